@@ -0,0 +1,113 @@
+"""
+A long-lived publisher for sending playback status to the message broker.
+"""
+
+import os
+import time
+
+from kombu import Connection
+
+import status_client
+
+AMQP_CONNECT_TIMEOUT = float(os.getenv('AMQP_CONNECT_TIMEOUT', '5'))  # seconds
+AMQP_RECONNECT_INTERVAL_START = float(os.getenv('AMQP_RECONNECT_INTERVAL_START', '1'))  # seconds
+AMQP_RECONNECT_INTERVAL_MAX = float(os.getenv('AMQP_RECONNECT_INTERVAL_MAX', '60'))  # seconds
+
+
+class PlaybackPublisher:  # pylint: disable=too-many-instance-attributes
+    """
+    Publishes playback status messages to the broker over a single connection
+    and channel that stay open between messages.
+
+    The exchange and queue are declared once per connection. If the link drops,
+    messages are dropped (a newer status will follow shortly) and the connection
+    is re-established with an exponential backoff, so the status loop is never
+    blocked waiting for the broker.
+    """
+
+    def __init__(self, url, exchange, routing_key, queue):
+        self.url = url
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.queue = queue
+        self.connection = None
+        self.producer = None
+        transport = Connection(url)
+        self.errors = (OSError, *transport.connection_errors, *transport.channel_errors)
+        self.reconnect_interval = AMQP_RECONNECT_INTERVAL_START
+        self.next_connect_attempt = 0
+        self.has_connected = False
+        self.reconnects = 0
+        self.published = 0
+        self.last_publish_latency = None
+
+    def connect(self):
+        """
+        Open the connection and channel, and declare the playback queue.
+        Returns True if the publisher is ready to publish.
+        """
+        if self.producer:
+            return True
+        if time.monotonic() < self.next_connect_attempt:
+            return False
+        try:
+            self.connection = Connection(self.url, connect_timeout=AMQP_CONNECT_TIMEOUT)
+            self.connection.connect()
+            channel = self.connection.channel()
+            self.queue(channel).declare()
+            self.producer = self.connection.Producer(
+                channel=channel,
+                exchange=self.exchange,
+                serializer='json',
+            )
+        except self.errors as exception:
+            print(f'Failed to connect to the message broker: {exception}, '
+                  f'retrying in {self.reconnect_interval} seconds.')
+            self.disconnect()
+            self.backoff()
+            return False
+
+        if self.has_connected:
+            self.reconnects += 1
+            status_client.AMQP_RECONNECT_COUNTER.inc()
+        self.has_connected = True
+        self.reconnect_interval = AMQP_RECONNECT_INTERVAL_START
+        return True
+
+    def backoff(self):
+        """
+        Schedule the next connection attempt, doubling the interval each time.
+        """
+        self.next_connect_attempt = time.monotonic() + self.reconnect_interval
+        self.reconnect_interval = min(self.reconnect_interval * 2, AMQP_RECONNECT_INTERVAL_MAX)
+
+    def disconnect(self):
+        """
+        Release the connection, ignoring errors from an already broken link.
+        """
+        self.producer = None
+        if self.connection:
+            try:
+                self.connection.release()
+            except self.errors:
+                pass
+        self.connection = None
+
+    def publish(self, message):
+        """
+        Publish a message on the open channel. Returns True if the message was sent.
+        """
+        if not self.connect():
+            return False
+        start = time.perf_counter()
+        try:
+            self.producer.publish(message, routing_key=self.routing_key)
+        except self.errors as exception:
+            print(f'Lost connection to the message broker: {exception}')
+            self.disconnect()
+            self.backoff()
+            return False
+        self.last_publish_latency = time.perf_counter() - start
+        status_client.AMQP_PUBLISH_LATENCY.observe(self.last_publish_latency)
+        self.published += 1
+        return True
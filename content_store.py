@@ -0,0 +1,204 @@
+"""
+A content-addressed store of resources, linked into the resources directory under
+the names VLC plays them by.
+"""
+
+import hashlib
+import os
+import re
+import time
+from urllib.parse import urlparse
+
+from downloader import CHECKSUM_ALGORITHMS, PARTIAL_SUFFIX, matches_checksum
+
+RESOURCE_STORE_PATH = os.getenv('RESOURCE_STORE_PATH', '/data/store/')
+# Partial downloads left in the store this long are given up on
+PARTIAL_MAX_AGE = 7 * 24 * 60 * 60  # seconds
+# The characters allowed in each part of a resource's key
+KEY_PART = re.compile('[a-z0-9]+')
+
+
+def resource_key(url, checksum=None):
+    """
+    Returns the key a resource is stored under: its checksum if XOS knows it, so the
+    same file under different names or URLs is only stored once, otherwise a hash
+    of its URL, e.g. 'sha256-9f86d08...' or 'url-3a7bd3e...'.
+    """
+    if checksum:
+        algorithm, _, digest = checksum.rpartition(':')
+        digest = digest.lower()
+        algorithm = algorithm.lower() or CHECKSUM_ALGORITHMS.get(len(digest))
+        # The key is used as a filename in the store and in peers' URLs
+        if (algorithm in hashlib.algorithms_available
+                and KEY_PART.fullmatch(algorithm) and KEY_PART.fullmatch(digest)):
+            return f'{algorithm}-{digest}'
+    return f'url-{hashlib.sha256(url.encode()).hexdigest()[:32]}'
+
+
+def name_subtitles(video_filename, subtitles_url):
+    """
+    Returns the filename of subtitles named after their video, so VLC finds them,
+    or None if there aren't any subtitles.
+    """
+    if not subtitles_url:
+        return None
+    filename = os.path.basename(urlparse(subtitles_url).path)
+    return video_filename[:video_filename.rfind('.')] + filename[filename.rfind('.'):]
+
+
+def disambiguate(filename, key):
+    """
+    Returns filename with part of key added before its extension.
+    """
+    stem, extension = os.path.splitext(filename)
+    return f'{stem}-{key.rpartition("-")[2][:12]}{extension}'
+
+
+class ContentStore:
+    """
+    Stores each resource once under its key, and hardlinks it into the resources
+    directory, which must be on the same filesystem, so a resource that's already
+    stored never needs downloading again. The manifest records the key of each
+    linked resource.
+
+    A stored resource is deleted once nothing in the resources directory links to it.
+    """
+
+    def __init__(self, manifest, directory=RESOURCE_STORE_PATH):
+        self.manifest = manifest
+        self.directory = directory
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        self.collect()
+
+    def path(self, key):
+        """
+        Returns the path a resource is stored at.
+        """
+        return os.path.join(self.directory, key)
+
+    def has(self, key):
+        """
+        Returns True if a resource is stored.
+        """
+        return os.path.isfile(self.path(key))
+
+    def key_of(self, local_path):
+        """
+        Returns the key recorded in the manifest for a linked resource, or None.
+        """
+        return (self.manifest.get(local_path) or {}).get('key')
+
+    def assign_filenames(self, resources, in_use=()):
+        """
+        Returns the filename to link each resource to, keyed by URL, from a list
+        of (url, key) in playlist order. Resources with the same filename from different
+        URLs get distinct filenames, as do ones whose filename is linked to another
+        resource that's in_use by the playing playlist.
+        """
+        filenames = {}
+        claimed = {}
+        for url, key in resources:
+            if url in filenames:
+                continue
+            filename = os.path.basename(urlparse(url).path)
+            linked_key = self.key_of(filename) if filename in in_use else None
+            if claimed.get(filename, key) != key or linked_key not in (None, key):
+                filename = disambiguate(filename, key)
+            claimed[filename] = key
+            filenames[url] = filename
+        return filenames
+
+    def link(self, key, local_path, checksum=None):
+        """
+        Link a stored resource into place at local_path and record it in the manifest.
+        """
+        temporary_path = f'{local_path}.link'
+        if os.path.lexists(temporary_path):
+            os.remove(temporary_path)
+        os.link(self.path(key), temporary_path)
+        os.replace(temporary_path, local_path)
+        self.manifest.record(local_path, checksum, key)
+
+    def make_available(self, local_path, checksum=None, url=None):
+        """
+        Returns True if the resource from url is at local_path, linking it into place
+        if it's stored already, or False if it needs downloading.
+        """
+        key = resource_key(url, checksum) if url else None
+        if self.manifest.is_valid(local_path, checksum):
+            linked_key = self.key_of(local_path)
+            if key is None or linked_key == key:
+                return True
+            if linked_key is None:
+                # Resources downloaded before the store existed are stored once
+                return self.ingest(key, local_path, checksum)
+        elif self.unverified(local_path, checksum):
+            # Resources cached before the manifest existed, or before XOS gave their
+            # checksum, are verified once and recorded
+            if key:
+                return self.ingest(key, local_path, checksum)
+            if matches_checksum(local_path, checksum):
+                self.manifest.record(local_path, checksum)
+                return True
+        if key and self.has(key):
+            self.link(key, local_path, checksum)
+            return True
+        return False
+
+    def unverified(self, local_path, checksum=None):
+        """
+        Returns True if there's a file at local_path that hasn't been verified against
+        checksum, because it isn't in the manifest or was recorded without a checksum.
+        """
+        entry = self.manifest.get(local_path)
+        if entry and (entry['checksum'] or not checksum):
+            return False
+        return os.path.isfile(local_path) and os.stat(local_path).st_size > 0
+
+    def ingest(self, key, local_path, checksum=None):
+        """
+        Store a resource that was downloaded before the store existed, once it's been
+        verified against its checksum, or link the stored copy in its place.
+        Returns False if it doesn't match its checksum, so it needs downloading.
+        """
+        if self.has(key):
+            self.link(key, local_path, checksum)
+            return True
+        if not matches_checksum(local_path, checksum):
+            print(f'{local_path} does not match its checksum {checksum}')
+            return False
+        os.link(local_path, self.path(key))
+        self.manifest.record(local_path, checksum, key)
+        return True
+
+    def release(self, key):
+        """
+        Delete a stored resource if nothing links to it any more.
+        """
+        if not key:
+            return
+        try:
+            if os.stat(self.path(key)).st_nlink <= 1:
+                print(f'Deleting stored resource {key}')
+                os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def collect(self):
+        """
+        Delete stored resources that nothing links to, and partial downloads that
+        were given up on.
+        """
+        now = time.time()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if entry.name.endswith(PARTIAL_SUFFIX):
+                    if now - stat.st_mtime > PARTIAL_MAX_AGE:
+                        os.remove(entry.path)
+                elif stat.st_nlink <= 1:
+                    print(f'Deleting unlinked stored resource {entry.name}')
+                    os.remove(entry.path)
@@ -0,0 +1,271 @@
+"""
+A download engine that fetches playlist resources in parallel over a pooled HTTP session.
+"""
+
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import status_client
+
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', '4'))
+DOWNLOAD_CHUNK_SIZE = int(os.getenv('DOWNLOAD_CHUNK_SIZE', str(1024 * 1024)))  # bytes
+DOWNLOAD_TIMEOUT = int(os.getenv('DOWNLOAD_TIMEOUT', '60'))  # seconds
+
+VERIFY_CHECKSUMS = os.getenv('VERIFY_CHECKSUMS', 'true') == 'true'
+
+# Suffix for partially downloaded files, which are resumed on the next attempt
+PARTIAL_SUFFIX = '.part'
+
+# Checksum algorithms, recognised by the length of their hex digest
+CHECKSUM_ALGORITHMS = {
+    32: 'md5',
+    40: 'sha1',
+    64: 'sha256',
+}
+
+
+class DownloadVerificationError(requests.exceptions.RequestException):
+    """
+    A downloaded file didn't match its expected size or checksum.
+    """
+
+
+def parse_checksum(checksum):
+    """
+    Returns the (algorithm, hex digest) of a checksum given as 'algorithm:digest',
+    or as a bare hex digest, in which case the algorithm is recognised by its length.
+    Returns None if checksum verification is disabled or the checksum isn't recognised.
+    """
+    if not checksum or not VERIFY_CHECKSUMS:
+        return None
+    algorithm, _, digest = checksum.rpartition(':')
+    digest = digest.lower()
+    algorithm = algorithm.lower() or CHECKSUM_ALGORITHMS.get(len(digest))
+    if algorithm not in hashlib.algorithms_available:
+        return None
+    return algorithm, digest
+
+
+def new_hash(checksum):
+    """
+    Returns a new hashlib object for the checksum's algorithm, or None.
+    """
+    parsed_checksum = parse_checksum(checksum)
+    if not parsed_checksum:
+        return None
+    return hashlib.new(parsed_checksum[0])
+
+
+def update_hash_from_file(file_hash, path):
+    """
+    Feed the contents of a file into a hashlib object.
+    """
+    with open(path, 'rb') as open_file:
+        for chunk in iter(lambda: open_file.read(DOWNLOAD_CHUNK_SIZE), b''):
+            file_hash.update(chunk)
+    return file_hash
+
+
+def checksum_of_file(path, checksum):
+    """
+    Returns a hashlib object of a file's contents using the checksum's algorithm, or None.
+    """
+    file_hash = new_hash(checksum)
+    if file_hash:
+        update_hash_from_file(file_hash, path)
+    return file_hash
+
+
+def matches_checksum(path, checksum):
+    """
+    Returns True if the file at path matches its checksum, or if there's no checksum
+    to verify it against.
+    """
+    file_hash = checksum_of_file(path, checksum)
+    return file_hash is None or file_hash.hexdigest() == parse_checksum(checksum)[1]
+
+
+def get_complete_size(response):
+    """
+    Returns the size of the complete file from a response's Content-Range header,
+    e.g. 'bytes 0-99/1000' or 'bytes */1000', or None if it doesn't say.
+    """
+    content_range = response.headers.get('Content-Range', '')
+    total = content_range.rsplit('/', 1)[1] if '/' in content_range else ''
+    return int(total) if total.isdigit() else None
+
+
+def get_expected_size(response, offset):
+    """
+    Returns the expected size of the complete file from the response headers,
+    or None if the server didn't say or the body is being decompressed.
+    """
+    if response.headers.get('Content-Encoding', 'identity') != 'identity':
+        return None
+    if response.status_code == 206 and '/' in response.headers.get('Content-Range', ''):
+        return get_complete_size(response)
+    content_length = response.headers.get('Content-Length', '')
+    return offset + int(content_length) if content_length.isdigit() else None
+
+
+class ResourceDownloader:
+    """
+    Downloads files with a bounded pool of worker threads sharing one requests.Session,
+    so connections to the same host are kept alive and reused between files.
+
+    Files are streamed into a partial file with large buffered writes and renamed into
+    place when complete. An interrupted transfer is resumed with an HTTP Range request.
+    """
+
+    def __init__(self, workers=DOWNLOAD_WORKERS, throttle=None):
+        # Limits the bandwidth of downloads, if given
+        self.throttle = throttle
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='download')
+        # Throughput of each completed download, keyed by filename
+        self.stats = {}
+
+    def submit(self, function, *args):
+        """
+        Run a function on the download worker pool, returning a Future.
+        """
+        return self.executor.submit(function, *args)
+
+    def download(self, url, local_path, checksum=None):
+        """
+        Download the file at url to local_path, resuming a partial download if there is one.
+
+        The file is only renamed into place once its size matches the Content-Length and,
+        if given, its checksum matches. Raises requests exceptions if the transfer fails.
+        """
+        partial_path = local_path + PARTIAL_SUFFIX
+        # Stored resources are named by their key, so report them by the URL's filename
+        filename = os.path.basename(urlparse(url).path)
+        offset = 0
+        if os.path.isfile(partial_path):
+            offset = os.path.getsize(partial_path)
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+
+        start = time.monotonic()
+        received = 0
+        with self.session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT, headers=headers) \
+                as response:
+            if offset and response.status_code == 416:
+                # Range not satisfiable, so the partial file is complete if it's the file's size
+                if get_complete_size(response) == offset:
+                    self.verify(
+                        partial_path, offset, checksum_of_file(partial_path, checksum), checksum,
+                    )
+                    self.commit(partial_path, local_path)
+                    return local_path
+                # Left from a different version of the file, so download it again
+                print(f'Discarding the partial download of {filename}, which doesn\'t match')
+                os.remove(partial_path)
+                return self.download(url, local_path, checksum)
+            response.raise_for_status()
+            if offset and response.status_code != 206:
+                # The server ignored the Range header and is sending the whole file
+                offset = 0
+            if offset:
+                print(f'Resuming download of {filename} from byte {offset}')
+            expected_size = get_expected_size(response, offset)
+            file_hash = new_hash(checksum)
+            if file_hash and offset:
+                update_hash_from_file(file_hash, partial_path)
+            with open(partial_path, 'ab' if offset else 'wb', buffering=DOWNLOAD_CHUNK_SIZE) \
+                    as open_file:
+                for chunk in self.iter_chunks(response):
+                    if chunk:  # filter out keep-alive new chunks
+                        open_file.write(chunk)
+                        received += len(chunk)
+                        status_client.DOWNLOAD_BYTES_COUNTER.inc(len(chunk))
+                        if self.throttle:
+                            self.throttle.consume(len(chunk))
+                        if file_hash:
+                            file_hash.update(chunk)
+                open_file.flush()
+                os.fsync(open_file.fileno())
+        self.verify(partial_path, expected_size, file_hash, checksum)
+        self.commit(partial_path, local_path)
+        self.report(filename, received, time.monotonic() - start)
+        return local_path
+
+    def chunk_size(self):
+        """
+        Returns the size of the chunks to read downloads in, smaller while they're throttled.
+        """
+        if self.throttle:
+            return self.throttle.chunk_size(DOWNLOAD_CHUNK_SIZE)
+        return DOWNLOAD_CHUNK_SIZE
+
+    def iter_chunks(self, response):
+        """
+        Yields the body of a streamed response in chunks, iterating over the rest of it
+        in chunks of the new size when the throttle changes it.
+        """
+        chunk_size = self.chunk_size()
+        while True:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                yield chunk
+                if self.chunk_size() != chunk_size:
+                    chunk_size = self.chunk_size()
+                    break
+            else:
+                return
+
+    @staticmethod
+    def verify(partial_path, expected_size, file_hash, checksum):
+        """
+        Check a downloaded partial file against its expected size and checksum.
+        A file that's too short is kept to be resumed, a corrupt file is deleted.
+        """
+        size = os.path.getsize(partial_path)
+        if expected_size is not None and size != expected_size:
+            if size > expected_size:
+                os.remove(partial_path)
+            raise DownloadVerificationError(
+                f'{os.path.basename(partial_path)} is {size} bytes, expected {expected_size}'
+            )
+        if file_hash and file_hash.hexdigest() != parse_checksum(checksum)[1]:
+            os.remove(partial_path)
+            raise DownloadVerificationError(
+                f'{os.path.basename(partial_path)} checksum {file_hash.hexdigest()} '
+                f'does not match {checksum}'
+            )
+
+    @staticmethod
+    def commit(partial_path, local_path):
+        """
+        Atomically rename a verified partial file into place and sync the directory entry.
+        """
+        os.replace(partial_path, local_path)
+        directory = os.open(os.path.dirname(local_path) or '.', os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def report(self, filename, received, seconds):
+        """
+        Record and print the throughput of a completed download.
+        """
+        throughput = received / seconds if seconds > 0 else 0
+        self.stats[filename] = {
+            'bytes': received,
+            'seconds': seconds,
+            'throughput': throughput,
+        }
+        status_client.DOWNLOAD_THROUGHPUT_GAUGE.labels(filename=filename).set(throughput)
+        print(
+            f'Downloaded {filename}: {received / 1024 / 1024:.1f} MB in {seconds:.1f} s '
+            f'({throughput / 1024 / 1024:.2f} MB/s)'
+        )
@@ -0,0 +1,38 @@
+"""
+Loads and atomically saves the JSON files the media player keeps its state in.
+"""
+
+import json
+import os
+
+
+def load(path, description):
+    """
+    Returns the dictionary saved at path, or an empty one if there isn't one
+    or it can't be read.
+    """
+    try:
+        with open(path, encoding='utf-8') as json_file:
+            data = json.load(json_file)
+        if isinstance(data, dict):
+            return data
+    except FileNotFoundError:
+        pass
+    except ValueError as exception:
+        print(f'Ignoring unreadable {description} {path}: {exception}')
+    return {}
+
+
+def save(path, data):
+    """
+    Atomically write data to path as JSON, so a crash never leaves it half written.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as outfile:
+        json.dump(data, outfile)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(temporary_path, path)
@@ -0,0 +1,111 @@
+"""
+A persisted manifest of verified resources in the resource cache.
+"""
+
+import os
+import threading
+import time
+
+import json_file
+
+RESOURCE_MANIFEST_JSON = os.getenv('RESOURCE_MANIFEST_JSON', '/data/resource_manifest.json')
+
+
+class ResourceManifest:
+    """
+    Records the size, checksum and modification time of each resource when it's
+    downloaded and verified, so at startup a cached file can be validated with a
+    stat() and a dictionary lookup rather than being re-downloaded or parsed.
+
+    Entries are keyed by filename in the resources directory, and also record when
+    the resource was last used by a playlist, for evicting the least recently used.
+    """
+
+    def __init__(self, path=RESOURCE_MANIFEST_JSON):
+        self.path = path
+        self.lock = threading.RLock()
+        self.entries = self.load()
+
+    def load(self):
+        """
+        Load the manifest from disk, or start an empty one.
+        """
+        return json_file.load(self.path, 'resource manifest')
+
+    def save(self):
+        """
+        Atomically write the manifest to disk.
+        """
+        with self.lock:
+            json_file.save(self.path, self.entries)
+
+    def record(self, local_path, checksum=None, key=None):
+        """
+        Record a verified resource at local_path, and the key it's stored under.
+        """
+        stat = os.stat(local_path)
+        with self.lock:
+            self.entries[os.path.basename(local_path)] = {
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+                'checksum': checksum,
+                'key': key,
+                'last_used': time.time(),
+            }
+            self.save()
+
+    def touch(self, filenames, last_used=None):
+        """
+        Record that the resources with these filenames were used by a playlist.
+        """
+        if last_used is None:
+            last_used = time.time()
+        with self.lock:
+            touched = False
+            for filename in filenames:
+                entry = self.entries.get(filename)
+                if entry:
+                    entry['last_used'] = last_used
+                    touched = True
+            if touched:
+                self.save()
+
+    def remove(self, filename):
+        """
+        Remove the entry for a deleted resource.
+        """
+        with self.lock:
+            if self.entries.pop(filename, None) is not None:
+                self.save()
+
+    def get(self, local_path):
+        """
+        Returns a copy of the entry for the resource at local_path, or None.
+        """
+        with self.lock:
+            entry = self.entries.get(os.path.basename(local_path))
+            return dict(entry) if entry else None
+
+    def __contains__(self, local_path):
+        with self.lock:
+            return os.path.basename(local_path) in self.entries
+
+    def is_valid(self, local_path, checksum=None):
+        """
+        Returns True if the file at local_path is the one recorded in the manifest,
+        and, if a checksum is given, that it was verified against the same checksum.
+        """
+        with self.lock:
+            entry = self.entries.get(os.path.basename(local_path))
+        if not entry:
+            return False
+        try:
+            stat = os.stat(local_path)
+        except FileNotFoundError:
+            return False
+        if stat.st_size != entry['size'] or stat.st_mtime_ns != entry['mtime']:
+            return False
+        if checksum and (not entry['checksum'] or checksum.lower() != entry['checksum'].lower()):
+            # Recorded before its checksum was known, so it hasn't been verified
+            return False
+        return True
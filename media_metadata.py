@@ -0,0 +1,154 @@
+"""
+A persistent cache of the metadata VLC parses from each resource.
+"""
+
+import os
+import threading
+import time
+
+import vlc
+
+import json_file
+import status_client
+
+MEDIA_METADATA_JSON = os.getenv('MEDIA_METADATA_JSON', '/data/media_metadata.json')
+MEDIA_PARSE_TIMEOUT = int(os.getenv('MEDIA_PARSE_TIMEOUT', '10000'))  # milliseconds
+# How often to check whether an asynchronous parse has finished
+MEDIA_PARSE_POLL_INTERVAL = 0.05  # seconds
+
+
+@status_client.timed('media_parse')
+def parse_media(media, timeout=MEDIA_PARSE_TIMEOUT):
+    """
+    Parse a vlc.Media with libvlc's asynchronous parser and wait for it to finish,
+    so several resources can be parsed at once from different threads.
+    Returns a dictionary of the media's duration, tracks, whether it's playable
+    and whether the parse was conclusive.
+
+    The parsed status is polled rather than waiting for MediaParsedChanged, as python-vlc
+    only keeps one callback per event type on each media's event manager, and a parse
+    shouldn't replace a callback something else has attached to the same media.
+    """
+    if media.parse_with_options(vlc.MediaParseFlag.local, timeout) == 0:
+        deadline = time.monotonic() + timeout / 1000 + 1
+        while not media.get_parsed_status() and time.monotonic() < deadline:
+            time.sleep(MEDIA_PARSE_POLL_INTERVAL)
+
+    duration = media.get_duration()
+    status = media.get_parsed_status()
+    tracks = []
+    if status == vlc.MediaParsedStatus.done:
+        for track in media.tracks_get() or []:
+            tracks.append({
+                'type': str(track.type),
+                'codec': track.codec,
+            })
+    return {
+        'duration': duration,
+        'tracks': tracks,
+        # A parse that timed out isn't conclusive, so only rule out media with no duration
+        'playable': duration > 0 if status == vlc.MediaParsedStatus.done else duration != 0,
+        'parsed': status in (vlc.MediaParsedStatus.done, vlc.MediaParsedStatus.failed),
+    }
+
+
+class MediaMetadataCache:
+    """
+    Stores the parsed metadata of each resource keyed on its path, size and modification
+    time, so unchanged files don't need to be parsed by VLC again after a restart.
+    """
+
+    def __init__(self, path=MEDIA_METADATA_JSON):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = self.load()
+
+    def load(self):
+        """
+        Load the cache from disk, or start an empty one.
+        """
+        return json_file.load(self.path, 'media metadata cache')
+
+    def save(self):
+        """
+        Atomically write the cache to disk.
+        """
+        json_file.save(self.path, self.entries)
+
+    def get(self, local_path):
+        """
+        Returns the cached metadata for the file at local_path, or None if it
+        isn't cached or the file has changed since it was parsed.
+        """
+        with self.lock:
+            entry = self.entries.get(local_path)
+        if not entry:
+            return None
+        try:
+            stat = os.stat(local_path)
+        except FileNotFoundError:
+            return None
+        if stat.st_size != entry['size'] or stat.st_mtime_ns != entry['mtime']:
+            return None
+        return entry
+
+    def set(self, local_path, metadata):
+        """
+        Cache the parsed metadata for the file at local_path.
+        """
+        stat = os.stat(local_path)
+        entry = dict(metadata, size=stat.st_size, mtime=stat.st_mtime_ns)
+        with self.lock:
+            self.entries[local_path] = entry
+            self.save()
+        return entry
+
+
+class MediaLibrary:
+    """
+    Loads the vlc.Media for local resources. Media that's already loaded is reused,
+    and unchanged files are recognised from the metadata cache rather than parsed.
+    """
+
+    def __init__(self, instance, metadata=None):
+        self.instance = instance
+        self.metadata = metadata or MediaMetadataCache()
+        self.lock = threading.Lock()
+        # Loaded vlc.Media keyed by resource path
+        self.media = {}
+
+    def load(self, local_path):
+        """
+        Returns the vlc.Media for the file at local_path, or None if it isn't playable.
+        """
+        with self.lock:
+            media = self.media.get(local_path)
+        if media:
+            return media
+        media = self.instance.media_new(local_path)
+        metadata = self.metadata.get(local_path)
+        if metadata is None:
+            metadata = parse_media(media)
+            if metadata['parsed']:
+                self.metadata.set(local_path, metadata)
+        if not metadata['playable']:
+            return None
+        with self.lock:
+            return self.media.setdefault(local_path, media)
+
+    def forget(self, local_path):
+        """
+        Forget the media loaded from a file that's been replaced.
+        """
+        with self.lock:
+            self.media.pop(local_path, None)
+
+    def retain(self, local_paths):
+        """
+        Forget the media of every file other than local_paths.
+        """
+        with self.lock:
+            self.media = {
+                local_path: media for local_path, media in self.media.items()
+                if local_path in local_paths
+            }
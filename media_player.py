@@ -3,20 +3,32 @@ import os
 import re
 import subprocess
 import time
-from datetime import datetime
 from threading import Thread
 from urllib.parse import urlparse
 
-import alsaaudio
 import pytz
 import requests
 import sentry_sdk
 import vlc
-from kombu import Connection
 from kombu.entity import Exchange, Queue
 
+import json_file
 import network
 import status_client
+from broker import PlaybackPublisher
+from content_store import ContentStore, name_subtitles, resource_key
+from downloader import DownloadVerificationError, ResourceDownloader
+from manifest import ResourceManifest
+from media_metadata import MediaLibrary
+from peers import PEER_SHARING, PEERS, Peers, peer_hosts, start_peer_server
+from playback_clock import PlaybackClock
+from playlist_watcher import PlaylistWatcher, playlist_version
+from prefetch import PREFETCH_INTERVAL, Prefetcher
+from resource_cache import ResourceCache
+from scheduler import Scheduler, only_while
+from status_sampler import STATUS_SAMPLE_INTERVAL, StatusSampler
+from sync import SYNC_BEACON_INTERVAL, BeaconScheduler, DriftController
+from throttle import DOWNLOAD_THROTTLE_INTERVAL, DownloadThrottle
 
 XOS_API_ENDPOINT = os.getenv('XOS_API_ENDPOINT')
 XOS_PLAYLIST_ENDPOINT = f'{XOS_API_ENDPOINT}playlists/'
@@ -25,7 +37,8 @@ XOS_MEDIA_PLAYER_ID = os.getenv('XOS_MEDIA_PLAYER_ID', '1')
 AUDIO_DEVICE_REGEX = re.compile(os.getenv('AUDIO_DEVICE_REGEX', ''), flags=re.IGNORECASE)
 DOWNLOAD_RETRIES = int(os.getenv('DOWNLOAD_RETRIES', '3'))
 AMQP_URL = os.getenv('AMQP_URL')
-TIME_BETWEEN_PLAYBACK_STATUS = os.getenv('TIME_BETWEEN_PLAYBACK_STATUS', '0.1')
+TIME_BETWEEN_PLAYBACK_STATUS = float(os.getenv('TIME_BETWEEN_PLAYBACK_STATUS', '0.1'))
+PROMETHEUS_UPDATE_INTERVAL = float(os.getenv('PROMETHEUS_UPDATE_INTERVAL', '1'))  # seconds
 DEVICE_NAME = os.getenv('BALENA_DEVICE_NAME_AT_INIT', f'mp-{XOS_MEDIA_PLAYER_ID}')
 DEVICE_UUID = os.getenv('BALENA_DEVICE_UUID', XOS_MEDIA_PLAYER_ID)
 BALENA_APP_ID = os.getenv('BALENA_APP_ID')
@@ -41,12 +54,18 @@ VLC_CONNECTION_RETRIES = int(os.getenv('VLC_CONNECTION_RETRIES', '3'))
 SYNC_CLIENT_TO = os.getenv('SYNC_CLIENT_TO')
 SYNC_IS_SERVER = os.getenv('SYNC_IS_SERVER', 'false') == 'true'
 SYNC_DRIFT_THRESHOLD = os.getenv('SYNC_DRIFT_THRESHOLD', '40')  # threshold in milliseconds
-SYNC_LATENCY = os.getenv('SYNC_LATENCY', '30')  # latency to sync a client in milliseconds
+SYNC_LATENCY = os.getenv('SYNC_LATENCY', '30')  # time a client takes to seek in milliseconds
+SYNC_SEEK_THRESHOLD = int(os.getenv('SYNC_SEEK_THRESHOLD', '1000'))  # threshold in milliseconds
 SYNC_IGNORE_THRESHOLD = os.getenv('SYNC_IGNORE_THRESHOLD', '2000')  # threshold in milliseconds
 IS_SYNCED_PLAYER = SYNC_CLIENT_TO or SYNC_IS_SERVER
+SYNC_TRANSPORT = os.getenv('SYNC_TRANSPORT', 'tcp')  # options: 'tcp', 'multicast', 'broadcast'
+SYNC_MULTICAST_GROUP = os.getenv('SYNC_MULTICAST_GROUP', '239.255.77.80')
+SYNC_PORT = int(os.getenv('SYNC_PORT', '10000'))
 DEBUG = os.getenv('DEBUG', 'false') == 'true'
 SCREEN_WIDTH = os.getenv('SCREEN_WIDTH')
 SCREEN_HEIGHT = os.getenv('SCREEN_HEIGHT')
+PROGRESSIVE_PLAYLIST = os.getenv('PROGRESSIVE_PLAYLIST', 'true') == 'true'
+CLOCK_POLL_INTERVAL = float(os.getenv('CLOCK_POLL_INTERVAL', '0.25'))  # seconds
 
 # Setup Sentry
 sentry_sdk.init(SENTRY_ID)
@@ -64,12 +83,14 @@ RESOURCES_PATH = '/data/resources/'
 
 # Cached playlist name
 CACHED_PLAYLIST_JSON = '/data/cached_playlist.json'
+# ETag and Last-Modified validators of the cached playlist
+CACHED_PLAYLIST_VALIDATORS_JSON = '/data/cached_playlist_validators.json'
 
 # Parse the output of `aplay -l`
 APLAY_REGEX = re.compile(r'card (?P<card_id>\d+): (.+), device (?P<device_id>\d+): (.+)')
 
 
-class MediaPlayer():  # pylint: disable=too-many-branches,too-many-instance-attributes
+class MediaPlayer():  # pylint: disable=too-many-branches,too-many-instance-attributes,too-many-public-methods
     """
     A media player that communicates with XOS to download resources
     and update the message broker with its playback status.
@@ -77,6 +98,12 @@ class MediaPlayer():  # pylint: disable=too-many-branches,too-many-instance-attr
 
     def __init__(self):
         self.playlist = []
+        # Identifies the playlist to synced players, see playlist_watcher.playlist_version
+        self.playlist_version = 0
+        # Adds the rest of a progressively loaded playlist, see load_playlist
+        self.add_thread = None
+        # Swaps in playlist changes, see schedule_tasks
+        self.playlist_watcher = None
         self.vlc = {
             'instance': None,
             'player': None,
@@ -84,12 +111,45 @@ class MediaPlayer():  # pylint: disable=too-many-branches,too-many-instance-attr
             'playlist': None,
         }
         self.init_vlc()
-
-        # Variables used to interpolate the play time in get_current_time.
-        # Holds the last time reported by VLC.
-        self.last_vlc_time = 0
-        # Holds the last clock time when VLC was asked for play time.
-        self.time_at_last_poll = 0
+        # Runs the periodic tasks, see schedule_tasks
+        self.scheduler = Scheduler()
+        # Limits the bandwidth of downloads while playing, see schedule_tasks
+        self.throttle = DownloadThrottle(self, PYTZ_TIMEZONE)
+        self.downloader = ResourceDownloader(throttle=self.throttle)
+        # Other players on the local network to fetch resources from before the origin
+        self.peers = Peers(self.downloader, peer_hosts(PEERS, SYNC_CLIENT_TO))
+        self.manifest = ResourceManifest()
+        # Stores each resource once, linked into RESOURCES_PATH by the filenames assigned
+        # to the playlist's resource URLs
+        self.store = ContentStore(self.manifest)
+        self.filenames = {}
+        # Keeps the resources of recent playlists within a disk budget
+        self.cache = ResourceCache(self.manifest, RESOURCES_PATH, store=self.store)
+        # Loads vlc.Media, reusing loaded media and cached metadata
+        self.media_library = MediaLibrary(self.vlc['instance'])
+
+        # Interpolates the play time in get_current_time from VLC's time-changed events
+        self.clock = PlaybackClock()
+        self.clock.attach(self.vlc['player'])
+
+        # Samples the playback status for the Prometheus exporter and message broker
+        self.sampler = StatusSampler(self, XOS_PLAYLIST_ID, XOS_MEDIA_PLAYER_ID, PYTZ_TIMEZONE)
+        status_client.STATUS_COLLECTOR.watch(self.sampler.latest)
+        # Warms the next playlist item in the page cache before the current one ends
+        self.prefetcher = Prefetcher(self)
+        self.playlist_position = -1
+        self.vlc_connection_attempts = 0
+        self.next_prometheus_update = self.next_broker_update = 0
+
+        # Long-lived connection to the message broker for playback status
+        self.publisher = None
+        if AMQP_URL:
+            self.publisher = PlaybackPublisher(
+                AMQP_URL,
+                MEDIA_PLAYER_EXCHANGE,
+                ROUTING_KEY,
+                PLAYBACK_QUEUE,
+            )
 
         if IS_SYNCED_PLAYER:
             self.setup_sync()
@@ -134,10 +194,30 @@ class MediaPlayer():  # pylint: disable=too-many-branches,too-many-instance-attr
         Initialises variables and network objects needed to sync players.
         """
         if SYNC_IS_SERVER:
-            self.server = network.Server('', port=10000)
+            self.beacons = BeaconScheduler(self, lambda: self.scheduler.trigger('sync_beacon'))
+            if SYNC_TRANSPORT == 'tcp':
+                self.server = network.Server('', port=SYNC_PORT)
+            else:
+                self.server = network.MulticastServer(
+                    SYNC_MULTICAST_GROUP,
+                    port=SYNC_PORT,
+                    broadcast=SYNC_TRANSPORT == 'broadcast',
+                )
 
         if SYNC_CLIENT_TO:
-            self.client = network.Client(SYNC_CLIENT_TO, port=10000)
+            client = getattr(self, 'client', None)
+            if client:
+                client.close()
+            self.drift = DriftController(self, int(SYNC_DRIFT_THRESHOLD))
+            if SYNC_TRANSPORT == 'tcp':
+                self.client = network.Client(SYNC_CLIENT_TO, port=SYNC_PORT)
+            else:
+                self.client = network.MulticastClient(
+                    SYNC_CLIENT_TO,
+                    port=SYNC_PORT,
+                    group=SYNC_MULTICAST_GROUP,
+                    broadcast=SYNC_TRANSPORT == 'broadcast',
+                )
 
     @staticmethod
     def print_debug(message):
@@ -147,14 +227,6 @@ class MediaPlayer():  # pylint: disable=too-many-branches,too-many-instance-attr
         if DEBUG:
             print(message)
 
-    @staticmethod
-    def datetime_now():
-        """
-        Return a string representation of the current datetime with the
-        timezone setting in an ISO 8601 format.
-        """
-        return datetime.now(PYTZ_TIMEZONE).isoformat()
-
     @staticmethod
     def get_audio_flags():
         """
@@ -201,105 +273,62 @@ class MediaPlayer():  # pylint: disable=too-many-branches,too-many-instance-attr
 
     def get_media_player_status(self):
         """
-        Compile the media player status into a dictionary.
+        Sample the media player status into a dictionary.
         """
-        media = self.vlc['player'].get_media()
-        if media:
-            stats = vlc.MediaStats()
-            media.get_stats(stats)
-            playlist_position = self.vlc['playlist'].index_of_item(media)
-            try:
-                label_id = self.playlist[playlist_position]['label']['id']
-            except TypeError:
-                # No label ID for this playlist item
-                label_id = None
-            try:
-                system_volume = str(alsaaudio.Mixer(alsaaudio.mixers()[0]).getvolume()[0] / 10)
-            except (alsaaudio.ALSAAudioError, IndexError):
-                system_volume = 0
-            media_player_status = {
-                'datetime': self.datetime_now(),
-                'playlist_id': int(XOS_PLAYLIST_ID),
-                'media_player_id': int(XOS_MEDIA_PLAYER_ID),
-                'label_id': label_id,
-                'playlist_position': playlist_position,
-                'playback_position': self.vlc['player'].get_position(),
-                'dropped_audio_frames': stats.lost_abuffers,
-                'dropped_video_frames': stats.lost_pictures,
-                'duration': self.vlc['player'].get_length(),
-                'player_volume': \
-                # Player value 0-256
-                str(self.vlc['player'].audio_get_volume() / 256 * 10),
-                'system_volume': \
-                # System value 0-100
-                system_volume,
-            }
-        else:
-            # playlist is empty
-            message = f'No playable items in playlist {int(XOS_PLAYLIST_ID)} '\
-                      f'on mediaplayer {int(XOS_MEDIA_PLAYER_ID)}'
-            media_player_status = {
-                'error': message,
-            }
-        return media_player_status
+        return self.sampler.sample()
 
-    def post_playback_to_broker(self):  # pylint: disable=R0914
+    def post_playback_to_broker(self):
         """
-        Sends current playback and player information to media broker and Prometheus
-        exporter.
+        Sends the latest playback and player information to the Prometheus exporter
+        if PROMETHEUS_UPDATE_INTERVAL seconds have passed since it was last sent, and to
+        the media broker if TIME_BETWEEN_PLAYBACK_STATUS seconds have. The playback gauges
+        are read from the latest sample when Prometheus scrapes.
         """
-        playlist_position = -1
-        vlc_connection_attempts = 0
-        while True:
-            try:
-                media_player_status = self.get_media_player_status()
-
-                if media_player_status['playlist_position'] != playlist_position:
-                    playlist_position = media_player_status['playlist_position']
-                    print(f'Playing video {playlist_position}: '
-                          f'{self.playlist[playlist_position]["resource"]}')
-
-                status_client.set_status(
-                    DEVICE_UUID,
-                    DEVICE_NAME,
-                    str(os.path.basename(
-                        urlparse(self.playlist[playlist_position]['resource']).path
-                    )),
-                    media_player_status,
-                )
+        now = time.monotonic()
+        try:
+            media_player_status = self.sampler.latest()
+
+            if media_player_status['playlist_position'] != self.playlist_position:
+                self.playlist_position = media_player_status['playlist_position']
+                print(f'Playing video {self.playlist_position}: '
+                      f'{self.playlist[self.playlist_position]["resource"]}')
+
+            if now >= self.next_prometheus_update:
+                self.next_prometheus_update = now + PROMETHEUS_UPDATE_INTERVAL
+                with status_client.timed('prometheus_update'):
+                    status_client.set_status(
+                        DEVICE_UUID,
+                        DEVICE_NAME,
+                        str(os.path.basename(
+                            urlparse(self.playlist[self.playlist_position]['resource']).path
+                        )),
+                        media_player_status,
+                    )
+
+            # Publish to XOS broker
+            if self.publisher and now >= self.next_broker_update:
+                self.next_broker_update = now + TIME_BETWEEN_PLAYBACK_STATUS
+                self.publisher.publish(media_player_status)
 
-                # Publish to XOS broker
-                if AMQP_URL:
-                    with Connection(AMQP_URL) as conn:
-                        producer = conn.Producer(serializer='json')
-                        producer.publish(
-                            media_player_status,
-                            exchange=MEDIA_PLAYER_EXCHANGE,
-                            routing_key=ROUTING_KEY,
-                            declare=[PLAYBACK_QUEUE],
-                        )
-
-            except KeyError as error:
-                vlc_connection_attempts += 1
-                template = 'An exception of type {0} occurred. Arguments:\n{1!r}'
-                message = template.format(type(error).__name__, error.args)
-                if vlc_connection_attempts < VLC_CONNECTION_RETRIES:
-                    print(message)
-                    print(f'Current vlc_status: {media_player_status}')
-                elif vlc_connection_attempts == VLC_CONNECTION_RETRIES:
-                    print(f'Tried {VLC_CONNECTION_RETRIES} times. '
-                          f'Giving up and posting error to Sentry...')
-                    sentry_sdk.capture_exception(error)
-
-            except (TimeoutError, ValueError) as error:
-                template = 'An exception of type {0} occurred. Arguments:\n{1!r}'
-                message = template.format(type(error).__name__, error.args)
+        except (KeyError, IndexError) as error:
+            self.vlc_connection_attempts += 1
+            template = 'An exception of type {0} occurred. Arguments:\n{1!r}'
+            message = template.format(type(error).__name__, error.args)
+            if self.vlc_connection_attempts < VLC_CONNECTION_RETRIES:
                 print(message)
+                print(f'Current vlc_status: {media_player_status}')
+            elif self.vlc_connection_attempts == VLC_CONNECTION_RETRIES:
+                print(f'Tried {VLC_CONNECTION_RETRIES} times. '
+                      f'Giving up and posting error to Sentry...')
                 sentry_sdk.capture_exception(error)
 
-                self.restart_app_container()
+        except (TimeoutError, ValueError) as error:
+            template = 'An exception of type {0} occurred. Arguments:\n{1!r}'
+            message = template.format(type(error).__name__, error.args)
+            print(message)
+            sentry_sdk.capture_exception(error)
 
-            time.sleep(float(TIME_BETWEEN_PLAYBACK_STATUS))
+            self.restart_app_container()
 
     @staticmethod
     def restart_app_container():
@@ -324,131 +353,125 @@ class MediaPlayer():  # pylint: disable=too-many-branches,too-many-instance-attr
             print(message)
             sentry_sdk.capture_exception(exception)
 
-    @staticmethod
-    def delete_unneeded_resources(playlist):
+    def delete_unneeded_resources(self, playlist):
         """
-        Deletes unneeded resources from old playlists.
+        Deletes unneeded resources from old playlists once they no longer fit
+        in the resource cache.
         """
-        # Make the resources directory if it doesn't exist
-        if not os.path.exists(RESOURCES_PATH):
-            os.makedirs(RESOURCES_PATH)
+        return self.cache.retain([
+            dict(item, resource=self.filenames.get(item.get('resource'), item.get('resource')))
+            for item in playlist
+        ])
 
-        resources_on_filesystem = []
-        for item in os.listdir(RESOURCES_PATH):
-            if os.path.isfile(os.path.join(RESOURCES_PATH, item)):
-                resources_on_filesystem.append(item)
+    def resource_needs_downloading(self, resource_path, checksum=None, url=None):
+        """
+        Checks whether the resource exists and matches its entry in the resource manifest,
+        linking it into place from the content store if it's stored already.
+        """
+        return not self.store.make_available(resource_path, checksum, url)
 
-        resources_from_playlist = []
-        for item in playlist:
-            try:
-                resource = urlparse(item.get('resource')).path.split('/')[-1]
-            except TypeError:
-                resource = None
-            if resource:
-                resources_from_playlist.append(resource)
-            try:
-                subtitles = urlparse(item.get('subtitles')).path.split('/')[-1]
-                _subtitles_filename = os.path.basename(subtitles)
-                subtitles_filename = (
-                    resource[:resource.rfind('.')]
-                    + _subtitles_filename[_subtitles_filename.rfind('.'):]
-                )
-            except TypeError:
-                subtitles = None
-            if subtitles:
-                resources_from_playlist.append(subtitles_filename)
-
-        unneeded_files = list(set(resources_on_filesystem) - set(resources_from_playlist))
-        for item in unneeded_files:
-            file_to_delete = os.path.join(RESOURCES_PATH, item)
-            print(f'Deleting unneeded media file: {file_to_delete}')
-            os.remove(file_to_delete)
-        return unneeded_files
+    def assign_filenames(self, playlist_labels):
+        """
+        Assigns the filenames a playlist's resources are linked to, so resources with the
+        same filename from different URLs don't overwrite each other.
+        """
+        resources = [
+            (label['resource'], resource_key(label['resource'], self.get_resource_checksum(label)))
+            for label in playlist_labels if label.get('resource')
+        ]
+        self.filenames = self.store.assign_filenames(resources, in_use=self.cache.pinned)
+
+    def local_filenames(self, playlist_label):
+        """
+        Returns the filenames a playlist label's resource and subtitles are linked to, with
+        the subtitles named after the resource so VLC finds them, or None if there aren't any.
+        """
+        resource_url = playlist_label.get('resource')
+        if not resource_url:
+            return None, None
+        video_filename = self.filenames.get(resource_url) or \
+            os.path.basename(urlparse(resource_url).path)
+        return video_filename, name_subtitles(video_filename, playlist_label.get('subtitles'))
 
     @staticmethod
-    def resource_needs_downloading(resource_path):
+    def get_resource_checksum(playlist_label):
         """
-        Checks whether the resource exists.
+        Returns the checksum of a playlist label's resource from the XOS playlist, if known.
         """
-        return (not os.path.isfile(resource_path)) \
-            or (os.path.isfile(resource_path)
-                and not os.stat(resource_path).st_size > 0)
+        if playlist_label.get('resource_checksum'):
+            return playlist_label['resource_checksum']
+        video = playlist_label.get('video') or {}
+        if video.get('web_resource') and video['web_resource'] == playlist_label.get('resource'):
+            return (video.get('web_metadata') or {}).get('checksum')
+        return None
 
     def download_resources(self, playlist_label):
         """
-        Downloads the resources for the specified playlist label.
+        Downloads the resources for the specified playlist label that aren't stored already.
         """
+        resource_url = playlist_label.get('resource')
+        subtitles_url = playlist_label.get('subtitles')
         try:
-            resource_url = playlist_label.get('resource')
-            video_filename = os.path.basename(urlparse(resource_url).path)
-            local_video_path = RESOURCES_PATH + video_filename
-
-            if resource_url and self.resource_needs_downloading(local_video_path):
-                print(f'{video_filename} not available locally, attempting to download it now.')
-                self.download_file(resource_url)
-
-        except TypeError:
-            pass
-
-        try:
-            subtitles_url = playlist_label.get('subtitles')
-            # Modify the subtitles filename to match the video filename (for VLC)
-            _subtitles_filename = os.path.basename(urlparse(subtitles_url).path)
-            subtitles_filename = (
-                video_filename[:video_filename.rfind('.')]
-                + _subtitles_filename[_subtitles_filename.rfind('.'):]
-            )
-
+            video_filename, subtitles_filename = self.local_filenames(playlist_label)
+        except (AttributeError, TypeError):
+            return None
+        if not video_filename:
+            return None
+
+        local_video_path = RESOURCES_PATH + video_filename
+        video_checksum = self.get_resource_checksum(playlist_label)
+        if self.resource_needs_downloading(local_video_path, video_checksum, resource_url):
+            print(f'{video_filename} not available locally, attempting to download it now.')
+            self.download_file(resource_url, video_filename, video_checksum)
+
+        if subtitles_filename:
             local_subtitles_path = RESOURCES_PATH + subtitles_filename
-
-            if subtitles_url and self.resource_needs_downloading(local_subtitles_path):
-                self.download_file(subtitles_url, subtitles_filename)
-
-        except TypeError:
-            pass
+            subtitles_checksum = playlist_label.get('subtitles_checksum')
+            if self.resource_needs_downloading(
+                    local_subtitles_path, subtitles_checksum, subtitles_url,
+            ):
+                self.download_file(subtitles_url, subtitles_filename, subtitles_checksum)
 
         # If the video is available locally, add it to the playlist to be played
-        if resource_url and os.path.isfile(local_video_path):
+        if os.path.isfile(local_video_path):
             # An array of dicts that has the label_id, resource & subtitles
             item_dictionary = {
                 'label': playlist_label['label'],
                 'resource': local_video_path,
             }
 
-            if subtitles_url and os.path.isfile(local_subtitles_path):
+            if subtitles_filename and os.path.isfile(local_subtitles_path):
                 item_dictionary['subtitles'] = local_subtitles_path
 
             return item_dictionary
         return None
 
-    @staticmethod
-    def download_file(url, filename=None):
+    @status_client.timed('download_file')
+    def download_file(self, url, filename=None, checksum=None):
         """
-        Downloads the file at the specified URL.
+        Downloads the file at the specified URL into the content store, from a peer on the
+        local network if one has it, resuming a partial download if possible, and links it
+        into place once it's been verified.
         """
+        if filename:
+            local_filename = filename
+        else:
+            local_filename = urlparse(url).path.split('/')[-1]
+
+        # Make the resources directory if it doesn't exist
+        if not os.path.exists(RESOURCES_PATH):
+            os.makedirs(RESOURCES_PATH)
+
+        key = resource_key(url, checksum)
         for _ in range(DOWNLOAD_RETRIES):
             try:
-                if filename:
-                    local_filename = filename
-                else:
-                    local_filename = urlparse(url).path.split('/')[-1]
-
-                # Make the resources directory if it doesn't exist
-                if not os.path.exists(RESOURCES_PATH):
-                    os.makedirs(RESOURCES_PATH)
-
-                with requests.get(url, stream=True, timeout=60) as response:
-                    response.raise_for_status()
-                    with open(RESOURCES_PATH + local_filename, 'wb') as open_file:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            if chunk:  # filter out keep-alive new chunks
-                                open_file.write(chunk)
-                                # open_file.flush()
+                if not self.peers.fetch(key, self.store.path(key), checksum):
+                    self.downloader.download(url, self.store.path(key), checksum)
+                self.store.link(key, RESOURCES_PATH + local_filename, checksum)
+                # Media loaded from a replaced file needs to be loaded again
+                self.media_library.forget(RESOURCES_PATH + local_filename)
                 return local_filename
-            except (
-                    requests.exceptions.HTTPError,
-                    requests.exceptions.ConnectionError
-            ) as exception:
+            except (requests.exceptions.RequestException, DownloadVerificationError) as exception:
                 message = f'Failed to download the file {local_filename} with error {exception}'
                 print(message)
                 sentry_sdk.capture_exception(exception)
@@ -456,65 +479,127 @@ class MediaPlayer():  # pylint: disable=too-many-branches,too-many-instance-attr
         print(message)
         return None
 
-    def download_playlist_from_xos(self):
+    def fetch_playlist_from_xos(self, conditional=True):
+        """
+        Fetches the playlist from XOS, sending the validators from the last fetch so that
+        an unchanged playlist isn't sent again. Returns the playlist data, whether it
+        changed since it was cached, and the validators to save once it's been cached.
+        """
+        headers = {}
+        validators = self.load_playlist_validators() if conditional else {}
+        if validators and os.path.isfile(CACHED_PLAYLIST_JSON):
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+
+        response = requests.get(
+            XOS_PLAYLIST_ENDPOINT + XOS_PLAYLIST_ID + '/',
+            headers=headers,
+            timeout=5,
+        )
+        if response.status_code == 304:
+            self.print_debug(f'Playlist {XOS_PLAYLIST_ID} not modified since it was cached.')
+            try:
+                return self.load_cached_playlist_json(), False, validators
+            except (FileNotFoundError, ValueError) as exception:
+                print(f'Unable to read the cached playlist, fetching it again: {exception}')
+                return self.fetch_playlist_from_xos(conditional=False)
+        response.raise_for_status()
+        validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        return response.json(), True, validators
+
+    @staticmethod
+    def load_playlist_validators():
+        """
+        Returns the ETag and Last-Modified validators saved with the cached playlist.
+        """
+        return json_file.load(CACHED_PLAYLIST_VALIDATORS_JSON, 'playlist validators')
+
+    @staticmethod
+    def load_cached_playlist_json():
+        """
+        Returns the cached playlist data, raising FileNotFoundError if there isn't one.
+        """
+        with open(CACHED_PLAYLIST_JSON, encoding='utf-8') as cached_playlist:
+            return json.load(cached_playlist)
+
+    @staticmethod
+    def cache_playlist(playlist_json_data, validators):
+        """
+        Caches the playlist data along with the validators it was fetched with.
+        """
+        json_file.save(CACHED_PLAYLIST_JSON, playlist_json_data)
+        json_file.save(CACHED_PLAYLIST_VALIDATORS_JSON, validators or {})
+
+    def download_playlist_from_xos(self, progressive=False):
         """
         Downloads the playlist from XOS.
         """
         playlist_json_data = {}
+        validators = {}
+        modified = True
         try:
-            response = requests.get(XOS_PLAYLIST_ENDPOINT + XOS_PLAYLIST_ID + '/', timeout=5)
-            response.raise_for_status()
-            playlist_json_data = response.json()
+            playlist_json_data, modified, validators = self.fetch_playlist_from_xos()
 
-        except (
-                requests.exceptions.HTTPError,
-                requests.exceptions.ConnectionError,
-                requests.exceptions.Timeout
-        ) as exception:
+        except requests.exceptions.RequestException as exception:
             print(f'Failed to connect to {XOS_PLAYLIST_ENDPOINT}, looking for local files.')
             sentry_sdk.capture_exception(exception)
 
             try:
-                with open(CACHED_PLAYLIST_JSON, encoding='utf-8') as json_file:
-                    playlist_json_data = json.load(json_file)
-            except FileNotFoundError as file_exception:
-                message = 'Cannot reach XOS and local cache does not exist'
+                playlist_json_data = self.load_cached_playlist_json()
+                modified = False
+            except (FileNotFoundError, ValueError) as file_exception:
+                message = 'Cannot reach XOS and local cache does not exist or is unreadable'
                 print(message)
                 sentry_sdk.capture_exception(file_exception)
                 return
 
+        if self.load_playlist(playlist_json_data, progressive) and modified:
+            self.cache_playlist(playlist_json_data, validators)
+
+    def load_playlist(self, playlist_json_data, progressive=False):
+        """
+        Downloads the resources of the playlist that aren't available locally
+        and loads the playable ones into VLC. Returns True if the playlist was loaded.
+
+        If progressive is True, playback starts as soon as the first playable item
+        is ready and the rest are added in playlist order in the background.
+        """
         try:
             playlist_labels = playlist_json_data['playlist_labels']
+            self.assign_filenames(playlist_labels)
+            self.playlist_version = playlist_version(playlist_json_data)
 
             # Delete unneeded files from the filesystem
             self.delete_unneeded_resources(playlist_labels)
 
-            # Download resources if they aren't available locally
-            for playlist_label in playlist_labels:
-                local_playlist_label = self.download_resources(playlist_label)
-                if not local_playlist_label:
-                    print(f'Invalid video resource: {playlist_label["video"]}, skipping.')
-                    continue
-                local_resource = local_playlist_label['resource']
-                media = self.vlc['instance'].media_new(local_resource)
-                media.parse()
-                if media.get_duration():
-                    # OK to play
-                    self.vlc['playlist'].add_media(media)
-                    self.playlist.append(local_playlist_label)
-                else:
-                    print(f'Video doesn\'t seem playable: {local_resource}, skipping.')
-
+            # Download resources that aren't available locally in parallel,
+            # then add them to the playlist in order
+            downloads = [
+                self.downloader.submit(self.prepare_resources, playlist_label)
+                for playlist_label in playlist_labels
+            ]
             self.vlc['list_player'].set_media_list(self.vlc['playlist'])
+            pending = list(zip(playlist_labels, downloads))
+            while pending:
+                playlist_label, download = pending.pop(0)
+                self.add_playlist_label(playlist_label, download.result())
+                if progressive and self.playlist and pending:
+                    self.vlc['list_player'].play()
+                    self.add_thread = Thread(
+                        target=self.add_playlist_labels,
+                        args=(pending,),
+                        daemon=True,
+                    )
+                    self.add_thread.start()
+                    break
+            return True
 
-            # cache playlist
-            with open(CACHED_PLAYLIST_JSON, 'w', encoding='utf-8') as outfile:
-                json.dump(playlist_json_data, outfile)
-
-        except (
-                requests.exceptions.HTTPError,
-                requests.exceptions.ConnectionError
-        ) as exception:
+        except requests.exceptions.RequestException as exception:
             print(f'Unable to connect to {XOS_PLAYLIST_ENDPOINT} and \
                 resources not available locally. Error: {exception}')
             sentry_sdk.capture_exception(exception)
@@ -524,26 +609,185 @@ class MediaPlayer():  # pylint: disable=too-many-branches,too-many-instance-attr
                 {XOS_PLAYLIST_ENDPOINT + XOS_PLAYLIST_ID}'
             print(message)
             sentry_sdk.capture_exception(exception)
+        return False
+
+    def get_playable_media(self, playlist_label, local_playlist_label):
+        """
+        Returns the vlc.Media for a downloaded playlist label, or None if it isn't playable.
+        Media already loaded for the same resource is reused rather than loaded again.
+        """
+        if not local_playlist_label:
+            print(f'Invalid video resource: {playlist_label.get("video")}, skipping.')
+            return None
+        local_resource = local_playlist_label['resource']
+        media = self.media_library.load(local_resource)
+        if not media:
+            print(f'Video doesn\'t seem playable: {local_resource}, skipping.')
+        return media
+
+    def prepare_resources(self, playlist_label):
+        """
+        Downloads the resources for the specified playlist label and loads its media,
+        so resources that need parsing are parsed in parallel on the download workers.
+        """
+        local_playlist_label = self.download_resources(playlist_label)
+        if local_playlist_label:
+            self.media_library.load(local_playlist_label['resource'])
+        return local_playlist_label
+
+    def add_playlist_label(self, playlist_label, local_playlist_label):
+        """
+        Adds a downloaded playlist label to the end of the playlist if it's playable.
+        """
+        media = self.get_playable_media(playlist_label, local_playlist_label)
+        if not media:
+            return False
+        # OK to play
+        self.vlc['playlist'].lock()
+        try:
+            self.playlist.append(local_playlist_label)
+            self.vlc['playlist'].add_media(media)
+        finally:
+            self.vlc['playlist'].unlock()
+        return True
+
+    def add_playlist_labels(self, pending):
+        """
+        Adds the remaining playlist labels in order as their downloads complete.
+        """
+        try:
+            for playlist_label, download in pending:
+                self.add_playlist_label(playlist_label, download.result())
+        except requests.exceptions.RequestException as exception:
+            print(f'Unable to download the rest of the playlist. Error: {exception}')
+            sentry_sdk.capture_exception(exception)
+        print(f'Finished loading {len(self.playlist)} playlist items.')
+
+    def wait_until_loaded(self):
+        """
+        Block until the rest of a progressively loaded playlist has been added.
+        """
+        if self.add_thread:
+            self.add_thread.join()
+
+    def load_cached_playlist(self, progressive=False):
+        """
+        Loads the cached playlist without contacting XOS if every one of its resources is
+        valid in the resource manifest. Returns True if the cached playlist was loaded.
+        """
+        try:
+            playlist_json_data = self.load_cached_playlist_json()
+            playlist_labels = playlist_json_data['playlist_labels']
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            return False
+        try:
+            self.assign_filenames(playlist_labels)
+        except (AttributeError, TypeError):
+            return False
+        if not playlist_labels or not all(
+                self.resources_are_cached(playlist_label) for playlist_label in playlist_labels
+        ):
+            return False
+        print(f'Loading cached playlist {CACHED_PLAYLIST_JSON}')
+        return self.load_playlist(playlist_json_data, progressive) and bool(self.playlist)
+
+    def resources_are_cached(self, playlist_label):
+        """
+        Returns True if the resources of a playlist label don't need downloading.
+        """
+        try:
+            video_filename, subtitles_filename = self.local_filenames(playlist_label)
+            if not video_filename or self.resource_needs_downloading(
+                    RESOURCES_PATH + video_filename,
+                    self.get_resource_checksum(playlist_label),
+                    playlist_label['resource'],
+            ):
+                return False
+            if subtitles_filename:
+                return not self.resource_needs_downloading(
+                    RESOURCES_PATH + subtitles_filename,
+                    playlist_label.get('subtitles_checksum'),
+                    playlist_label['subtitles'],
+                )
+        except (AttributeError, TypeError):
+            return False
+        return True
+
+    def refresh_playlist(self):
+        """
+        Checks XOS for changes to the playlist. If it has changed, downloads only the new
+        resources and returns the new playlist, VLC MediaList and playlist version to swap in,
+        reusing the vlc.Media of unchanged items. Returns None if the playlist hasn't changed.
+        """
+        try:
+            playlist_json_data, modified, validators = self.fetch_playlist_from_xos()
+        except requests.exceptions.RequestException as exception:
+            print(f'Failed to refresh the playlist from {XOS_PLAYLIST_ENDPOINT}: {exception}')
+            return None
+        if not modified:
+            return None
+        try:
+            if playlist_json_data == self.load_cached_playlist_json():
+                self.cache_playlist(playlist_json_data, validators)
+                return None
+        except (FileNotFoundError, ValueError):
+            pass
+
+        print(f'Playlist {XOS_PLAYLIST_ID} has changed, downloading its resources...')
+        try:
+            playlist_labels = playlist_json_data['playlist_labels']
+            self.assign_filenames(playlist_labels)
+            downloads = [
+                self.downloader.submit(self.prepare_resources, playlist_label)
+                for playlist_label in playlist_labels
+            ]
+            playlist = []
+            media_list = self.vlc['instance'].media_list_new()
+            for playlist_label, download in zip(playlist_labels, downloads):
+                local_playlist_label = download.result()
+                media = self.get_playable_media(playlist_label, local_playlist_label)
+                if media:
+                    playlist.append(local_playlist_label)
+                    media_list.add_media(media)
+        except (KeyError, TypeError) as exception:
+            print(f'Is there a resource for this playlist? {XOS_PLAYLIST_ID}')
+            sentry_sdk.capture_exception(exception)
+            return None
+        except requests.exceptions.RequestException as exception:
+            print(f'Unable to download the updated playlist. Error: {exception}')
+            sentry_sdk.capture_exception(exception)
+            return None
+
+        self.cache_playlist(playlist_json_data, validators)
+        return playlist, media_list, playlist_version(playlist_json_data)
+
+    def swap_playlist(self, playlist, media_list, version):
+        """
+        Replaces the playing playlist with a new one, starting from its first item,
+        and deletes the resources that are no longer needed.
+        """
+        self.wait_until_loaded()
+        print(f'Playing updated playlist {XOS_PLAYLIST_ID} with {len(playlist)} items.')
+        self.playlist = playlist
+        self.vlc['playlist'] = media_list
+        self.vlc['list_player'].set_media_list(media_list)
+        self.vlc['list_player'].play_item_at_index(0)
+        self.playlist_version = version
+        self.media_library.retain({item['resource'] for item in playlist})
+        self.delete_unneeded_resources(playlist)
 
     def get_current_time(self):
         """
         Function to interpolate VLC player's play time.
         This is to overcome the limitation where the get_time() function only returns
-        a value every 250 ms. We get VLC's reported play time using get_time() and add
-        to that the time elapsed since the last correct VLC time report.
+        a value every 250 ms. While VLC's time-changed events are arriving the playback
+        clock interpolates from the last event, otherwise VLC's reported play time is
+        polled using get_time() and added to the time elapsed since it last changed.
         """
-        vlc_time = self.vlc['player'].get_time()  # get VLC's reported time
-
-        # If VLC's reported time hasn't changed, add to that the time elapsed
-        # since the last time it did change.
-        if self.last_vlc_time == vlc_time and self.last_vlc_time != 0:
-            vlc_time += int(vlc.libvlc_clock() / 1000) - self.time_at_last_poll
-        # If VLC's reported time did change, then it is the correct time and we
-        # reset time_at_last_poll to calculate the elapsed time from this point on.
-        else:
-            self.last_vlc_time = vlc_time
-            self.time_at_last_poll = int(vlc.libvlc_clock() / 1000)
-        return vlc_time
+        clock_time = self.clock.clock()
+        if self.clock.is_fresh(clock_time):
+            return self.clock.now(clock_time)
+        return self.clock.observe(self.vlc['player'].get_time(), clock_time)
 
     def get_current_playlist_position(self):
         """
@@ -552,26 +796,17 @@ class MediaPlayer():  # pylint: disable=too-many-branches,too-many-instance-attr
         """
         media = self.vlc['player'].get_media()
         if media:
-            stats = vlc.MediaStats()
-            media.get_stats(stats)
             playlist_position = self.vlc['playlist'].index_of_item(media)
             return playlist_position
         return None
 
-    def run_timer(self):
-        """
-        Constantly call get_current_time to have an accurate time whenever get_current_time
-        is called elsewhere.
-        """
-        while True:
-            self.get_current_time()
-
     def sync_check(self):
         """
-        Determine whether we should try and setup the sync again.
+        Determine whether we should try and setup the sync again. The TCP client reconnects
+        itself with a backoff, so it's left to, rather than set up again.
         """
         self.client.sync_attempts += 1
-        if self.client.sync_attempts > 3:
+        if self.client.sync_attempts > 3 and SYNC_TRANSPORT != 'tcp':
             self.print_debug('No server_time received, attempting to re-setup sync...')
             self.setup_sync()
             self.print_debug(f'Sync attempts reset to: {self.client.sync_attempts}')
@@ -584,7 +819,6 @@ class MediaPlayer():  # pylint: disable=too-many-branches,too-many-instance-attr
     def sync_to_server(self):
         """
         For client players, look for data from the server, check if syncing is needed and sync.
-        For server players, send the player's current time every second.
         """
         if SYNC_CLIENT_TO:
             while True:
@@ -598,6 +832,11 @@ class MediaPlayer():  # pylint: disable=too-many-branches,too-many-instance-attr
                         self.sync_check()
                         continue
 
+                    if self.playlist_watcher and \
+                            not self.playlist_watcher.follow(server_state[2]):
+                        # Not playing the server's playlist, so its position doesn't apply
+                        continue
+
                     client_time = self.get_current_time()
                     if server_time == 0 or client_time == 0:
                         # Avoid syncing at the beginning of videos
@@ -611,18 +850,47 @@ class MediaPlayer():  # pylint: disable=too-many-branches,too-many-instance-attr
                     self.sync_check()
                     continue
 
+    def send_beacon(self):
+        """
+        For server players, send the player's current time to the clients.
+        """
+        current_playlist_position = self.get_current_playlist_position()
+        if current_playlist_position is None:
+            self.print_debug(
+                f'Failed to get current playlist position: {current_playlist_position}. '
+                'Skipping this sync...'
+            )
+        else:
+            self.server.send(
+                current_playlist_position, self.get_current_time(), self.playlist_version,
+            )
+            self.print_debug(f'Sent beacon {self.server.sequence}')
+
+    def schedule_tasks(self, playlist_watcher):
+        """
+        Schedule the periodic tasks, each at its own configurable interval.
+        """
+        self.playlist_watcher = playlist_watcher
+        self.scheduler.every('playlist_refresh', playlist_watcher.interval, playlist_watcher.check)
+        if IS_SYNCED_PLAYER:
+            # A fallback for when VLC's time-changed events aren't updating the playback clock
+            self.scheduler.every('clock', CLOCK_POLL_INTERVAL, self.get_current_time)
         if SYNC_IS_SERVER:
-            while True:
-                time.sleep(1)
-                current_playlist_position = self.get_current_playlist_position()
-                if current_playlist_position is None:
-                    self.print_debug(
-                        f'Failed to get current playlist position: {current_playlist_position}. '
-                        'Skipping this sync...'
-                    )
-                else:
-                    self.server.send(f'{current_playlist_position},{self.get_current_time()}')
-                    self.print_debug(f'Clients: {self.server.clients}')
+            self.scheduler.every('sync_beacon', SYNC_BEACON_INTERVAL, self.send_beacon)
+        # Wait for VLC to launch. A playlist may be loaded after these are scheduled,
+        # so their runs are skipped until there's one playing.
+        for name, interval, function in [
+                ('sample', STATUS_SAMPLE_INTERVAL, self.sampler.sample),
+                ('publish', min(TIME_BETWEEN_PLAYBACK_STATUS, PROMETHEUS_UPDATE_INTERVAL),
+                 self.post_playback_to_broker),
+                ('prefetch', PREFETCH_INTERVAL, self.prefetcher.check),
+        ]:
+            self.scheduler.every(
+                name, interval, only_while(lambda: self.playlist, function), delay=5,
+            )
+        self.scheduler.every(
+            'download_throttle', DOWNLOAD_THROTTLE_INTERVAL, self.throttle.adapt, delay=5,
+        )
 
     def sync_playlist(self, server_playlist_position, server_time, client_time):
         """
@@ -647,6 +915,7 @@ class MediaPlayer():  # pylint: disable=too-many-branches,too-many-instance-attr
                     f'client {client_playlist_position}, syncing now...'
                 )
                 self.vlc['list_player'].play_item_at_index(server_playlist_position)
+                self.drift.reset()
                 client_time = self.get_current_time()
                 client_playlist_position = server_playlist_position
                 self.print_debug(
@@ -656,8 +925,11 @@ class MediaPlayer():  # pylint: disable=too-many-branches,too-many-instance-attr
     def sync_playback(self, server_time, client_time):
         """
         Sync playback position between server and client if necessary.
+        Drift is corrected by adjusting the playback rate, or by seeking if it's large.
         """
-        if abs(client_time - server_time) > int(SYNC_DRIFT_THRESHOLD):
+        if abs(client_time - server_time) <= SYNC_SEEK_THRESHOLD:
+            self.drift.correct(client_time - server_time)
+        else:
             sync = True
             target_time = server_time + int(SYNC_LATENCY)
             video_length = int(self.vlc['player'].get_length())
@@ -682,29 +954,34 @@ class MediaPlayer():  # pylint: disable=too-many-branches,too-many-instance-attr
                         f'of this video: {video_length}, ignoring sync...'
                     )
                 if sync:
-                    self.vlc['player'].set_time(target_time)
+                    with status_client.timed('sync_seek'):
+                        self.vlc['player'].set_time(target_time)
+                    status_client.SYNC_SEEK_COUNTER.inc()
+                    self.drift.reset()
 
 
 if __name__ == "__main__":
     # pylint: disable=invalid-name
 
     media_player = MediaPlayer()
-    media_player.download_playlist_from_xos()
-    media_player.vlc['list_player'].play()
-
-    if IS_SYNCED_PLAYER:
-        run_timer_thread = Thread(target=media_player.run_timer)
-        run_timer_thread.start()
+    if PEER_SHARING:
+        # Share the stored resources with the other players on the local network
+        start_peer_server(media_player.store)
+    # Synced players fetch the playlist from XOS, so a group restarted after it changed
+    # doesn't start with some of them playing an older cached playlist
+    if not IS_SYNCED_PLAYER and media_player.load_cached_playlist(progressive=PROGRESSIVE_PLAYLIST):
+        # Start playing straight away, the playlist watcher checks XOS for changes
+        media_player.vlc['list_player'].play()
+    else:
+        media_player.download_playlist_from_xos(progressive=PROGRESSIVE_PLAYLIST)
+        media_player.vlc['list_player'].play()
 
-        sync_thread = Thread(target=media_player.sync_to_server)
+    if SYNC_CLIENT_TO:
+        # Driven by the beacons arriving from the server
+        sync_thread = Thread(target=media_player.sync_to_server, daemon=True)
         sync_thread.start()
 
-    if media_player.playlist:
-        # Wait for VLC to launch
-        time.sleep(5)
-        playback_time_thread = Thread(target=media_player.post_playback_to_broker)
-        playback_time_thread.start()
-    else:
-        print('The playlist appears to be empty... not attempting to post playback status.')
-        while True:
-            pass
+    media_player.schedule_tasks(
+        PlaylistWatcher(media_player, follow_server=bool(SYNC_CLIENT_TO)),
+    )
+    media_player.scheduler.run()
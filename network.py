@@ -2,18 +2,314 @@
 Based on: https://github.com/oaubert/python-vlc/tree/master/examples/video_sync
 """
 
+import abc
+import errno
 import os
+import random
+import selectors
 import socket
+import struct
 import threading
 import time
+from collections import deque, namedtuple
+from concurrent import futures
+
+import status_client
 
 SYNC_MAX_CLIENTS = int(os.getenv('SYNC_MAX_CLIENTS', '5'))
+# How long the server waits for a client to accept data before dropping it
+SYNC_CLIENT_SEND_TIMEOUT = float(os.getenv('SYNC_CLIENT_SEND_TIMEOUT', '2'))  # seconds
+SYNC_MULTICAST_TTL = int(os.getenv('SYNC_MULTICAST_TTL', '1'))
+# How long a UDP client waits for a beacon before reporting that none arrived
+SYNC_RECEIVE_TIMEOUT = float(os.getenv('SYNC_RECEIVE_TIMEOUT', '5'))  # seconds
+SYNC_PING_INTERVAL = float(os.getenv('SYNC_PING_INTERVAL', '1'))  # seconds
+# Number of recent ping round trips the clock offset is estimated from
+SYNC_CLOCK_WINDOW = int(os.getenv('SYNC_CLOCK_WINDOW', '16'))
+SYNC_RECONNECT_INTERVAL_START = float(os.getenv('SYNC_RECONNECT_INTERVAL_START', '0.5'))  # seconds
+SYNC_RECONNECT_INTERVAL_MAX = float(os.getenv('SYNC_RECONNECT_INTERVAL_MAX', '30'))  # seconds
+# Detect a dead server connection after 5 idle seconds and 3 unanswered probes 2 seconds apart
+KEEPALIVE_OPTIONS = {'TCP_KEEPIDLE': 5, 'TCP_KEEPINTVL': 2, 'TCP_KEEPCNT': 3}
+
+DISCONNECTED = 'disconnected'
+CONNECTING = 'connecting'
+CONNECTED = 'connected'
+
+# Sync frames are a fixed-size struct in network byte order: magic, protocol version,
+# frame kind, sequence number, playlist position, media time in milliseconds, the
+# sender's monotonic clock in microseconds when the frame was sent, and the version
+# of the playlist the server is playing, see playlist_watcher.playlist_version.
+FRAME = struct.Struct('!2sBBIiqqI')
+FRAME_MAGIC = b'MP'
+FRAME_VERSION = 2
+FRAME_BEACON = 0
+# A client's ping carries its send time in timestamp. The server's pong echoes the ping's
+# sequence number and timestamp, in media_time, and is timestamped when it's sent.
+FRAME_PING = 1
+FRAME_PONG = 2
+# Number of frames the client's receive buffer holds
+RECEIVE_BUFFER_FRAMES = 64
+SEQUENCE_MODULO = 2 ** 32
+# A frame further behind than this is taken to be from a server that restarted
+SEQUENCE_RESTART_WINDOW = 64
+
+SyncFrame = namedtuple(
+    'SyncFrame',
+    ['kind', 'sequence', 'playlist_position', 'media_time', 'timestamp', 'playlist_version'],
+)
+
+
+def monotonic_microseconds():
+    """
+    Returns the monotonic clock in microseconds.
+    """
+    return time.monotonic_ns() // 1000
+
+
+def encode_frame(kind, sequence, playlist_position, media_time, playlist_version=0):
+    """
+    Returns the bytes of a sync frame, timestamped now.
+    """
+    return FRAME.pack(
+        FRAME_MAGIC,
+        FRAME_VERSION,
+        kind,
+        sequence % SEQUENCE_MODULO,
+        playlist_position,
+        media_time,
+        monotonic_microseconds(),
+        playlist_version,
+    )
+
+
+def is_newer(sequence, last_sequence):
+    """
+    Returns True if sequence comes after last_sequence, allowing for wrap around.
+    """
+    if last_sequence is None:
+        return True
+    return 0 < (sequence - last_sequence) % SEQUENCE_MODULO < SEQUENCE_MODULO // 2
+
+
+def is_stale(sequence, last_sequence):
+    """
+    Returns True if sequence is a duplicate or was overtaken by last_sequence. Frames far
+    behind last_sequence aren't stale, as the server has restarted its sequence numbers.
+    """
+    if is_newer(sequence, last_sequence):
+        return False
+    return (last_sequence - sequence) % SEQUENCE_MODULO <= SEQUENCE_RESTART_WINDOW
+
+
+def newest_beacon(frames, last_frame):
+    """
+    Returns the newest beacon in frames that isn't stale compared to last_frame, or None.
+    """
+    newest = None
+    last_sequence = last_frame.sequence if last_frame else None
+    for frame in frames:
+        if frame.kind == FRAME_BEACON and not is_stale(frame.sequence, last_sequence):
+            newest = frame
+            last_sequence = frame.sequence
+    return newest
+
+
+class ClockEstimator:
+    """
+    Estimates the offset of the server's monotonic clock from this one with NTP-style
+    ping round trips. Of the last few round trips the fastest is the least delayed by
+    queueing, so its offset is used as the estimate.
+    """
+
+    def __init__(self, window=SYNC_CLOCK_WINDOW):
+        self.samples = deque(maxlen=window)
+        # The server's clock minus this one in microseconds, None until a pong arrives
+        self.offset = None
+        self.round_trip = None
+
+    def add_sample(self, sent, server_time, received):
+        """
+        Add a round trip of a ping sent and its pong received on this clock,
+        and the server's clock when it sent the pong, all in microseconds.
+        """
+        round_trip = received - sent
+        if round_trip < 0:
+            return
+        self.samples.append((round_trip, server_time - (sent + received) // 2))
+        self.round_trip, self.offset = min(self.samples)
+        status_client.SYNC_ROUND_TRIP_GAUGE.set(self.round_trip / 1000000)
+        status_client.SYNC_CLOCK_OFFSET_GAUGE.set(self.offset / 1000000)
+
+    def project(self, frame, local_time=None):
+        """
+        Returns the media time in milliseconds of a server beacon projected forward
+        to now, or its media time as sent if the clock offset isn't known yet.
+        """
+        if self.offset is None:
+            return frame.media_time
+        if local_time is None:
+            local_time = monotonic_microseconds()
+        elapsed = local_time + self.offset - frame.timestamp
+        return frame.media_time + max(elapsed, 0) // 1000
+
+
+class SyncClient(abc.ABC):  # pylint: disable=R0903
+    """
+    The beacon and ping handling shared by the sync clients.
+    """
+
+    def __init__(self):
+        self.sync_attempts = 0
+        self.clock = ClockEstimator()
+        self.ping_sequence = 0
+        self.last_ping = None
+        # The newest beacon frame received from the server
+        self.last_frame = None
+
+    @abc.abstractmethod
+    def send_frame(self, data):
+        """
+        Send a frame to the server.
+        """
+
+    def ping(self):
+        """
+        Ping the server every SYNC_PING_INTERVAL seconds to measure the clock offset.
+        """
+        now = time.monotonic()
+        if self.last_ping is not None and now - self.last_ping < SYNC_PING_INTERVAL:
+            return
+        self.last_ping = now
+        self.ping_sequence = (self.ping_sequence + 1) % SEQUENCE_MODULO
+        try:
+            self.send_frame(encode_frame(FRAME_PING, self.ping_sequence, 0, 0))
+        except OSError as exception:
+            print(f'Failed to ping the server: {exception}')
+
+    def handle_frames(self, frames):
+        """
+        Measure the clock offset from any pongs in frames, and return a list of integers
+        containing the playlist position and time of the server player in milliseconds
+        projected to now from the newest beacon, and the version of its playlist,
+        or None if there isn't a new beacon.
+        """
+        received = monotonic_microseconds()
+        for frame in frames:
+            if frame.kind == FRAME_PONG:
+                self.clock.add_sample(frame.media_time, frame.timestamp, received)
+        newest = newest_beacon(frames, self.last_frame)
+        if not newest:
+            return None
+        self.last_frame = newest
+        return [
+            newest.playlist_position,
+            self.clock.project(newest, received),
+            newest.playlist_version,
+        ]
+
+
+class FrameReader:
+    """
+    Reads sync frames from a stream socket into a preallocated buffer with recv_into,
+    so frames that arrive split across reads or coalesced into one are parsed intact.
+    Bytes that aren't a frame are skipped by searching for the next frame's magic.
+    """
+
+    def __init__(self, frames=RECEIVE_BUFFER_FRAMES):
+        self.buffer = bytearray(FRAME.size * frames)
+        self.view = memoryview(self.buffer)
+        # Number of bytes received but not yet parsed
+        self.length = 0
+
+    def reset(self):
+        """
+        Discard any partially received frame, e.g. after reconnecting.
+        """
+        self.length = 0
+
+    def receive(self, sock):
+        """
+        Receive from sock into the buffer once. Returns the number of bytes received,
+        which is zero when the connection has closed.
+        """
+        received = sock.recv_into(self.view[self.length:])
+        self.length += received
+        return received
+
+    def frames(self):
+        """
+        Returns the complete frames in the buffer, leaving any partial frame to be completed
+        by the next receive.
+        """
+        frames = []
+        offset = 0
+        while self.length - offset >= FRAME.size:
+            magic, version, *fields = FRAME.unpack_from(self.buffer, offset)
+            if magic != FRAME_MAGIC:
+                # Out of step with the stream, skip to the next magic
+                next_frame = self.buffer.find(FRAME_MAGIC, offset + 1, self.length)
+                offset = next_frame if next_frame != -1 else self.length - 1
+                continue
+            offset += FRAME.size
+            if version == FRAME_VERSION:
+                frames.append(SyncFrame(*fields))
+        # Move the remaining partial frame to the start of the buffer
+        remaining = self.length - offset
+        self.buffer[:remaining] = self.buffer[offset:self.length]
+        self.length = remaining
+        return frames
+
+
+class ClientConnection:
+    """
+    A client connected to the sync server, with a bounded queue of frames to send it.
+    Only the newest beacon is kept, so a client that falls behind skips to it rather
+    than catching up through old ones.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = FrameReader(frames=4)
+        # The rest of a frame that was only partly sent
+        self.partial = None
+        self.beacon = None
+        self.pongs = deque(maxlen=4)
+        # When the client stopped accepting data, or None if it's keeping up
+        self.stalled_since = None
+
+    def flush(self):
+        """
+        Send as much of the queued frames as the socket will take without blocking.
+        Returns True if everything was sent.
+        """
+        while True:
+            if not self.partial:
+                if self.pongs:
+                    self.partial = memoryview(self.pongs.popleft())
+                elif self.beacon:
+                    self.partial = memoryview(self.beacon)
+                    self.beacon = None
+                else:
+                    self.stalled_since = None
+                    return True
+            try:
+                sent = self.sock.send(self.partial)
+            except BlockingIOError:
+                sent = 0
+            self.partial = self.partial[sent:]
+            if self.partial:
+                if self.stalled_since is None:
+                    self.stalled_since = time.monotonic()
+                return False
 
 
 class Server:
     """
     A server class for synchronisation. Sends the time of the video
-    being currently played each second to a set of clients.
+    being currently played to a set of clients, and answers their pings.
+
+    Accepting clients, answering pings and sending beacons all happen in one selector
+    loop on non-blocking sockets, so a slow client doesn't hold up the others, and
+    clients that stop accepting data for SYNC_CLIENT_SEND_TIMEOUT seconds are dropped.
     """
 
     def __init__(self, host, port):
@@ -24,89 +320,460 @@ class Server:
         self.sock.bind((host, port))
 
         self.sock.listen(SYNC_MAX_CLIENTS)
+        self.sock.setblocking(False)
 
-        self.clients = set()
-        listener_thread = threading.Thread(target=self.listen_for_clients, args=())
-        listener_thread.daemon = True
-        listener_thread.start()
+        # Connected clients keyed by socket, only used by the server's loop
+        self.clients = {}
+        self.sequence = 0
+        self.beacon = None
+        # send() wakes the loop by writing to this socket pair
+        self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+        self.wakeup_receiver.setblocking(False)
+        self.wakeup_sender.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.selector.register(self.wakeup_receiver, selectors.EVENT_READ)
+        server_thread = threading.Thread(target=self.run, args=())
+        server_thread.daemon = True
+        server_thread.start()
 
-    def listen_for_clients(self):
+    def run(self):
         """
-        Constantly listens for incoming clients to set up a connection.
+        Constantly accepts clients, answers their pings and sends them beacons.
         """
         while True:
+            for key, events in self.selector.select(timeout=SYNC_CLIENT_SEND_TIMEOUT):
+                if key.fileobj is self.sock:
+                    self.accept()
+                elif key.fileobj is self.wakeup_receiver:
+                    self.broadcast()
+                else:
+                    if events & selectors.EVENT_WRITE and key.data.sock in self.clients:
+                        self.flush(key.data)
+                    if events & selectors.EVENT_READ and key.data.sock in self.clients:
+                        self.answer_pings(key.data)
+            self.evict_stalled_clients()
+
+    def accept(self):
+        """
+        Accept a new client.
+        """
+        try:
             client, _ = self.sock.accept()
-            print(f'Accepted Connection from: {client}')
-            self.clients.add(client)
+        except BlockingIOError:
+            return
+        print(f'Accepted Connection from: {client}')
+        client.setblocking(False)
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = ClientConnection(client)
+        self.clients[client] = connection
+        self.selector.register(client, selectors.EVENT_READ, connection)
 
-    def send(self, data):
+    def broadcast(self):
         """
-        Sends the time in milliseconds (int) to the set of registered clients.
+        Queue the newest beacon for every client and send it to those keeping up.
         """
-        data = f'{data},'.encode()
+        try:
+            while self.wakeup_receiver.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        beacon = self.beacon
+        for connection in list(self.clients.values()):
+            connection.beacon = beacon
+            self.flush(connection)
 
+    def flush(self, connection):
+        """
+        Send a client its queued frames, and wait for it to be writable if it can't take them.
+        """
         try:
-            for client in self.clients:
-                try:
-                    client.send(data)
-                except socket.error:
-                    print(f'Connection to client: {client} was broken!')
-                    client.close()
-                    self.clients.remove(client)
-        except RuntimeError as exception:
-            # e.g. #139 RuntimeError: Set changed size during iteration
-            # We're sending this time data every 1 second, so okay to skip a few as clients arrive
-            # If it becomes a problem, write a locking mechanism for listen_for_clients()
-            print(f'Media Player Server exception while trying to send {data}: {exception}')
+            sent = connection.flush()
+        except OSError:
+            self.drop(connection, 'was broken')
+            return
+        events = selectors.EVENT_READ if sent else selectors.EVENT_READ | selectors.EVENT_WRITE
+        self.selector.modify(connection.sock, events, connection)
+
+    def answer_pings(self, connection):
+        """
+        Answer the pings a client has sent, or drop it if its connection has closed.
+        """
+        try:
+            if not connection.reader.receive(connection.sock):
+                self.drop(connection, 'was closed')
+                return
+        except BlockingIOError:
+            return
+        except OSError:
+            self.drop(connection, 'was broken')
+            return
+        for frame in connection.reader.frames():
+            if frame.kind == FRAME_PING:
+                connection.pongs.append(
+                    encode_frame(FRAME_PONG, frame.sequence, 0, frame.timestamp)
+                )
+        self.flush(connection)
+
+    def evict_stalled_clients(self):
+        """
+        Drop clients that haven't accepted any data for SYNC_CLIENT_SEND_TIMEOUT seconds.
+        """
+        now = time.monotonic()
+        for connection in list(self.clients.values()):
+            if connection.stalled_since and \
+                    now - connection.stalled_since > SYNC_CLIENT_SEND_TIMEOUT:
+                self.drop(connection, 'stopped receiving')
+
+    def drop(self, connection, reason):
+        """
+        Disconnect a client.
+        """
+        print(f'Connection to client: {connection.sock} {reason}, dropping it')
+        self.selector.unregister(connection.sock)
+        del self.clients[connection.sock]
+        connection.sock.close()
+
+    def send(self, playlist_position, media_time, playlist_version=0):
+        """
+        Sends a beacon frame of the playlist position, the media time in milliseconds (int)
+        and the playlist version to the set of registered clients.
+        """
+        self.sequence = (self.sequence + 1) % SEQUENCE_MODULO
+        self.beacon = encode_frame(
+            FRAME_BEACON, self.sequence, playlist_position, media_time, playlist_version,
+        )
+        try:
+            self.wakeup_sender.send(b'\0')
+        except BlockingIOError:
+            # The loop hasn't woken for the last beacon yet, and will send this one instead
+            pass
 
 
-class Client:  # pylint: disable=R0903
+class Client(SyncClient):  # pylint: disable=too-many-instance-attributes
     """
     A client class for synchronisation. Receives the time of the video
     being currently in the server player.
+
+    The connection is made with a non-blocking socket driven by receive(), so nothing
+    waits on a server that's down, and the server's address is resolved on another
+    thread. Failed connections are retried with a jittered exponential backoff,
+    and the connection state is exported to Prometheus.
     """
 
     def __init__(self, address, port):
-
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        super().__init__()
         self.address = address
         self.port = port
-        self.sync_attempts = 0
+        self.sock = None
+        self.selector = selectors.DefaultSelector()
+        self.reader = FrameReader()
+        # Frames waiting for the socket to accept them
+        self.outgoing = bytearray()
+        self.resolver = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='sync')
+        # The address being resolved for the next connection attempt
+        self.resolving = None
+        self.state = None
+        self.set_state(DISCONNECTED)
+        self.connection_attempts = 0
+        self.next_connection_attempt = 0
         self.connect()
 
-    def receive(self):
+    def set_state(self, state):
+        """
+        Set and export the connection state.
+        """
+        self.state = state
+        status_client.SYNC_CONNECTION_STATE.state(state)
+
+    def send_frame(self, data):
+        """
+        Send a frame to the server, keeping whatever the socket doesn't accept to send
+        once it's writable. A frame is skipped if the server isn't reading earlier ones.
         """
-        Receives data and tries to parse it into a list of integers containing
-        the current playlist position, and time of the server player in milliseconds.
+        if self.state != CONNECTED or len(self.outgoing) >= FRAME.size * 4:
+            return
+        self.outgoing += data
+        self.flush()
+
+    def flush(self):
+        """
+        Send as much of the outgoing frames as the socket will take without blocking,
+        and watch for it becoming writable if any are left.
         """
         try:
-            data = self.sock.recv(4096)
-            if data:
-                data = data.decode().split(',')
-                return [int(data[-3]), int(data[-2])]
-            print(f'No data received... {data}')
-            return None
-        except OSError:
-            print(f'Closing socket: {self.sock}')
-            self.sock.close()
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            print('Attempting to reconnect...')
+            sent = self.sock.send(self.outgoing)
+        except BlockingIOError:
+            sent = 0
+        del self.outgoing[:sent]
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if self.outgoing else 0)
+        if self.selector.get_key(self.sock).events != events:
+            self.selector.modify(self.sock, events)
+
+    @status_client.timed('sync_receive')
+    def receive(self):
+        """
+        Receives frames from the server and returns a list of integers containing the
+        playlist position and time of the server player in milliseconds and its playlist
+        version from the newest beacon, connecting or reconnecting first if needed. Beacons
+        older than one already received are ignored. Returns None if no beacon arrives
+        within SYNC_RECEIVE_TIMEOUT seconds or the connection is lost.
+        """
+        deadline = time.monotonic() + SYNC_RECEIVE_TIMEOUT
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                return None
+            if self.state == DISCONNECTED:
+                self.reconnect(now, deadline)
+                continue
+            if self.state == CONNECTED:
+                self.ping()
+            events = self.selector.select(deadline - now)
+            if not events:
+                continue
+            if self.state == CONNECTING:
+                self.finish_connecting()
+                continue
+            try:
+                if any(mask & selectors.EVENT_WRITE for _, mask in events):
+                    self.flush()
+                if not any(mask & selectors.EVENT_READ for _, mask in events):
+                    continue
+                if not self.reader.receive(self.sock):
+                    self.disconnect('connection closed by the server')
+                    return None
+            except BlockingIOError:
+                continue
+            except OSError as exception:
+                self.disconnect(exception)
+                return None
+            server_state = self.handle_frames(self.reader.frames())
+            if server_state:
+                return server_state
+
+    def reconnect(self, now, deadline):
+        """
+        Connect once the next connection attempt is due and the server's address has been
+        resolved, waiting until then or the deadline.
+        """
+        if now < self.next_connection_attempt:
+            time.sleep(min(self.next_connection_attempt, deadline) - now)
+        elif self.resolving and not self.resolving.done():
+            futures.wait([self.resolving], timeout=deadline - now)
+        else:
             self.connect()
-            return None
 
     def connect(self):
         """
-        Attempt to connect to the server.
+        Start resolving the server's address, or once it's resolved, start connecting
+        to the server without waiting for it to answer.
         """
+        if self.resolving:
+            resolving, self.resolving = self.resolving, None
+            try:
+                address = resolving.result()[0][4]
+            except OSError as exception:
+                self.disconnect(exception)
+                return
+        else:
+            try:
+                # An IP address is resolved without looking it up
+                address = socket.getaddrinfo(
+                    self.address, self.port, socket.AF_INET, socket.SOCK_STREAM, 0,
+                    socket.AI_NUMERICHOST,
+                )[0][4]
+            except socket.gaierror:
+                # Looking up a host name blocks, so it's done on the resolver thread
+                self.resolving = self.resolver.submit(
+                    socket.getaddrinfo, self.address, self.port, socket.AF_INET,
+                    socket.SOCK_STREAM,
+                )
+                return
         print(f'Connecting to {self.address} port {self.port}')
-        connected = False
-        while not connected:
+        # The server's sequence numbers start again on a new connection
+        self.reader.reset()
+        self.outgoing.clear()
+        self.last_frame = None
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setblocking(False)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for option, value in KEEPALIVE_OPTIONS.items():
+            if hasattr(socket, option):
+                self.sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+        try:
+            error = self.sock.connect_ex(address)
+        except OSError as exception:
+            self.disconnect(exception)
+            return
+        if error not in (0, errno.EINPROGRESS):
+            self.disconnect(os.strerror(error))
+            return
+        self.selector.register(self.sock, selectors.EVENT_WRITE)
+        self.set_state(CONNECTING)
+
+    def finish_connecting(self):
+        """
+        Finish connecting once the socket is writable, or schedule another attempt.
+        """
+        error = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error:
+            self.disconnect(os.strerror(error))
+            return
+        print(f'Connected to {self.address} port {self.port}')
+        self.selector.modify(self.sock, selectors.EVENT_READ)
+        self.connection_attempts = 0
+        self.last_ping = None
+        self.set_state(CONNECTED)
+
+    def disconnect(self, reason):
+        """
+        Close the connection and schedule the next attempt with a jittered exponential backoff.
+        """
+        self.close()
+        self.connection_attempts += 1
+        interval = min(
+            SYNC_RECONNECT_INTERVAL_START * 2 ** (self.connection_attempts - 1),
+            SYNC_RECONNECT_INTERVAL_MAX,
+        )
+        interval = random.uniform(interval / 2, interval)
+        self.next_connection_attempt = time.monotonic() + interval
+        print(f'Can\'t connect to {self.address} port {self.port}: {reason}, '
+              f'retrying in {interval:.1f} seconds')
+
+    def close(self):
+        """
+        Close the connection to the server.
+        """
+        if self.sock is None:
+            self.set_state(DISCONNECTED)
+            return
+        try:
+            self.selector.unregister(self.sock)
+        except (KeyError, ValueError):
+            pass
+        self.sock.close()
+        self.set_state(DISCONNECTED)
+
+
+class MulticastServer:
+    """
+    A server class for synchronisation over UDP. Sends each beacon as a single datagram
+    to a multicast group, or broadcasts it, however many clients are listening,
+    and answers the pings clients send to its port.
+    """
+
+    def __init__(self, group, port, broadcast=False):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('', port))
+        if broadcast:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            self.destination = ('<broadcast>', port)
+        else:
+            self.sock.setsockopt(
+                socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, SYNC_MULTICAST_TTL,
+            )
+            self.destination = (group, port)
+        print(f'Server sending to {self.destination[0]} port {port}')
+        self.sequence = 0
+        ping_thread = threading.Thread(target=self.answer_pings, daemon=True)
+        ping_thread.start()
+
+    def answer_pings(self):
+        """
+        Constantly answers pings from clients.
+        """
+        reader = FrameReader(frames=1)
+        while True:
+            reader.reset()
             try:
-                self.sock.connect((self.address, self.port))
-                connected = True
-            except ConnectionRefusedError:
-                print(f'Waiting for server at {self.address} port {self.port}')
-                time.sleep(1)
-            except OSError:
-                print(f'Can\'t connect to {self.address} port {self.port}')
+                reader.length, sender = self.sock.recvfrom_into(reader.view)
+                for frame in reader.frames():
+                    # Our own broadcast beacons arrive here too, so only answer pings
+                    if frame.kind == FRAME_PING:
+                        self.sock.sendto(
+                            encode_frame(FRAME_PONG, frame.sequence, 0, frame.timestamp),
+                            sender,
+                        )
+            except OSError as exception:
+                print(f'Media Player Server exception while answering a ping: {exception}')
                 time.sleep(1)
+
+    def send(self, playlist_position, media_time, playlist_version=0):
+        """
+        Sends a beacon datagram of the playlist position, the media time
+        in milliseconds (int) and the playlist version.
+        """
+        self.sequence = (self.sequence + 1) % SEQUENCE_MODULO
+        data = encode_frame(
+            FRAME_BEACON, self.sequence, playlist_position, media_time, playlist_version,
+        )
+        try:
+            self.sock.sendto(data, self.destination)
+        except OSError as exception:
+            print(f'Media Player Server exception while trying to send {data}: {exception}')
+
+
+class MulticastClient(SyncClient):
+    """
+    A client class for synchronisation over UDP. Receives beacons sent to a multicast
+    group, or broadcast, by the server at address, and drops stale or duplicate beacons.
+    """
+
+    def __init__(self, address, port, group, broadcast=False):
+        super().__init__()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('', port))
+        if not broadcast:
+            membership = struct.pack(
+                '4s4s', socket.inet_aton(group), socket.inet_aton('0.0.0.0'),
+            )
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        self.sock.settimeout(SYNC_RECEIVE_TIMEOUT)
+        try:
+            self.address = socket.gethostbyname(address)
+        except OSError:
+            self.address = address
+        self.port = port
+        self.reader = FrameReader(frames=1)
+        print(f'Listening for {self.address} on {"broadcast" if broadcast else group} '
+              f'port {port}')
+
+    def send_frame(self, data):
+        """
+        Send a frame to the server.
+        """
+        self.sock.sendto(data, (self.address, self.port))
+
+    @status_client.timed('sync_receive')
+    def receive(self):
+        """
+        Receives beacons from the server and returns a list of integers containing the
+        playlist position and time of the server player in milliseconds and its playlist
+        version from the newest one. Returns None if no beacon arrives within
+        SYNC_RECEIVE_TIMEOUT seconds.
+        """
+        try:
+            while True:
+                self.ping()
+                # Each datagram is one frame, so don't carry a truncated one over
+                self.reader.reset()
+                received, sender = self.sock.recvfrom_into(self.reader.view)
+                if sender[0] != self.address:
+                    continue
+                self.reader.length = received
+                server_state = self.handle_frames(self.reader.frames())
+                if server_state:
+                    return server_state
+        except OSError as exception:
+            print(f'No beacon received from {self.address}: {exception}')
+            return None
+
+    def close(self):
+        """
+        Stop listening for beacons.
+        """
+        self.sock.close()
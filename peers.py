@@ -0,0 +1,167 @@
+"""
+Shares stored resources between players on the local network, so a group of players
+showing the same playlist doesn't download each resource from the origin many times.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+import sentry_sdk
+
+import status_client
+from downloader import parse_checksum
+
+PEER_SHARING = os.getenv('PEER_SHARING', 'false') == 'true'
+PEER_PORT = int(os.getenv('PEER_PORT', '1008'))
+# The interface to share resources on, e.g. '10.0.0.11', or all of them if empty
+PEER_BIND = os.getenv('PEER_BIND', '')
+# Other players to fetch resources from, e.g. 'mp-2.local,10.0.0.12:1008'
+PEERS = os.getenv('PEERS', '')
+PEER_TIMEOUT = float(os.getenv('PEER_TIMEOUT', '2'))  # seconds
+
+# Resources are requested by their key, e.g. /resources/sha256-9f86d08...
+RESOURCE_PATH = re.compile(r'^/resources/([a-z0-9]+)-([0-9a-f]+)$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def peer_hosts(peers, sync_server=None):
+    """
+    Returns the host:port of each peer from a comma separated list of hosts,
+    with the sync server first if there is one.
+    """
+    hosts = []
+    for host in [sync_server] + peers.split(','):
+        host = (host or '').strip()
+        if host and ':' not in host:
+            host = f'{host}:{PEER_PORT}'
+        if host and host not in hosts:
+            hosts.append(host)
+    return hosts
+
+
+def parse_range(header, size):
+    """
+    Returns the first and last byte of a 'bytes=first-last' Range header for a file
+    of size bytes, or None for the whole file. Raises ValueError if it can't be satisfied.
+    """
+    match = RANGE.match(header or '')
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # The last bytes of the file
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+    if first > last:
+        raise ValueError(f'Range {header} is outside {size} bytes')
+    return first, last
+
+
+class PeerHandler(BaseHTTPRequestHandler):
+    """
+    Serves the resources in the server's content store that are stored under their
+    checksum, supporting Range requests so interrupted transfers can be resumed.
+    Only complete resources are served, and peers verify them against the checksum.
+    """
+
+    def do_GET(self):
+        self.send_resource(body=True)
+
+    def do_HEAD(self):
+        self.send_resource(body=False)
+
+    def send_resource(self, body):
+        """
+        Send a stored resource, or part of it.
+        """
+        match = RESOURCE_PATH.match(self.path)
+        store = self.server.store
+        if not match or match.group(1) not in hashlib.algorithms_available \
+                or not store.has('-'.join(match.groups())):
+            self.send_error(404)
+            return
+
+        with open(store.path('-'.join(match.groups())), 'rb') as open_file:
+            size = os.fstat(open_file.fileno()).st_size
+            try:
+                byte_range = parse_range(self.headers.get('Range'), size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            first, last = byte_range or (0, size - 1)
+            if byte_range:
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {first}-{last}/{size}')
+            else:
+                self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(last - first + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+            if body and last >= first:
+                try:
+                    sent = self.connection.sendfile(open_file, first, last - first + 1)
+                    status_client.PEER_BYTES_SERVED_COUNTER.inc(sent)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """
+        Don't log every request.
+        """
+
+
+def start_peer_server(store, port=PEER_PORT, bind=PEER_BIND):
+    """
+    Serve the content store's resources to peers on port from a daemon thread,
+    returning the server, or None if it couldn't listen on the port.
+    """
+    try:
+        server = ThreadingHTTPServer((bind, port), PeerHandler)
+    except OSError as exception:
+        print(f'Not sharing resources with peers, failed to listen on {bind}:{port}: {exception}')
+        sentry_sdk.capture_exception(exception)
+        return None
+    server.daemon_threads = True
+    server.store = store
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Peers:
+    """
+    Fetches resources from peers on the local network before the origin. Only resources
+    with a checksum are fetched from peers, so the downloader can verify them.
+    """
+
+    def __init__(self, downloader, hosts):
+        self.downloader = downloader
+        self.hosts = hosts
+
+    def fetch(self, key, local_path, checksum=None):
+        """
+        Download a resource from the first peer that has it to local_path,
+        returning True if one did, or False if it needs downloading from the origin.
+        """
+        if not self.hosts or not parse_checksum(checksum):
+            return False
+        for host in self.hosts:
+            url = f'http://{host}/resources/{key}'
+            try:
+                response = self.downloader.session.head(url, timeout=PEER_TIMEOUT)
+                if response.status_code != 200:
+                    continue
+                self.downloader.download(url, local_path, checksum)
+                status_client.PEER_DOWNLOADS_COUNTER.inc()
+                return True
+            except requests.exceptions.RequestException as exception:
+                print(f'Failed to fetch {key} from peer {host} with error {exception}')
+        return False
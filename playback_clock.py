@@ -0,0 +1,145 @@
+"""
+A playback clock that interpolates the VLC player's play time.
+"""
+
+import os
+import threading
+
+import vlc
+
+import vlc_events
+
+# How long without a time-changed event before the clock falls back to polling VLC
+CLOCK_EVENT_TIMEOUT = int(os.getenv('CLOCK_EVENT_TIMEOUT', '500'))  # milliseconds
+
+
+class PlaybackClock:
+    """
+    VLC only updates the time reported by get_time() every 250 ms or so, so this
+    clock records the VLC time alongside the libvlc clock at the moment it changed,
+    and interpolates between the two when asked for the current time.
+
+    It's updated by VLC's MediaPlayerTimeChanged events, or by observe() when
+    the caller polls VLC itself, so nothing needs to spin to keep it accurate.
+    The VLC time and the clock time it was recorded at are only read and written
+    together under the lock, so the status and sync threads see a consistent pair.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # The last time reported by VLC in milliseconds
+        self.vlc_time = 0
+        # The libvlc clock in milliseconds when vlc_time last changed
+        self.clock_time = 0
+        # The libvlc clock in milliseconds when the last time-changed event arrived
+        self.event_clock_time = None
+        self.playing = True
+        # The playback rate, as media time passes faster or slower than the clock
+        self.rate = 1.0
+
+    @staticmethod
+    def clock():
+        """
+        Returns the libvlc clock in milliseconds.
+        """
+        return int(vlc.libvlc_clock() / 1000)
+
+    def attach(self, player):
+        """
+        Subscribe to the VLC media player's events to keep the clock updated.
+        """
+        event_manager = player.event_manager()
+        vlc_events.subscribe(
+            event_manager, vlc.EventType.MediaPlayerTimeChanged, self.on_time_changed,
+        )
+        vlc_events.subscribe(event_manager, vlc.EventType.MediaPlayerPlaying, self.on_playing)
+        vlc_events.subscribe(event_manager, vlc.EventType.MediaPlayerPaused, self.on_stopped)
+        vlc_events.subscribe(event_manager, vlc.EventType.MediaPlayerStopped, self.on_stopped)
+        vlc_events.subscribe(
+            event_manager, vlc.EventType.MediaPlayerMediaChanged, self.on_media_changed,
+        )
+        vlc_events.subscribe(
+            event_manager, vlc.EventType.MediaPlayerEndReached, self.on_media_changed,
+        )
+
+    def on_time_changed(self, event):
+        """
+        VLC callback for a new play time.
+        """
+        clock_time = self.clock()
+        with self.lock:
+            self.vlc_time = event.u.new_time
+            self.clock_time = clock_time
+            self.event_clock_time = clock_time
+
+    def on_playing(self, _event):
+        """
+        VLC callback for playback starting or resuming.
+        """
+        with self.lock:
+            self.playing = True
+            self.clock_time = self.clock()
+
+    def on_media_changed(self, _event):
+        """
+        VLC callback for an item ending or a new one being set, so the old item's
+        time isn't carried over until the new item's first time-changed event.
+        """
+        clock_time = self.clock()
+        with self.lock:
+            self.vlc_time = 0
+            self.clock_time = clock_time
+            self.event_clock_time = None
+
+    def on_stopped(self, _event):
+        """
+        VLC callback for playback being paused or stopped.
+        """
+        with self.lock:
+            self.playing = False
+
+    def set_rate(self, rate):
+        """
+        Set the playback rate the play time is interpolated at.
+        """
+        with self.lock:
+            self.rate = rate
+
+    def is_fresh(self, clock_time):
+        """
+        Returns True if time-changed events are arriving, so VLC doesn't need to be polled.
+        """
+        with self.lock:
+            return (
+                self.event_clock_time is not None
+                and clock_time - self.event_clock_time < CLOCK_EVENT_TIMEOUT
+            )
+
+    def now(self, clock_time=None):
+        """
+        Returns the interpolated play time in milliseconds at clock_time (default now).
+        """
+        if clock_time is None:
+            clock_time = self.clock()
+        with self.lock:
+            if not self.playing or self.vlc_time == 0:
+                return self.vlc_time
+            return self.vlc_time + int((clock_time - self.clock_time) * self.rate)
+
+    def observe(self, vlc_time, clock_time):
+        """
+        Update the clock from a polled VLC time and return the interpolated play time.
+
+        If VLC's reported time hasn't changed, add to it the time elapsed since it last did.
+        If it did change, it's the correct time and the elapsed time is measured from now on.
+        """
+        # VLC reports -1 while there's no media playing
+        vlc_time = max(vlc_time, 0)
+        with self.lock:
+            if self.vlc_time == vlc_time and self.vlc_time != 0:
+                if not self.playing:
+                    return vlc_time
+                return vlc_time + int((clock_time - self.clock_time) * self.rate)
+            self.vlc_time = vlc_time
+            self.clock_time = clock_time
+            return vlc_time
@@ -0,0 +1,120 @@
+"""
+Watches XOS for playlist changes and hot-reloads them without restarting the player.
+"""
+
+import json
+import os
+import threading
+import zlib
+
+import vlc
+
+import vlc_events
+
+PLAYLIST_REFRESH_INTERVAL = float(os.getenv('PLAYLIST_REFRESH_INTERVAL', '300'))  # seconds
+
+
+def playlist_version(playlist_json_data):
+    """
+    Returns a 32 bit version of a playlist from XOS, which is the same on every player
+    that fetched the same playlist, so synced players can tell if they're playing it.
+    """
+    playlist_labels = playlist_json_data.get('playlist_labels')
+    return zlib.crc32(json.dumps(playlist_labels, sort_keys=True).encode('utf-8'))
+
+
+class PlaylistWatcher:  # pylint: disable=too-many-instance-attributes
+    """
+    Polls XOS for changes to the media player's playlist. When it changes, the new
+    resources are downloaded in the background and the new playlist is swapped in
+    when the current one loops back to its first item.
+
+    Nothing coordinates when the players in a synced group check XOS, so synced clients
+    follow_server instead: they keep the updated playlist until the sync server's beacons
+    show it's swapped to the same version at its loop boundary, and swap with it.
+    """
+
+    def __init__(self, media_player, interval=PLAYLIST_REFRESH_INTERVAL, follow_server=False):
+        self.media_player = media_player
+        # How often check is scheduled, zero to check once
+        self.interval = interval
+        self.follow_server = follow_server
+        self.lock = threading.Lock()
+        # The updated (playlist, media list, version) a synced client is waiting to swap in
+        self.pending = None
+        # The last version of the server's playlist a synced client checked XOS for
+        self.requested_version = None
+        self.next_item_set = threading.Event()
+        self.stopped = threading.Event()
+        vlc_events.subscribe(
+            media_player.vlc['list_player'].event_manager(),
+            vlc.EventType.MediaListPlayerNextItemSet,
+            self.on_next_item_set,
+        )
+
+    def on_next_item_set(self, _event):
+        """
+        VLC callback for the list player moving to another item.
+        """
+        self.next_item_set.set()
+
+    def wait_for_loop_boundary(self):
+        """
+        Block until the playlist loops back to its first item.
+        Returns immediately if there's nothing playing.
+        """
+        self.next_item_set.clear()
+        while self.media_player.playlist and not self.stopped.is_set():
+            if self.next_item_set.wait(timeout=1):
+                self.next_item_set.clear()
+                if self.media_player.get_current_playlist_position() == 0:
+                    return
+
+    def check(self):
+        """
+        Check XOS for a playlist change, and swap it in at the next loop boundary.
+        Returns True if the playlist was swapped.
+        """
+        updated_playlist = self.media_player.refresh_playlist()
+        if not updated_playlist:
+            return False
+        if self.follow_server:
+            with self.lock:
+                self.pending = updated_playlist
+            print('The updated playlist will be swapped in when the sync server plays it.')
+            return False
+        # The progressively loaded playlist mustn't be added to once it's swapped out
+        self.media_player.wait_until_loaded()
+        self.wait_for_loop_boundary()
+        if self.stopped.is_set():
+            return False
+        self.media_player.swap_playlist(*updated_playlist)
+        return True
+
+    def follow(self, version):
+        """
+        For a synced client, swap in the updated playlist once the sync server's beacons
+        carry its version, or check XOS straight away for a playlist the server has changed
+        to that the client hasn't downloaded. Returns True if the client is already playing
+        the same version of the playlist as the server.
+        """
+        if version == self.media_player.playlist_version:
+            return True
+        with self.lock:
+            updated_playlist = self.pending
+            if updated_playlist and updated_playlist[2] == version:
+                self.pending = None
+            else:
+                updated_playlist = None
+        if updated_playlist:
+            self.media_player.swap_playlist(*updated_playlist)
+        elif version != self.requested_version:
+            self.requested_version = version
+            self.media_player.scheduler.trigger('playlist_refresh')
+        return False
+
+    def stop(self):
+        """
+        Stop watching for changes.
+        """
+        self.stopped.set()
@@ -0,0 +1,77 @@
+"""
+Warms the head of the next playlist item in the page cache before the current one ends,
+so VLC doesn't stutter reading it cold from the SD card or USB storage.
+"""
+
+import os
+
+import status_client
+
+PREFETCH_LEAD_TIME = float(os.getenv('PREFETCH_LEAD_TIME', '10'))  # seconds
+PREFETCH_SIZE_MB = float(os.getenv('PREFETCH_SIZE_MB', '32'))
+PREFETCH_INTERVAL = float(os.getenv('PREFETCH_INTERVAL', '1'))  # seconds
+PREFETCH_CHUNK_SIZE = 1024 * 1024  # bytes
+
+
+def warm(local_path, size):
+    """
+    Ask the kernel to read the first size bytes of a file into the page cache,
+    or read them if it can't be asked.
+    """
+    with open(local_path, 'rb') as open_file:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(open_file.fileno(), 0, size, os.POSIX_FADV_WILLNEED)
+        else:
+            remaining = size
+            while remaining > 0 and open_file.read(min(PREFETCH_CHUNK_SIZE, remaining)):
+                remaining -= PREFETCH_CHUNK_SIZE
+
+
+class Prefetcher:
+    """
+    Checks the latest playback status, and lead_time seconds before the end of the
+    current item, warms the first size_mb megabytes of the next one.
+
+    When the playlist moves to another item, it's a hit if that item was warmed,
+    and a miss if it wasn't, e.g. after a seek or a short item.
+    """
+
+    def __init__(self, media_player, lead_time=PREFETCH_LEAD_TIME, size_mb=PREFETCH_SIZE_MB):
+        self.media_player = media_player
+        self.lead_time = lead_time
+        self.size = int(size_mb * 1024 * 1024)
+        # The resource last warmed, and the playlist position last seen
+        self.prefetched = None
+        self.playlist_position = None
+
+    def check(self):
+        """
+        Warm the next item if the current one is about to end, and count whether
+        a new item was warmed.
+        """
+        status = self.media_player.sampler.latest()
+        playlist = self.media_player.playlist
+        try:
+            playlist_position = status['playlist_position']
+            remaining = status['duration'] * (1 - status['playback_position']) / 1000
+            next_resource = playlist[(playlist_position + 1) % len(playlist)]['resource']
+            resource = playlist[playlist_position]['resource']
+        except (KeyError, IndexError, TypeError, ZeroDivisionError):
+            return
+
+        if playlist_position != self.playlist_position:
+            if self.playlist_position is not None:
+                if resource == self.prefetched:
+                    status_client.PREFETCH_HITS_COUNTER.inc()
+                else:
+                    status_client.PREFETCH_MISSES_COUNTER.inc()
+            self.playlist_position = playlist_position
+            self.prefetched = None
+
+        if status['duration'] > 0 and remaining <= self.lead_time \
+                and self.prefetched != next_resource:
+            try:
+                warm(next_resource, self.size)
+                self.prefetched = next_resource
+            except OSError as exception:
+                print(f'Failed to prefetch {next_resource}: {exception}')
@@ -0,0 +1,74 @@
+"""
+Thread stack dumps and a sampling profiler for a live media player, served on the
+status_client's Prometheus port.
+"""
+
+import collections
+import os
+import sys
+import threading
+import time
+import traceback
+
+PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', 'false').lower() == 'true'
+PROFILER_INTERVAL = float(os.getenv('PROFILER_INTERVAL', '0.01'))  # seconds
+PROFILER_MAX_DURATION = 60  # seconds
+# Only one profile runs at a time, as each one samples every thread
+_profile_lock = threading.Lock()
+
+
+def thread_names():
+    """
+    Returns the names of running threads keyed by their ident.
+    """
+    return {thread.ident: thread.name for thread in threading.enumerate()}
+
+
+def dump_stacks():
+    """
+    Returns the current stack of every thread as text.
+    """
+    names = thread_names()
+    lines = []
+    for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+        lines.append(f'Thread {names.get(ident, ident)} ({ident}):\n')
+        lines.extend(traceback.format_stack(frame))
+        lines.append('\n')
+    return ''.join(lines)
+
+
+def collapse_stack(frame):
+    """
+    Returns a frame's stack from the outermost call in py-spy's raw format,
+    e.g. 'run (media_player.py:123);sample (status_sampler.py:45)'.
+    """
+    calls = []
+    while frame is not None:
+        code = frame.f_code
+        calls.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(calls))
+
+
+def profile(seconds, interval=PROFILER_INTERVAL):
+    """
+    Samples the stacks of every thread but this one for seconds, and returns them as
+    collapsed stacks with the number of times each was seen, one per line, which can be
+    rendered by flamegraph.pl, speedscope or py-spy's tooling. Returns None if another
+    profile is already running.
+    """
+    if not _profile_lock.acquire(blocking=False):  # pylint: disable=consider-using-with
+        return None
+    try:
+        counts = collections.Counter()
+        this_thread = threading.get_ident()
+        deadline = time.monotonic() + min(seconds, PROFILER_MAX_DURATION)
+        while time.monotonic() < deadline:
+            names = thread_names()
+            for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if ident != this_thread:
+                    counts[f'{names.get(ident, ident)};{collapse_stack(frame)}'] += 1
+            time.sleep(interval)
+    finally:
+        _profile_lock.release()
+    return ''.join(f'{stack} {count}\n' for stack, count in counts.most_common())
@@ -0,0 +1,154 @@
+"""
+Keeps the resources of recent playlists within a disk budget, evicting the least
+recently used when space is needed.
+"""
+
+import os
+import threading
+from collections import Counter
+from urllib.parse import urlparse
+
+import status_client
+from content_store import name_subtitles
+from downloader import PARTIAL_SUFFIX
+
+RESOURCE_CACHE_BUDGET_MB = float(os.getenv('RESOURCE_CACHE_BUDGET_MB', '0'))
+
+
+def playlist_filenames(playlist):
+    """
+    Returns the filenames of the resources and subtitles a playlist needs.
+    """
+    filenames = set()
+    for item in playlist:
+        try:
+            resource = urlparse(item.get('resource')).path.split('/')[-1]
+        except TypeError:
+            resource = None
+        if resource:
+            filenames.add(resource)
+            try:
+                filenames.add(name_subtitles(resource, item.get('subtitles')))
+            except TypeError:
+                pass
+    filenames.discard(None)
+    return filenames
+
+
+def stored_as(filename, entry):
+    """
+    Returns the content store key a manifest entry is linked to, or its filename if
+    it isn't in the store.
+    """
+    return entry.get('key') or filename
+
+
+class ResourceCache:
+    """
+    Tracks the resources in the resources directory with the resource manifest as its
+    index. The current playlist's resources are always kept, and resources from previous
+    playlists are kept while the cache fits in budget_mb megabytes, so switching back to
+    a recent playlist doesn't download its resources again. A budget of zero only keeps
+    the current playlist's resources.
+
+    The directory is scanned once at startup to reconcile the index with the files on
+    disk, after which the index is kept up to date as resources are downloaded and evicted.
+    Partial downloads are kept in the content store, which gives up on them once they're old.
+    """
+
+    def __init__(self, manifest, directory, budget_mb=RESOURCE_CACHE_BUDGET_MB, store=None):
+        self.manifest = manifest
+        self.directory = directory
+        # The content store evicted resources are linked from, if there is one
+        self.store = store
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        # Filenames needed by the current playlist
+        self.pinned = set()
+        self.reconcile()
+
+    def reconcile(self):
+        """
+        Drop index entries for files that are gone and add files that aren't indexed.
+        They're recorded without a checksum, so they're verified against their checksum
+        from XOS before they're played, like resources cached before the manifest existed.
+        Partial downloads from before resources were downloaded into the content store
+        are deleted, as they won't be resumed.
+        """
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        with os.scandir(self.directory) as entries:
+            on_disk = {entry.name for entry in entries if entry.is_file()}
+        for filename in set(self.manifest.entries) - on_disk:
+            self.manifest.remove(filename)
+        for filename in on_disk - set(self.manifest.entries):
+            if filename.endswith(PARTIAL_SUFFIX):
+                self.delete(filename)
+            else:
+                self.manifest.record(os.path.join(self.directory, filename))
+                # Least recently used, as it's unknown when it was last played
+                self.manifest.touch([filename], last_used=0)
+
+    def retain(self, playlist):
+        """
+        Pin the resources of a new playlist, and release the previous playlist's to be
+        evicted when space is needed. Returns the filenames deleted.
+        """
+        filenames = playlist_filenames(playlist)
+        with self.lock:
+            released = self.pinned - filenames
+            # The released resources were played until now
+            self.manifest.touch(released | filenames)
+            self.pinned = filenames
+        return self.evict()
+
+    def evict(self):
+        """
+        Delete the least recently used resources that aren't pinned until the cache fits
+        its budget. Returns the filenames deleted.
+        """
+        deleted = []
+        with self.lock:
+            with self.manifest.lock:
+                entries = dict(self.manifest.entries)
+            # Filenames linked to the same stored resource only take up its size once,
+            # and it's only freed once none of them are left
+            sizes = {}
+            links = Counter()
+            for filename, entry in entries.items():
+                sizes[stored_as(filename, entry)] = entry['size']
+                links[stored_as(filename, entry)] += 1
+            total = sum(sizes.values())
+            pinned = {
+                stored_as(filename, entries[filename]) for filename in self.pinned & set(entries)
+            }
+            unpinned = sorted(
+                (entry.get('last_used', 0), filename)
+                for filename, entry in entries.items()
+                if filename not in self.pinned and stored_as(filename, entry) not in pinned
+            )
+            for _, filename in unpinned:
+                if total <= self.budget:
+                    break
+                self.delete(filename)
+                self.manifest.remove(filename)
+                if self.store:
+                    self.store.release(entries[filename].get('key'))
+                stored = stored_as(filename, entries[filename])
+                links[stored] -= 1
+                if not links[stored]:
+                    total -= entries[filename]['size']
+                deleted.append(filename)
+        status_client.RESOURCE_CACHE_SIZE_GAUGE.set(total)
+        return deleted
+
+    def delete(self, filename):
+        """
+        Delete a file from the resources directory. Returns True if it existed.
+        """
+        file_to_delete = os.path.join(self.directory, filename)
+        if not os.path.isfile(file_to_delete):
+            return False
+        print(f'Deleting unneeded media file: {file_to_delete}')
+        os.remove(file_to_delete)
+        return True
@@ -0,0 +1,145 @@
+"""
+Runs the media player's periodic tasks from one thread that sleeps until the next task
+is due, on a small pool of worker threads so a blocking VLC, ALSA or network call in
+one task doesn't hold up the others.
+"""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import sentry_sdk
+
+import status_client
+
+SCHEDULER_WORKERS = int(os.getenv('SCHEDULER_WORKERS', '4'))
+
+
+def only_while(condition, function):
+    """
+    Returns a task that calls function, skipping its runs while condition() is false.
+    """
+    def task():
+        if condition():
+            function()
+    return task
+
+
+class Task:  # pylint: disable=too-few-public-methods
+    """
+    A function run every interval seconds, or once if the interval is zero.
+    """
+
+    def __init__(self, name, function, interval):
+        self.name = name
+        self.function = function
+        self.interval = interval
+        # When the task is next due, or None while it's running or once it's finished
+        self.due = None
+        self.running = False
+        # Whether to run again as soon as the current run finishes
+        self.triggered = False
+
+
+class Scheduler:
+    """
+    Schedules tasks by when they're next due. A task doesn't run again until its last
+    run has finished, and a task that overruns its interval runs again straight away
+    rather than trying to catch up on the runs it missed.
+    """
+
+    def __init__(self, workers=SCHEDULER_WORKERS):
+        self.condition = threading.Condition()
+        # A heap of (due, sequence, task), where entries whose due time no longer
+        # matches their task's were superseded by a trigger and are skipped
+        self.queue = []
+        self.sequence = itertools.count()
+        self.tasks = {}
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='scheduler')
+        self.stopped = False
+
+    def every(self, name, interval, function, delay=0):
+        """
+        Run function every interval seconds, first after delay seconds.
+        An interval of zero runs it once.
+        """
+        task = Task(name, function, interval)
+        with self.condition:
+            self.tasks[name] = task
+            self.push(task, time.monotonic() + delay)
+        return task
+
+    def push(self, task, due):
+        """
+        Queue a task to run at due. Called with the condition held.
+        """
+        task.due = due
+        heapq.heappush(self.queue, (due, next(self.sequence), task))
+        self.condition.notify()
+
+    def trigger(self, name):
+        """
+        Run a task straight away, or as soon as its current run finishes.
+        It doesn't call libvlc, so it's safe to call from VLC callbacks.
+        """
+        with self.condition:
+            task = self.tasks.get(name)
+            if task is None:
+                return
+            if task.running:
+                task.triggered = True
+            elif task.due is not None:
+                self.push(task, time.monotonic())
+
+    def run(self):
+        """
+        Hand each task to the workers when it's due, until stopped.
+        """
+        with self.condition:
+            while not self.stopped:
+                while self.queue and self.queue[0][2].due != self.queue[0][0]:
+                    heapq.heappop(self.queue)
+                if not self.queue:
+                    self.condition.wait()
+                    continue
+                due, _, task = self.queue[0]
+                now = time.monotonic()
+                if due > now:
+                    self.condition.wait(due - now)
+                    continue
+                heapq.heappop(self.queue)
+                task.due = None
+                task.running = True
+                self.executor.submit(self.run_task, task, due)
+
+    def run_task(self, task, due):
+        """
+        Run a task on a worker and schedule its next run.
+        """
+        started = time.monotonic()
+        try:
+            task.function()
+        except Exception as exception:  # pylint: disable=broad-except
+            print(f'Scheduled task {task.name} failed: {exception}')
+            sentry_sdk.capture_exception(exception)
+        finished = time.monotonic()
+        status_client.STATUS_LOOP_LATENCY.labels(loop=task.name).observe(finished - started)
+        with self.condition:
+            task.running = False
+            if task.triggered:
+                task.triggered = False
+                self.push(task, finished)
+            elif task.interval:
+                self.push(task, max(due + task.interval, finished))
+
+    def stop(self):
+        """
+        Stop scheduling tasks, letting any that are running finish.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.executor.shutdown(wait=False)
@@ -1,20 +1,180 @@
 import os
+import threading
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
 
-from prometheus_client import Counter, Gauge, Info, start_http_server
+from prometheus_client import (REGISTRY, Counter, Enum, Gauge, Histogram, Info,
+                               MetricsHandler)
+from prometheus_client.core import GaugeMetricFamily
+
+import profiler
 
 DEVICE_INFO = Info('device', 'Device')
 FILENAME_INFO = Info('filename', 'Filename')
-DURATION_GAUGE = Gauge('duration', 'Duration')
-PLAYBACK_POSITION_GAUGE = Gauge('playback_position', 'Playback position')
 LOOP_COUNTER = Counter('number_loops', 'Number of loops')
-PLAYLIST_POSITION_GAUGE = Gauge('position_playlist', 'Position in playlist')
 LABEL_INFO = Info('label', 'Label')
-DROPPED_AUDIO_FRAMES_GAUGE = Gauge('dropped_audio_frames', 'Dropped audio frames')
-DROPPED_VIDEO_FRAMES_GAUGE = Gauge('dropped_video_frames', 'Dropped video frames')
-PLAYER_VOLUME_GAUGE = Gauge('player_volume', 'VLC volume')
-SYSTEM_VOLUME_GAUGE = Gauge('system_volume', 'System volume')
+DROPPED_AUDIO_FRAMES_COUNTER = Counter('dropped_audio_frames', 'Dropped audio frames')
+DROPPED_VIDEO_FRAMES_COUNTER = Counter('dropped_video_frames', 'Dropped video frames')
+PREFETCH_HITS_COUNTER = Counter(
+    'prefetch_hits', 'Playlist items that were prefetched before they started playing',
+)
+PREFETCH_MISSES_COUNTER = Counter(
+    'prefetch_misses', 'Playlist items that started playing without being prefetched',
+)
+STATUS_LOOP_LATENCY = Histogram(
+    'status_loop_latency_seconds',
+    'Time taken by each pass of the status sampling and publishing loops',
+    ['loop'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0),
+)
+OPERATION_LATENCY = Histogram(
+    'operation_latency_seconds',
+    'Time taken by operations on the media player hot paths',
+    ['operation'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+AMQP_PUBLISH_LATENCY = Histogram(
+    'amqp_publish_latency_seconds',
+    'Time taken to publish a playback status message to the broker',
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0),
+)
+AMQP_RECONNECT_COUNTER = Counter('amqp_reconnects', 'Number of reconnections to the broker')
+DOWNLOAD_THROUGHPUT_GAUGE = Gauge(
+    'download_throughput_bytes',
+    'Throughput of the last download of each resource in bytes per second',
+    ['filename'],
+)
+DOWNLOAD_BYTES_COUNTER = Counter('download_bytes', 'Bytes of resources downloaded')
+DOWNLOAD_THROTTLE_RATE_GAUGE = Gauge(
+    'download_throttle_rate_bytes',
+    'Rate downloads are limited to in bytes per second, 0 when they are not limited',
+)
+DOWNLOAD_THROTTLE_STATE = Enum(
+    'download_throttle_state',
+    'Whether downloads are limited, and whether they are backing off to protect playback',
+    states=['unlimited', 'limited', 'backing_off'],
+)
+DOWNLOAD_THROTTLE_WAIT_COUNTER = Counter(
+    'download_throttle_wait_seconds', 'Time downloads have waited to keep to the rate limit',
+)
+PEER_DOWNLOADS_COUNTER = Counter(
+    'peer_downloads', 'Resources downloaded from peers on the local network instead of the origin',
+)
+PEER_BYTES_SERVED_COUNTER = Counter('peer_bytes_served', 'Bytes of resources served to peers')
+RESOURCE_CACHE_SIZE_GAUGE = Gauge(
+    'resource_cache_bytes',
+    'Size of the resources kept in the resource cache in bytes',
+)
+SYNC_ROUND_TRIP_GAUGE = Gauge(
+    'sync_round_trip_seconds',
+    'Round trip time to the sync server used for the clock offset estimate',
+)
+SYNC_CLOCK_OFFSET_GAUGE = Gauge(
+    'sync_clock_offset_seconds',
+    'Estimated offset of the sync server clock from this player',
+)
+SYNC_DRIFT_GAUGE = Gauge(
+    'sync_drift_seconds',
+    'Residual drift of playback from the sync server, positive when ahead',
+)
+SYNC_PLAYBACK_RATE_GAUGE = Gauge('sync_playback_rate', 'Playback rate used to correct drift')
+SYNC_CONVERGENCE_TIME = Histogram(
+    'sync_convergence_seconds',
+    'Time taken to correct drift from the sync server by adjusting the playback rate',
+    buckets=(.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0),
+)
+SYNC_SEEK_COUNTER = Counter('sync_seeks', 'Number of seeks to correct drift from the sync server')
+SYNC_CONNECTION_STATE = Enum(
+    'sync_connection_state',
+    'State of the sync client connection to the sync server',
+    states=['disconnected', 'connecting', 'connected'],
+)
 PROMETHEUS_PORT = int(os.getenv("PROMETHEUS_PORT", "1007"))
 
+# Playback gauges read from the media player status when Prometheus scrapes
+STATUS_GAUGES = (
+    ('duration', 'Duration', 'duration'),
+    ('playback_position', 'Playback position', 'playback_position'),
+    ('position_playlist', 'Position in playlist', 'playlist_position'),
+    ('player_volume', 'VLC volume', 'player_volume'),
+    ('system_volume', 'System volume', 'system_volume'),
+)
+
+
+class StatusCollector:
+    """
+    Collects the playback gauges from the latest media player status when Prometheus
+    scrapes, rather than setting them every time the status is sampled.
+    """
+
+    def __init__(self):
+        # Returns the latest media player status
+        self.source = None
+        self.status = None
+
+    def watch(self, source):
+        """
+        Read the status from source() when scraped.
+        """
+        self.source = source
+
+    def update(self, media_player_status):
+        """
+        Set the status to export if there's no source to read it from.
+        """
+        self.status = media_player_status
+
+    def collect(self):
+        """
+        Yields a gauge for each playback value in the latest status.
+        """
+        status = self.source() if self.source else self.status
+        if not status or 'error' in status:
+            return
+        for name, documentation, key in STATUS_GAUGES:
+            if status.get(key) is not None:
+                yield GaugeMetricFamily(name, documentation, value=float(status[key]))
+
+
+STATUS_COLLECTOR = StatusCollector()
+REGISTRY.register(STATUS_COLLECTOR)
+
+
+def timed(operation):
+    """
+    Returns a timer for an operation, which can be used as a decorator or in a with block,
+    and observes its duration in the operation latency histogram.
+    """
+    return OPERATION_LATENCY.labels(operation=operation).time()
+
+
+# The last values set on each info metric, and the last dropped frame totals
+_last_info = {}
+_last_dropped_frames = {}
+
+
+def set_info(metric, value):
+    """
+    Set an info metric's value if it's changed.
+    """
+    if _last_info.get(metric) != value:
+        metric.info(value)
+        _last_info[metric] = value
+
+
+def count_dropped_frames(counter, total):
+    """
+    Add the frames dropped since the last total to a counter. VLC's totals are per media,
+    so a total lower than the last one started again from zero on another item.
+    """
+    if total is None:
+        return
+    last_total = _last_dropped_frames.get(counter, 0)
+    dropped = total - last_total if total >= last_total else total
+    if dropped:
+        counter.inc(dropped)
+    _last_dropped_frames[counter] = total
+
 
 def set_status(
         uuid,
@@ -23,23 +183,66 @@ def set_status(
         media_player_status,
         ):
     """
-    Sets values in the prometheus client's gauges and info metrics.
+    Sets values in the prometheus client's info metrics and counters when they've changed.
     """
-    DEVICE_INFO.info({
+    set_info(DEVICE_INFO, {
         'uuid': uuid,
         'name': device_name
     })
-    FILENAME_INFO.info({'filename': str(filename)})
-    DURATION_GAUGE.set(media_player_status['duration'])
-    PLAYBACK_POSITION_GAUGE.set(media_player_status['playback_position'])
-    PLAYLIST_POSITION_GAUGE.set(media_player_status['playlist_position'])
-    LABEL_INFO.info({'id': str(media_player_status['label_id'])})
-    if media_player_status['dropped_audio_frames']:
-        DROPPED_AUDIO_FRAMES_GAUGE.set(media_player_status['dropped_audio_frames'])
-    if media_player_status['dropped_video_frames']:
-        DROPPED_VIDEO_FRAMES_GAUGE.set(media_player_status['dropped_video_frames'])
-    PLAYER_VOLUME_GAUGE.set(media_player_status['player_volume'])
-    SYSTEM_VOLUME_GAUGE.set(media_player_status['system_volume'])
-
-
-start_http_server(PROMETHEUS_PORT)
+    set_info(FILENAME_INFO, {'filename': str(filename)})
+    set_info(LABEL_INFO, {'id': str(media_player_status['label_id'])})
+    count_dropped_frames(DROPPED_AUDIO_FRAMES_COUNTER, media_player_status['dropped_audio_frames'])
+    count_dropped_frames(DROPPED_VIDEO_FRAMES_COUNTER, media_player_status['dropped_video_frames'])
+    STATUS_COLLECTOR.update(media_player_status)
+
+
+class StatusHandler(MetricsHandler):
+    """
+    Serves the metrics, with thread stack dumps on /debug/stacks, and if the profiler is
+    enabled, collapsed stacks sampled for a number of seconds on /debug/profile?seconds=10.
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/debug/stacks':
+            self.send_text(200, profiler.dump_stacks())
+        elif url.path == '/debug/profile':
+            if not profiler.PROFILER_ENABLED:
+                self.send_text(404, 'The profiler is disabled, set PROFILER_ENABLED=true\n')
+                return
+            try:
+                seconds = float(parse_qs(url.query).get('seconds', ['10'])[0])
+            except ValueError:
+                self.send_text(400, 'seconds should be a number\n')
+                return
+            stacks = profiler.profile(seconds)
+            if stacks is None:
+                self.send_text(409, 'A profile is already running\n')
+            else:
+                self.send_text(200, stacks)
+        else:
+            super().do_GET()
+
+    def send_text(self, status, text):
+        """
+        Send a plain text response.
+        """
+        body = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_status_server(port):
+    """
+    Serve the metrics and debug endpoints on port from a daemon thread.
+    """
+    server = ThreadingHTTPServer(('', port), StatusHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+start_status_server(PROMETHEUS_PORT)
@@ -0,0 +1,161 @@
+"""
+Samples the media player's playback status for the broker and Prometheus publishers.
+"""
+
+import os
+import select
+import threading
+import time
+from datetime import datetime
+
+import alsaaudio
+import vlc
+
+import status_client
+import vlc_events
+
+STATUS_SAMPLE_INTERVAL = float(os.getenv('STATUS_SAMPLE_INTERVAL', '0.1'))  # seconds
+# How long to wait before trying to open the ALSA mixer again after it failed
+MIXER_RETRY_INTERVAL = 10  # seconds
+
+
+class StatusSampler:  # pylint: disable=too-many-instance-attributes
+    """
+    Samples the playback status into a preallocated record that publishers read at their
+    own rates with latest(), so sampling VLC doesn't depend on how often it's published.
+
+    The ALSA mixer is opened once and only read again when it reports a change, and the
+    playlist position is only looked up when VLC's list player moves to another item.
+    """
+
+    def __init__(self, media_player, playlist_id, media_player_id, timezone):
+        self.media_player = media_player
+        self.timezone = timezone
+        self.lock = threading.Lock()
+        self.stats = vlc.MediaStats()
+        self.mixer = None
+        self.mixer_poll = None
+        self.next_mixer_attempt = 0
+        self.system_volume = 0
+        self.item_changed = True
+        self.playlist_position = None
+        self.sampled_at = None
+        self.status = {
+            'datetime': None,
+            'playlist_id': int(playlist_id),
+            'media_player_id': int(media_player_id),
+            'label_id': None,
+            'playlist_position': None,
+            'playback_position': None,
+            'dropped_audio_frames': None,
+            'dropped_video_frames': None,
+            'duration': None,
+            'player_volume': None,
+            'system_volume': None,
+        }
+        self.error_status = {
+            'error': f'No playable items in playlist {int(playlist_id)} '
+                     f'on mediaplayer {int(media_player_id)}',
+        }
+        self.has_media = False
+        vlc_events.subscribe(
+            media_player.vlc['list_player'].event_manager(),
+            vlc.EventType.MediaListPlayerNextItemSet,
+            self.on_next_item_set,
+        )
+
+    def on_next_item_set(self, _event):
+        """
+        VLC callback for the list player moving to another item.
+        """
+        self.item_changed = True
+
+    def get_playlist_position(self, media):
+        """
+        Returns the playlist position of the playing media, only looking it up
+        in the VLC playlist when the list player has moved to another item.
+        """
+        if self.item_changed:
+            self.item_changed = False
+            self.playlist_position = self.media_player.vlc['playlist'].index_of_item(media)
+        return self.playlist_position
+
+    @status_client.timed('alsa_volume')
+    def get_system_volume(self):
+        """
+        Returns the system volume (0-10) from the ALSA mixer, opening the mixer once
+        and only reading the volume again when ALSA reports a change.
+        """
+        if self.mixer is None:
+            if time.monotonic() < self.next_mixer_attempt:
+                return self.system_volume
+            try:
+                self.mixer = alsaaudio.Mixer(alsaaudio.mixers()[0])
+                self.mixer_poll = select.poll()
+                for file_descriptor, event_mask in self.mixer.polldescriptors():
+                    self.mixer_poll.register(file_descriptor, event_mask)
+            except (alsaaudio.ALSAAudioError, IndexError):
+                self.mixer = None
+                self.next_mixer_attempt = time.monotonic() + MIXER_RETRY_INTERVAL
+                self.system_volume = 0
+                return self.system_volume
+        elif self.mixer_poll.poll(0):
+            self.mixer.handleevents()
+        else:
+            return self.system_volume
+        try:
+            # System value 0-100
+            self.system_volume = str(self.mixer.getvolume()[0] / 10)
+        except alsaaudio.ALSAAudioError:
+            self.mixer = None
+            self.system_volume = 0
+        return self.system_volume
+
+    @status_client.timed('status_sample')
+    def sample(self):
+        """
+        Sample the playback status into the status record and return a copy of it.
+        """
+        player = self.media_player.vlc['player']
+        media = player.get_media()
+        if media:
+            media.get_stats(self.stats)
+            playlist_position = self.get_playlist_position(media)
+            try:
+                label_id = self.media_player.playlist[playlist_position]['label']['id']
+            except (TypeError, IndexError):
+                # No label ID for this playlist item
+                label_id = None
+            system_volume = self.get_system_volume()
+            with self.lock:
+                self.has_media = True
+                self.sampled_at = time.time()
+                self.status['label_id'] = label_id
+                self.status['playlist_position'] = playlist_position
+                self.status['playback_position'] = player.get_position()
+                self.status['dropped_audio_frames'] = self.stats.lost_abuffers
+                self.status['dropped_video_frames'] = self.stats.lost_pictures
+                self.status['duration'] = player.get_length()
+                # Player value 0-256
+                self.status['player_volume'] = str(player.audio_get_volume() / 256 * 10)
+                self.status['system_volume'] = system_volume
+        else:
+            # playlist is empty
+            with self.lock:
+                self.has_media = False
+                self.sampled_at = time.time()
+        return self.latest()
+
+    def latest(self):
+        """
+        Returns a copy of the most recent status sample, sampling now if there isn't one.
+        """
+        if self.sampled_at is None:
+            return self.sample()
+        with self.lock:
+            if not self.has_media:
+                return dict(self.error_status)
+            status = dict(self.status)
+            sampled_at = self.sampled_at
+        status['datetime'] = datetime.fromtimestamp(sampled_at, self.timezone).isoformat()
+        return status
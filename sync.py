@@ -0,0 +1,154 @@
+"""
+Drift correction for synced client players, and beacon scheduling for the sync server.
+"""
+
+import os
+import time
+
+import vlc
+
+import status_client
+import vlc_events
+
+# Largest change to the playback rate used to correct drift, e.g. 0.05 plays at 95-105%
+SYNC_MAX_RATE_ADJUST = float(os.getenv('SYNC_MAX_RATE_ADJUST', '0.05'))
+# Rate adjustment per second of drift
+SYNC_RATE_GAIN = float(os.getenv('SYNC_RATE_GAIN', '0.5'))
+# Rate adjustment per second of drift accumulated each second
+SYNC_RATE_INTEGRAL_GAIN = float(os.getenv('SYNC_RATE_INTEGRAL_GAIN', '0.05'))
+# Drift is corrected until it's within this fraction of the drift threshold
+SYNC_SETTLE_FRACTION = 0.25
+# Longest gap between drift measurements that's integrated, e.g. after a pause
+MAX_INTEGRATION_INTERVAL = 5  # seconds
+SYNC_BEACON_INTERVAL = float(os.getenv('SYNC_BEACON_INTERVAL', '0.5'))  # seconds
+# A jump in the play time this far from where it was expected to be is taken to be a seek
+SEEK_DETECTION_THRESHOLD = 1000  # milliseconds
+
+
+class DriftController:
+    """
+    Corrects drift from the sync server by playing slightly faster or slower, with a PI
+    controller on the drift, rather than seeking, which stutters while VLC decodes from
+    the previous keyframe.
+
+    Drift beyond threshold milliseconds starts a correction, which continues until the
+    drift has settled well within the threshold so it doesn't hover at its edge.
+    """
+
+    def __init__(self, media_player, threshold, max_adjust=SYNC_MAX_RATE_ADJUST):
+        self.media_player = media_player
+        self.threshold = threshold
+        self.max_adjust = max_adjust
+        self.rate = 1.0
+        self.integral = 0.0
+        self.last_update = None
+        # When the current correction started, or None if the player is in sync
+        self.correction_started = None
+
+    def set_rate(self, rate):
+        """
+        Set the media player's playback rate if it's changed.
+        """
+        if rate != self.rate:
+            self.rate = rate
+            self.media_player.vlc['player'].set_rate(rate)
+            self.media_player.clock.set_rate(rate)
+            status_client.SYNC_PLAYBACK_RATE_GAUGE.set(rate)
+
+    def reset(self):
+        """
+        Forget the drift history and play at normal speed after a seek or playlist change.
+        """
+        self.integral = 0.0
+        self.last_update = None
+        self.correction_started = None
+        self.set_rate(1.0)
+
+    def correct(self, drift, now=None):
+        """
+        Correct a drift of the client ahead of the server by drift milliseconds,
+        which is negative when the client is behind.
+        """
+        self.set_rate(self.update(drift, now))
+
+    def update(self, drift, now=None):
+        """
+        Returns the playback rate that corrects a drift of drift milliseconds.
+        """
+        if now is None:
+            now = time.monotonic()
+        status_client.SYNC_DRIFT_GAUGE.set(drift / 1000)
+
+        if self.correction_started is None:
+            if abs(drift) <= self.threshold:
+                return self.rate
+            self.correction_started = now
+        elif abs(drift) <= self.threshold * SYNC_SETTLE_FRACTION:
+            status_client.SYNC_CONVERGENCE_TIME.observe(now - self.correction_started)
+            self.integral = 0.0
+            self.last_update = None
+            self.correction_started = None
+            return 1.0
+
+        elapsed = 0
+        if self.last_update is not None:
+            elapsed = min(now - self.last_update, MAX_INTEGRATION_INTERVAL)
+        self.last_update = now
+        error = drift / 1000
+        integral = self.integral + error * elapsed
+        adjust = SYNC_RATE_GAIN * error + SYNC_RATE_INTEGRAL_GAIN * integral
+        if abs(adjust) < self.max_adjust:
+            # Only integrate while the rate isn't limited, so the integral doesn't wind up
+            self.integral = integral
+        adjust = max(-self.max_adjust, min(adjust, self.max_adjust))
+        return round(1.0 - adjust, 4)
+
+
+class BeaconScheduler:
+    """
+    Triggers the sync server's beacon straight away whenever the server moves to
+    another playlist item, pauses, resumes or seeks, so clients follow those changes
+    without waiting for the next scheduled beacon.
+
+    A change calls trigger, which makes the beacon task due straight away. It's called
+    from VLC callbacks, so it mustn't call libvlc.
+    """
+
+    def __init__(self, media_player, trigger):
+        self.trigger = trigger
+        # The last time-changed event's play time and when it arrived
+        self.last_time = None
+        vlc_events.subscribe(
+            media_player.vlc['list_player'].event_manager(),
+            vlc.EventType.MediaListPlayerNextItemSet,
+            self.on_change,
+        )
+        event_manager = media_player.vlc['player'].event_manager()
+        for event_type in (
+                vlc.EventType.MediaPlayerPlaying,
+                vlc.EventType.MediaPlayerPaused,
+                vlc.EventType.MediaPlayerStopped,
+        ):
+            vlc_events.subscribe(event_manager, event_type, self.on_change)
+        vlc_events.subscribe(
+            event_manager, vlc.EventType.MediaPlayerTimeChanged, self.on_time_changed,
+        )
+
+    def on_change(self, _event):
+        """
+        VLC callback for a change that clients should hear about straight away.
+        """
+        self.trigger()
+
+    def on_time_changed(self, event):
+        """
+        VLC callback for a new play time, which triggers a beacon if it jumped.
+        """
+        now = time.monotonic()
+        new_time = event.u.new_time
+        if self.last_time is not None:
+            last_time, last_changed = self.last_time
+            expected_time = last_time + (now - last_changed) * 1000
+            if abs(new_time - expected_time) > SEEK_DETECTION_THRESHOLD:
+                self.trigger()
+        self.last_time = (new_time, now)
@@ -0,0 +1,106 @@
+import os
+
+from content_store import ContentStore, name_subtitles, resource_key
+from manifest import ResourceManifest
+
+CHECKSUM = '9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08'
+
+
+def test_content_store_links_stored_resources(tmp_path):
+    """
+    Test that a resource stored under its checksum is linked under other names
+    rather than downloaded again, and deleted once nothing links to it.
+    """
+    resources = tmp_path / 'resources'
+    resources.mkdir()
+    manifest = ResourceManifest(str(tmp_path / 'manifest.json'))
+    store = ContentStore(manifest, str(tmp_path / 'store'))
+
+    url = 'https://xos/a/video.mp4'
+    key = resource_key(url, CHECKSUM)
+    assert key == f'sha256-{CHECKSUM}'
+    assert not store.make_available(str(resources / 'video.mp4'), CHECKSUM, url)
+
+    # Downloaded into the store and linked into place
+    with open(store.path(key), 'wb') as resource:
+        resource.write(b'test')
+    store.link(key, str(resources / 'video.mp4'), CHECKSUM)
+
+    # The same file under another name and URL
+    assert store.make_available(str(resources / 'copy.mp4'), CHECKSUM, 'https://xos/b/copy.mp4')
+    assert os.path.samefile(resources / 'video.mp4', resources / 'copy.mp4')
+    assert store.key_of('copy.mp4') == key
+
+    os.remove(resources / 'video.mp4')
+    store.release(key)
+    assert store.has(key)
+    os.remove(resources / 'copy.mp4')
+    store.release(key)
+    assert not store.has(key)
+
+
+def test_content_store_ingests_existing_resources(tmp_path):
+    """
+    Test that resources downloaded before the store existed are stored without downloading,
+    once they've been verified against their checksum.
+    """
+    resources = tmp_path / 'resources'
+    resources.mkdir()
+    with open(resources / 'video.mp4', 'wb') as resource:
+        resource.write(b'test')
+    manifest = ResourceManifest(str(tmp_path / 'manifest.json'))
+    store = ContentStore(manifest, str(tmp_path / 'store'))
+
+    url = 'https://xos/video.mp4'
+    assert store.make_available(str(resources / 'video.mp4'), url=url)
+    assert store.has(resource_key(url))
+    assert store.key_of('video.mp4') == resource_key(url)
+
+    # A file cut short before the manifest existed isn't trusted
+    with open(resources / 'truncated.mp4', 'wb') as resource:
+        resource.write(b'tes')
+    assert not store.make_available(str(resources / 'truncated.mp4'), CHECKSUM)
+    with open(resources / 'truncated.mp4', 'ab') as resource:
+        resource.write(b't')
+    assert store.make_available(str(resources / 'truncated.mp4'), CHECKSUM)
+    assert manifest.get(str(resources / 'truncated.mp4'))['checksum'] == CHECKSUM
+
+    # A corrupt file isn't stored under the checksum it should have
+    with open(resources / 'corrupt.mp4', 'wb') as resource:
+        resource.write(b'tent')
+    manifest.record(str(resources / 'corrupt.mp4'))
+    url = 'https://xos/corrupt.mp4'
+    assert not store.make_available(str(resources / 'corrupt.mp4'), CHECKSUM, url)
+    assert not store.has(resource_key(url, CHECKSUM))
+
+
+def test_content_store_assigns_distinct_filenames(tmp_path):
+    """
+    Test that resources with the same filename from different URLs get distinct
+    filenames, and subtitles are named after their video.
+    """
+    store = ContentStore(ResourceManifest(str(tmp_path / 'manifest.json')), str(tmp_path / 'store'))
+    filenames = store.assign_filenames([
+        ('https://xos/a/video.mp4', 'url-aaaa'),
+        ('https://xos/b/video.mp4', f'sha256-{CHECKSUM}'),
+        ('https://xos/a/video.mp4', 'url-aaaa'),
+    ])
+    assert filenames == {
+        'https://xos/a/video.mp4': 'video.mp4',
+        'https://xos/b/video.mp4': 'video-9f86d081884c.mp4',
+    }
+    assert name_subtitles('video-9f86d081884c.mp4', 'https://xos/b/en.srt') == \
+        'video-9f86d081884c.srt'
+    assert name_subtitles('video.mp4', None) is None
+
+
+def test_resource_key_only_uses_known_algorithms():
+    """
+    Test that a checksum is only used as the key if its algorithm is a known hash that's
+    safe in a filename, and otherwise the resource is keyed on its URL.
+    """
+    url = 'https://xos/a/video.mp4'
+    assert resource_key(url, f'SHA256:{CHECKSUM}') == f'sha256-{CHECKSUM}'
+    for algorithm in ('../..', 'url', 'md5-sha1', 'unknown'):
+        assert resource_key(url, f'{algorithm}:{CHECKSUM}') == resource_key(url)
+    assert resource_key(url, 'sha256:../video') == resource_key(url)
@@ -0,0 +1,179 @@
+import hashlib
+import os
+from unittest.mock import MagicMock
+
+import pytest
+
+from downloader import (PARTIAL_SUFFIX, DownloadVerificationError,
+                        ResourceDownloader)
+from manifest import ResourceManifest
+
+
+def md5(data):
+    """
+    Returns the md5 hex digest of some bytes.
+    """
+    return hashlib.md5(data).hexdigest()
+
+
+def mock_response(status_code, chunks):
+    """
+    Returns a mocked streaming requests response.
+    """
+    response = MagicMock()
+    response.status_code = status_code
+    response.iter_content = MagicMock(return_value=iter(chunks))
+    response.headers = {}
+    response.__enter__ = MagicMock(return_value=response)
+    response.__exit__ = MagicMock(return_value=False)
+    return response
+
+
+def test_download_writes_file(tmp_path):
+    """
+    Test that a download is streamed to a partial file and renamed into place.
+    """
+    downloader = ResourceDownloader(workers=2)
+    downloader.session.get = MagicMock(return_value=mock_response(200, [b'abc', b'', b'def']))
+    local_path = str(tmp_path / 'video.mp4')
+
+    downloader.download('https://example.com/video.mp4', local_path)
+
+    with open(local_path, 'rb') as open_file:
+        assert open_file.read() == b'abcdef'
+    assert not os.path.exists(local_path + PARTIAL_SUFFIX)
+    assert downloader.stats['video.mp4']['bytes'] == 6
+    assert 'Range' not in downloader.session.get.call_args.kwargs['headers']
+
+
+def test_download_follows_throttle_chunk_size(tmp_path):
+    """
+    Test that the rest of a download is read in smaller chunks once the throttle backs off.
+    """
+    sizes = [1024]
+    throttle = MagicMock()
+    throttle.chunk_size = lambda default: sizes[0]
+    throttle.consume = MagicMock(side_effect=lambda amount: sizes.__setitem__(0, 512))
+    response = mock_response(200, [b'abc', b'def', b'ghi'])
+    downloader = ResourceDownloader(workers=1, throttle=throttle)
+    downloader.session.get = MagicMock(return_value=response)
+    local_path = str(tmp_path / 'video.mp4')
+
+    downloader.download('https://example.com/video.mp4', local_path)
+
+    with open(local_path, 'rb') as open_file:
+        assert open_file.read() == b'abcdefghi'
+    assert [call.kwargs['chunk_size'] for call in response.iter_content.call_args_list] == \
+        [1024, 512]
+
+
+def test_download_resumes_partial_file(tmp_path):
+    """
+    Test that a partial download is resumed with a Range request.
+    """
+    downloader = ResourceDownloader(workers=2)
+    downloader.session.get = MagicMock(return_value=mock_response(206, [b'def']))
+    local_path = str(tmp_path / 'video.mp4')
+    with open(local_path + PARTIAL_SUFFIX, 'wb') as open_file:
+        open_file.write(b'abc')
+
+    downloader.download('https://example.com/video.mp4', local_path)
+
+    assert downloader.session.get.call_args.kwargs['headers'] == {'Range': 'bytes=3-'}
+    with open(local_path, 'rb') as open_file:
+        assert open_file.read() == b'abcdef'
+
+    # A server that ignores the Range header sends the whole file again
+    with open(local_path + PARTIAL_SUFFIX, 'wb') as open_file:
+        open_file.write(b'abc')
+    downloader.session.get = MagicMock(return_value=mock_response(200, [b'abcdef']))
+    downloader.download('https://example.com/video.mp4', local_path)
+    with open(local_path, 'rb') as open_file:
+        assert open_file.read() == b'abcdef'
+
+
+def test_download_discards_partial_file_of_another_version(tmp_path):
+    """
+    Test that a partial download is only taken to be complete when the server says it's
+    the size of the file, and is downloaded again otherwise.
+    """
+    downloader = ResourceDownloader(workers=2)
+    local_path = str(tmp_path / 'video.mp4')
+    with open(local_path + PARTIAL_SUFFIX, 'wb') as open_file:
+        open_file.write(b'abcdef')
+    response = mock_response(416, [])
+    response.headers = {'Content-Range': 'bytes */6'}
+    downloader.session.get = MagicMock(return_value=response)
+    downloader.download('https://example.com/video.mp4', local_path)
+    with open(local_path, 'rb') as open_file:
+        assert open_file.read() == b'abcdef'
+
+    # A partial file longer than the replaced file is discarded
+    with open(local_path + PARTIAL_SUFFIX, 'wb') as open_file:
+        open_file.write(b'abcdefgh')
+    response = mock_response(416, [])
+    response.headers = {'Content-Range': 'bytes */3'}
+    downloader.session.get = MagicMock(side_effect=[response, mock_response(200, [b'xyz'])])
+    downloader.download('https://example.com/video.mp4', local_path)
+    assert 'Range' not in downloader.session.get.call_args.kwargs['headers']
+    with open(local_path, 'rb') as open_file:
+        assert open_file.read() == b'xyz'
+    assert not os.path.exists(local_path + PARTIAL_SUFFIX)
+
+
+def test_download_verifies_size_and_checksum(tmp_path):
+    """
+    Test that a download is only moved into place if its size and checksum match.
+    """
+    downloader = ResourceDownloader(workers=2)
+    local_path = str(tmp_path / 'video.mp4')
+
+    response = mock_response(200, [b'abc'])
+    response.headers = {'Content-Length': '6'}
+    downloader.session.get = MagicMock(return_value=response)
+    with pytest.raises(DownloadVerificationError):
+        downloader.download('https://example.com/video.mp4', local_path)
+    assert not os.path.exists(local_path)
+    # The short file is kept to be resumed
+    assert os.path.getsize(local_path + PARTIAL_SUFFIX) == 3
+
+    response = mock_response(206, [b'xyz'])
+    response.headers = {'Content-Range': 'bytes 3-5/6'}
+    downloader.session.get = MagicMock(return_value=response)
+    with pytest.raises(DownloadVerificationError):
+        downloader.download('https://example.com/video.mp4', local_path, md5(b'abcdef'))
+    assert not os.path.exists(local_path)
+    assert not os.path.exists(local_path + PARTIAL_SUFFIX)
+
+    response = mock_response(200, [b'abcdef'])
+    response.headers = {'Content-Length': '6'}
+    downloader.session.get = MagicMock(return_value=response)
+    downloader.download('https://example.com/video.mp4', local_path, md5(b'abcdef'))
+    with open(local_path, 'rb') as open_file:
+        assert open_file.read() == b'abcdef'
+
+
+def test_manifest_validates_resources(tmp_path):
+    """
+    Test that the manifest recognises recorded files and persists between instances.
+    """
+    local_path = str(tmp_path / 'video.mp4')
+    with open(local_path, 'wb') as open_file:
+        open_file.write(b'abcdef')
+    manifest = ResourceManifest(str(tmp_path / 'manifest.json'))
+    assert not manifest.is_valid(local_path)
+
+    manifest.record(local_path, md5(b'abcdef'))
+    manifest = ResourceManifest(str(tmp_path / 'manifest.json'))
+    assert manifest.is_valid(local_path)
+    assert manifest.is_valid(local_path, md5(b'abcdef'))
+    assert not manifest.is_valid(local_path, md5(b'ghijkl'))
+
+    # Recorded without a checksum, so unverified if there is one
+    manifest.record(local_path)
+    assert manifest.is_valid(local_path)
+    assert not manifest.is_valid(local_path, md5(b'abcdef'))
+
+    with open(local_path, 'ab') as open_file:
+        open_file.write(b'ghi')
+    assert not manifest.is_valid(local_path)
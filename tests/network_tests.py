@@ -0,0 +1,211 @@
+import contextlib
+import socket
+import time
+from unittest.mock import MagicMock, patch
+
+from network import (CONNECTED, DISCONNECTED, FRAME, FRAME_BEACON, FRAME_PING,
+                     Client, ClientConnection, ClockEstimator, FrameReader,
+                     MulticastClient, Server, SyncFrame, encode_frame,
+                     is_newer)
+
+
+def test_frame_reader_parses_split_and_coalesced_frames():
+    """
+    Test that frames split across reads or coalesced into one read are parsed intact.
+    """
+    sender, receiver = socket.socketpair()
+    reader = FrameReader()
+    frames = encode_frame(FRAME_BEACON, 1, 0, 1000) + encode_frame(FRAME_BEACON, 2, 1, 2000)
+
+    sender.sendall(b'garbage' + frames[:FRAME.size + 5])
+    reader.receive(receiver)
+    assert [frame.media_time for frame in reader.frames()] == [1000]
+
+    sender.sendall(frames[FRAME.size + 5:])
+    reader.receive(receiver)
+    frames = reader.frames()
+    assert len(frames) == 1
+    frame = frames[0]
+    assert (frame.sequence, frame.playlist_position, frame.media_time) == (2, 1, 2000)
+    assert reader.length == 0
+
+    sender.close()
+    receiver.close()
+
+
+def test_sequence_numbers_wrap_around():
+    """
+    Test that sequence numbers are compared allowing for wrap around.
+    """
+    assert is_newer(1, None)
+    assert is_newer(2, 1)
+    assert not is_newer(1, 1)
+    assert not is_newer(1, 2)
+    assert is_newer(0, 2 ** 32 - 1)
+
+
+def test_client_returns_newest_beacon():
+    """
+    Test that the client acts on the newest beacon and ignores stale ones.
+    """
+    listener = socket.create_server(('127.0.0.1', 0))
+    client = Client('127.0.0.1', listener.getsockname()[1])
+    sender, _ = listener.accept()
+
+    sender.sendall(encode_frame(FRAME_BEACON, 5, 1, 500) + encode_frame(FRAME_BEACON, 6, 2, 600))
+    assert client.receive() == [2, 600, 0]
+    assert client.state == CONNECTED
+
+    # A stale beacon is skipped in favour of the next new one
+    sender.sendall(encode_frame(FRAME_BEACON, 4, 0, 400) + encode_frame(FRAME_BEACON, 7, 2, 700))
+    assert client.receive() == [2, 700, 0]
+
+    sender.close()
+    assert client.receive() is None
+    assert client.state == DISCONNECTED
+    listener.close()
+
+
+@patch('network.SYNC_RECEIVE_TIMEOUT', 0.2)
+def test_client_reconnects_with_backoff():
+    """
+    Test that a client waiting for its server doesn't block, and retries with a backoff.
+    """
+    listener = socket.create_server(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+
+    started = time.monotonic()
+    client = Client('127.0.0.1', port)
+    assert client.receive() is None
+    assert time.monotonic() - started < 1
+    assert client.state == DISCONNECTED
+    assert client.connection_attempts >= 1
+    assert client.next_connection_attempt > started
+    client.close()
+
+
+def test_client_buffers_partly_sent_pings():
+    """
+    Test that the rest of a partly sent ping is sent once the socket is writable,
+    and that host names are resolved off the receiving thread.
+    """
+    listener = socket.create_server(('127.0.0.1', 0))
+    client = Client('localhost', listener.getsockname()[1])
+    assert client.state == DISCONNECTED
+    assert client.resolving is not None
+    with patch('network.SYNC_RECEIVE_TIMEOUT', 0.2):
+        client.receive()
+    assert client.state == CONNECTED
+    receiver, _ = listener.accept()
+    # Skip any ping sent on connecting
+    receiver.setblocking(False)
+    with contextlib.suppress(BlockingIOError):
+        receiver.recv(1024)
+    receiver.setblocking(True)
+
+    sock = client.sock
+    client.sock = MagicMock(send=MagicMock(return_value=10))
+    client.sock.fileno = sock.fileno
+    frame = encode_frame(FRAME_PING, 1, 0, 0)
+    client.send_frame(frame)
+    assert len(client.outgoing) == FRAME.size - 10
+    client.sock = sock
+    # Not time for another ping yet
+    client.last_ping = time.monotonic()
+    with patch('network.SYNC_RECEIVE_TIMEOUT', 0.2):
+        client.receive()
+    assert not client.outgoing
+    assert receiver.recv(1024) == frame[10:]
+
+    receiver.close()
+    client.close()
+    listener.close()
+
+
+def test_multicast_client_drops_stale_beacons():
+    """
+    Test that the UDP client ignores duplicate and stale beacons, but follows
+    a server that restarted its sequence numbers.
+    """
+    client = MulticastClient('localhost', 0, group=None, broadcast=True)
+    destination = ('127.0.0.1', client.sock.getsockname()[1])
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    for sequence, media_time in [(1000, 100), (1000, 100), (999, 99), (1001, 101)]:
+        sender.sendto(encode_frame(FRAME_BEACON, sequence, 0, media_time), destination)
+    assert client.receive() == [0, 100, 0]
+    assert client.receive() == [0, 101, 0]
+
+    sender.sendto(encode_frame(FRAME_BEACON, 1, 0, 5), destination)
+    assert client.receive() == [0, 5, 0]
+
+    client.sock.settimeout(0.1)
+    assert client.receive() is None
+
+    sender.close()
+    client.sock.close()
+
+
+def test_clock_estimator_uses_fastest_round_trip():
+    """
+    Test that the clock offset is estimated from the fastest recent round trip,
+    and used to project a beacon's media time to now.
+    """
+    clock = ClockEstimator(window=4)
+    beacon = SyncFrame(FRAME_BEACON, 1, 0, 1000, 10000, 0)
+    assert clock.project(beacon, local_time=0) == 1000
+
+    clock.add_sample(sent=1000, server_time=6000, received=1200)
+    clock.add_sample(sent=2000, server_time=9000, received=5000)
+    assert (clock.round_trip, clock.offset) == (200, 4900)
+
+    # 5100us on the client is 10000us on the server, so 50ms after the beacon was sent
+    assert clock.project(beacon, local_time=55100) == 1050
+
+
+def test_client_measures_clock_offset():
+    """
+    Test that a client pings the server and projects its beacons with the clock offset.
+    """
+    server = Server('127.0.0.1', 0)
+    client = Client('127.0.0.1', server.sock.getsockname()[1])
+    while not server.clients:
+        time.sleep(0.01)
+
+    server.send(1, 1000, playlist_version=7)
+    assert client.receive() == [1, 1000, 7]
+    time.sleep(0.1)
+    server.send(1, 2000, playlist_version=7)
+    playlist_position, media_time, _ = client.receive()
+
+    assert client.clock.offset is not None
+    assert playlist_position == 1
+    assert 2000 <= media_time < 2100
+    client.sock.close()
+
+
+def test_client_connection_keeps_newest_beacon():
+    """
+    Test that a client that stops accepting data is only sent the newest beacon
+    once it catches up, after the rest of the frame it was part way through.
+    """
+    sock = MagicMock()
+    connection = ClientConnection(sock)
+    beacons = [encode_frame(FRAME_BEACON, sequence, 0, sequence) for sequence in range(3)]
+
+    sock.send = MagicMock(return_value=10)
+    connection.beacon = beacons[0]
+    assert not connection.flush()
+    assert connection.stalled_since is not None
+
+    sock.send = MagicMock(side_effect=BlockingIOError)
+    connection.beacon = beacons[1]
+    assert not connection.flush()
+    connection.beacon = beacons[2]
+
+    sock.send = MagicMock(side_effect=len)
+    assert connection.flush()
+    assert [bytes(call.args[0]) for call in sock.send.call_args_list] == \
+        [beacons[0][10:], beacons[2]]
+    assert connection.stalled_since is None
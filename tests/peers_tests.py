@@ -0,0 +1,70 @@
+import hashlib
+
+import requests
+
+from content_store import ContentStore, resource_key
+from downloader import PARTIAL_SUFFIX, ResourceDownloader
+from manifest import ResourceManifest
+from peers import Peers, parse_range, peer_hosts, start_peer_server
+
+DATA = b'0123456789' * 100
+CHECKSUM = hashlib.sha256(DATA).hexdigest()
+
+
+def test_peer_hosts_and_ranges():
+    """
+    Test that the sync server is the first peer, and Range headers are parsed.
+    """
+    assert peer_hosts('mp-2, 10.0.0.3:8000,mp-2', 'sync.local') == \
+        ['sync.local:1008', 'mp-2:1008', '10.0.0.3:8000']
+    assert not peer_hosts('')
+    assert parse_range(None, 100) is None
+    assert parse_range('bytes=10-', 100) == (10, 99)
+    assert parse_range('bytes=10-200', 100) == (10, 99)
+    assert parse_range('bytes=-10', 100) == (90, 99)
+
+
+def test_peers_share_verified_resources(tmp_path):
+    """
+    Test that a resource stored under its checksum is served to a peer, resuming a
+    partial download, and that other resources aren't served.
+    """
+    manifest = ResourceManifest(str(tmp_path / 'manifest.json'))
+    store = ContentStore(manifest, str(tmp_path / 'store'))
+    key = resource_key('https://xos/video.mp4', CHECKSUM)
+    with open(store.path(key), 'wb') as resource:
+        resource.write(DATA)
+    url_key = resource_key('https://xos/other.mp4')
+    with open(store.path(url_key), 'wb') as resource:
+        resource.write(DATA)
+    server = start_peer_server(store, port=0, bind='127.0.0.1')
+    host = f'127.0.0.1:{server.server_address[1]}'
+
+    try:
+        # Another server can't listen on the same port, and doesn't stop the player
+        assert start_peer_server(store, port=server.server_address[1], bind='127.0.0.1') is None
+
+        response = requests.get(
+            f'http://{host}/resources/{key}', headers={'Range': 'bytes=990-'}, timeout=5,
+        )
+        assert response.status_code == 206
+        assert response.content == DATA[990:]
+        assert response.headers['Content-Range'] == f'bytes 990-999/{len(DATA)}'
+        for path in (f'/resources/{url_key}', '/resources/../manifest.json'):
+            assert requests.get(f'http://{host}{path}', timeout=5).status_code == 404
+
+        # Resumed from a partial download, and verified against the checksum
+        local_path = str(tmp_path / 'video.mp4')
+        with open(local_path + PARTIAL_SUFFIX, 'wb') as partial:
+            partial.write(DATA[:500])
+        peers = Peers(ResourceDownloader(workers=1), [host])
+        assert peers.fetch(key, local_path, CHECKSUM)
+        with open(local_path, 'rb') as resource:
+            assert resource.read() == DATA
+
+        # A peer with the wrong content, and resources without a checksum, aren't used
+        assert not peers.fetch(key, str(tmp_path / 'wrong.mp4'), hashlib.sha256(b'').hexdigest())
+        assert not peers.fetch(url_key, str(tmp_path / 'other.mp4'))
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -71,15 +71,22 @@ def test_get_current_time_interpolates():
     assert player.get_current_time() == 270
 
 
-def test_run_timer():
+@patch('media_player.vlc.libvlc_clock', MagicMock(
+    side_effect=[0, 100 * (10 ** 3), 200 * (10 ** 3), 300 * (10 ** 3)]
+))
+def test_get_current_time_uses_clock_events():
     """
-    Check that the get_current_time method gets called when running the timer.
+    Check that get_current_time interpolates from VLC's time-changed events without polling.
     """
     player = MediaPlayer()
-    assert_called_in_infinite_loop(
-        'media_player.MediaPlayer.get_current_time',
-        player.run_timer
-    )
+    mock_player = MagicMock()
+    player.vlc['player'] = mock_player
+    player.clock.on_time_changed(MagicMock(u=MagicMock(new_time=1000)))
+    assert player.get_current_time() == 1100
+    assert player.get_current_time() == 1200
+    player.clock.on_stopped(MagicMock())
+    assert player.get_current_time() == 1000
+    assert not mock_player.get_time.called
 
 
 @patch('media_player.network.Server', MagicMock())
@@ -93,17 +100,37 @@ def test_server_sends_time_to_client():
     player.get_current_playlist_position = MagicMock(return_value=1)
     assert_called_in_infinite_loop(
         'media_player.MediaPlayer.get_current_time',
-        player.sync_to_server
+        player.send_beacon
     )
 
     with pytest.raises(AssertionError):
         player.get_current_playlist_position = MagicMock(return_value=None)
         assert_called_in_infinite_loop(
             'media_player.MediaPlayer.get_current_time',
-            player.sync_to_server
+            player.send_beacon
         )
 
 
+@patch('media_player.vlc.libvlc_clock', MagicMock(return_value=100 * (10 ** 3)))
+@patch('media_player.network.Server', MagicMock())
+@patch('media_player.SYNC_IS_SERVER', 'true')
+@patch('media_player.IS_SYNCED_PLAYER', True)
+def test_server_beacon_at_item_change_starts_new_item():
+    """
+    Check that a beacon sent as the playlist moves to the next item doesn't carry
+    the time the previous item had reached.
+    """
+    player = MediaPlayer()
+    player.server = MagicMock()
+    player.vlc['player'] = MagicMock()
+    player.vlc['player'].get_time = MagicMock(return_value=-1)
+    player.get_current_playlist_position = MagicMock(return_value=1)
+    player.clock.on_time_changed(MagicMock(u=MagicMock(new_time=20000)))
+    player.clock.on_media_changed(MagicMock())
+    player.send_beacon()
+    assert player.server.send.call_args[0][:2] == (1, 0)
+
+
 @patch('media_player.network.Client', MagicMock())
 @patch('media_player.SYNC_CLIENT_TO', '100.100.100.100')
 @patch('media_player.IS_SYNCED_PLAYER', True)
@@ -123,11 +150,12 @@ def test_client_receives_time_from_server():
 @patch('media_player.IS_SYNCED_PLAYER', True)
 def test_client_drifts_from_server():
     """
-    Check that if the time drifts, the client calls set_time on its player.
+    Check that if the time drifts beyond the seek threshold, the client calls set_time
+    on its player.
     """
     player = MediaPlayer()
     player.client.receive = MagicMock(return_value=[1, 50])
-    player.get_current_time = MagicMock(return_value=100)
+    player.get_current_time = MagicMock(return_value=1100)
     player.get_current_playlist_position = MagicMock(return_value=1)
     player.vlc['player'].get_length = MagicMock(return_value=3000)
     assert_called_in_infinite_loop(
@@ -144,7 +172,31 @@ def test_client_drifts_from_server():
     # Assert sync isn't called within 2 seconds of the end of the current video
     with pytest.raises(AssertionError):
         player.client.receive = MagicMock(return_value=[1, 2500])
-        player.get_current_time = MagicMock(return_value=2000)
+        player.get_current_time = MagicMock(return_value=1000)
+        assert_called_in_infinite_loop(
+            'vlc.MediaPlayer.set_time',
+            player.sync_to_server
+        )
+
+
+@patch('media_player.network.Client', MagicMock())
+@patch('media_player.SYNC_CLIENT_TO', '100.100.100.100')
+@patch('media_player.IS_SYNCED_PLAYER', True)
+def test_client_corrects_small_drift_with_playback_rate():
+    """
+    Check that if the time drifts a little, the client adjusts its playback rate
+    rather than seeking.
+    """
+    player = MediaPlayer()
+    player.client.receive = MagicMock(return_value=[1, 50])
+    player.get_current_time = MagicMock(return_value=150)
+    player.get_current_playlist_position = MagicMock(return_value=1)
+    player.vlc['player'].get_length = MagicMock(return_value=3000)
+    assert_called_in_infinite_loop(
+        'vlc.MediaPlayer.set_rate',
+        player.sync_to_server
+    )
+    with pytest.raises(AssertionError):
         assert_called_in_infinite_loop(
             'vlc.MediaPlayer.set_time',
             player.sync_to_server
@@ -198,20 +250,26 @@ def test_client_playlist_position_set_without_drift():
 
 
 @patch('media_player.network.Client', MagicMock())
+@patch('media_player.network.MulticastClient', MagicMock())
 @patch('media_player.SYNC_CLIENT_TO', '100.100.100.100')
 @patch('media_player.IS_SYNCED_PLAYER', True)
 def test_sync_check():
     """
-    Test that setup_sync is called as expected in sync_check.
+    Test that setup_sync is called as expected in sync_check, and the TCP client
+    is left to reconnect itself.
     """
     player = MediaPlayer()
     with patch.object(MediaPlayer, 'setup_sync', wraps=player.setup_sync) as mock_setup_sync:
-        player.client.sync_attempts = 1
-        player.sync_check()
-        assert mock_setup_sync.call_count == 0
         player.client.sync_attempts = 4
         player.sync_check()
-        assert mock_setup_sync.call_count == 1
+        assert mock_setup_sync.call_count == 0
+        with patch('media_player.SYNC_TRANSPORT', 'multicast'):
+            player.client.sync_attempts = 1
+            player.sync_check()
+            assert mock_setup_sync.call_count == 0
+            player.client.sync_attempts = 4
+            player.sync_check()
+            assert mock_setup_sync.call_count == 1
 
 
 @patch('media_player.network.Client', MagicMock())
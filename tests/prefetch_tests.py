@@ -0,0 +1,51 @@
+from unittest.mock import MagicMock, patch
+
+from prometheus_client import REGISTRY
+
+from prefetch import Prefetcher
+
+
+def status(playlist_position, playback_position):
+    """
+    Returns a playback status part way through a 60 second item.
+    """
+    return {
+        'playlist_position': playlist_position,
+        'playback_position': playback_position,
+        'duration': 60000,
+    }
+
+
+def test_prefetcher_warms_next_item(tmp_path):
+    """
+    Test that the next item is warmed shortly before the current one ends,
+    and that items starting are counted as hits or misses.
+    """
+    resources = [str(tmp_path / f'{index}.mp4') for index in range(3)]
+    for resource in resources:
+        with open(resource, 'wb') as open_file:
+            open_file.write(b'\0' * 1024)
+    media_player = MagicMock(playlist=[{'resource': resource} for resource in resources])
+    prefetcher = Prefetcher(media_player, lead_time=10, size_mb=1)
+    hits = REGISTRY.get_sample_value('prefetch_hits_total')
+    misses = REGISTRY.get_sample_value('prefetch_misses_total')
+
+    with patch('prefetch.warm') as warm:
+        for playlist_position, playback_position in [(0, 0.5), (0, 0.9), (0, 0.95), (1, 0.0)]:
+            media_player.sampler.latest = MagicMock(
+                return_value=status(playlist_position, playback_position),
+            )
+            prefetcher.check()
+        warm.assert_called_once_with(resources[1], 1024 * 1024)
+
+        # Seeking to another item isn't a hit
+        media_player.sampler.latest = MagicMock(return_value=status(0, 0.1))
+        prefetcher.check()
+
+    assert REGISTRY.get_sample_value('prefetch_hits_total') == hits + 1
+    assert REGISTRY.get_sample_value('prefetch_misses_total') == misses + 1
+
+    # Really warm the last item, which loops back to the first
+    media_player.sampler.latest = MagicMock(return_value=status(2, 0.99))
+    prefetcher.check()
+    assert prefetcher.prefetched == resources[0]
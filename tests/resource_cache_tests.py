@@ -0,0 +1,90 @@
+import os
+
+from content_store import ContentStore
+from manifest import ResourceManifest
+from resource_cache import ResourceCache
+
+
+def playlist(*filenames):
+    """
+    Returns a playlist of local resources with these filenames.
+    """
+    return [{'resource': f'/data/resources/{filename}'} for filename in filenames]
+
+
+def write_resources(directory, *filenames):
+    """
+    Write a megabyte resource to the directory for each filename.
+    """
+    for filename in filenames:
+        with open(directory / filename, 'wb') as resource:
+            resource.write(b'\0' * 1024 * 1024)
+
+
+def test_resource_cache_evicts_least_recently_used(tmp_path):
+    """
+    Test that resources from previous playlists are kept within the budget,
+    and the least recently used are evicted first.
+    """
+    directory = tmp_path / 'resources'
+    directory.mkdir()
+    write_resources(directory, 'a.mp4', 'b.mp4', 'old.mp4', 'c.mp4.part')
+    manifest = ResourceManifest(str(tmp_path / 'manifest.json'))
+    cache = ResourceCache(manifest, str(directory), budget_mb=2)
+
+    # Files found at startup are indexed, and partial downloads that won't be resumed deleted
+    assert set(manifest.entries) == {'a.mp4', 'b.mp4', 'old.mp4'}
+    assert not os.path.exists(directory / 'c.mp4.part')
+    manifest.touch(['b.mp4'], last_used=1)
+    assert cache.retain(playlist('a.mp4')) == ['old.mp4']
+
+    assert not cache.retain(playlist('b.mp4'))
+    # Switching back keeps both playlists' resources
+    assert not cache.retain(playlist('a.mp4'))
+
+    write_resources(directory, 'c.mp4')
+    manifest.record(str(directory / 'c.mp4'))
+    assert cache.retain(playlist('c.mp4')) == ['b.mp4']
+    assert sorted(os.listdir(directory)) == ['a.mp4', 'c.mp4']
+    assert set(ResourceManifest(str(tmp_path / 'manifest.json')).entries) == {'a.mp4', 'c.mp4'}
+
+
+def test_resource_cache_without_budget_keeps_current_playlist(tmp_path):
+    """
+    Test that a budget of zero only keeps the current playlist's resources.
+    """
+    directory = tmp_path / 'resources'
+    directory.mkdir()
+    write_resources(directory, 'a.mp4', 'a.srt', 'b.mp4')
+    cache = ResourceCache(ResourceManifest(str(tmp_path / 'manifest.json')), str(directory), 0)
+
+    assert cache.retain([{'resource': 'a.mp4', 'subtitles': 'https://xos/a.srt'}]) == ['b.mp4']
+    assert sorted(cache.retain(playlist('b.mp4'))) == ['a.mp4', 'a.srt']
+
+
+def test_resource_cache_counts_stored_resources_once(tmp_path):
+    """
+    Test that a stored resource linked under several filenames counts towards the
+    budget once, and is only counted as freed once none of its links are left.
+    """
+    directory = tmp_path / 'resources'
+    directory.mkdir()
+    manifest = ResourceManifest(str(tmp_path / 'manifest.json'))
+    store = ContentStore(manifest, str(tmp_path / 'store'))
+    write_resources(tmp_path / 'store', 'sha1-shared')
+    store.link('sha1-shared', str(directory / 'a.mp4'))
+    store.link('sha1-shared', str(directory / 'b.mp4'))
+    write_resources(directory, 'c.mp4')
+    cache = ResourceCache(manifest, str(directory), budget_mb=2, store=store)
+
+    # Only two megabytes are stored, however many filenames the shared resource has
+    assert not cache.retain(playlist('a.mp4'))
+    assert not cache.retain(playlist('c.mp4'))
+
+    write_resources(directory, 'd.mp4')
+    manifest.record(str(directory / 'd.mp4'))
+    manifest.touch(['a.mp4'], last_used=1)
+    manifest.touch(['b.mp4'], last_used=2)
+    assert cache.retain(playlist('d.mp4')) == ['a.mp4', 'b.mp4']
+    assert not store.has('sha1-shared')
+    assert sorted(os.listdir(directory)) == ['c.mp4', 'd.mp4']
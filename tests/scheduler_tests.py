@@ -0,0 +1,95 @@
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+from scheduler import Scheduler, only_while
+
+
+def test_scheduler_runs_tasks_when_due():
+    """
+    Test that tasks run at their own intervals, once if their interval is zero,
+    straight away when triggered, and that a failing task keeps its schedule.
+    """
+    scheduler = Scheduler(workers=2)
+    runs = {'fast': 0, 'slow': 0, 'once': 0, 'failing': 0}
+    condition = threading.Condition()
+
+    def task(name):
+        def run():
+            with condition:
+                runs[name] += 1
+                condition.notify_all()
+        return run
+
+    def failing():
+        task('failing')()
+        raise ValueError('Failed')
+
+    def wait_for(name, count):
+        with condition:
+            return condition.wait_for(lambda: runs[name] >= count, timeout=5)
+
+    scheduler.every('fast', 0.01, task('fast'))
+    scheduler.every('slow', 60, task('slow'))
+    scheduler.every('once', 0, task('once'))
+    scheduler.every('failing', 0.01, failing)
+
+    with patch('scheduler.sentry_sdk.capture_exception'):
+        threading.Thread(target=scheduler.run, daemon=True).start()
+        assert wait_for('fast', 5)
+        assert wait_for('failing', 4)
+        assert wait_for('once', 1)
+        assert wait_for('slow', 1)
+        scheduler.trigger('slow')
+        assert wait_for('slow', 2)
+        scheduler.stop()
+
+    assert runs['slow'] == 2
+    assert runs['once'] == 1
+
+
+def test_scheduler_reschedules_without_catching_up():
+    """
+    Test that a task is next due an interval after it was last due, or straight away
+    if it overran, rather than catching up on the runs it missed.
+    """
+    scheduler = Scheduler(workers=1)
+    task = scheduler.every('task', 10, MagicMock())
+    # The task's start and finish times
+    with patch('scheduler.time.monotonic', side_effect=[1, 2]):
+        scheduler.run_task(task, 0)
+    assert task.due == 10
+    with patch('scheduler.time.monotonic', side_effect=[10, 25]):
+        scheduler.run_task(task, 10)
+    assert task.due == 25
+    scheduler.stop()
+
+
+def test_scheduler_idles_without_polling():
+    """
+    Test that the scheduler sleeps until the next task is due.
+    """
+    scheduler = Scheduler(workers=1)
+    scheduler.every('idle', 60, MagicMock(), delay=60)
+    thread = threading.Thread(target=scheduler.run, daemon=True)
+    started = time.process_time()
+    thread.start()
+    time.sleep(0.5)
+    assert time.process_time() - started < 0.1
+    scheduler.stop()
+    thread.join(timeout=1)
+    assert not thread.is_alive()
+
+
+def test_only_while_skips_runs():
+    """
+    Test that a task only calls its function while its condition holds.
+    """
+    playlist = []
+    function = MagicMock()
+    task = only_while(lambda: playlist, function)
+    task()
+    function.assert_not_called()
+    playlist.append('video.mp4')
+    task()
+    function.assert_called_once()
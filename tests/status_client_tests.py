@@ -0,0 +1,81 @@
+import threading
+import urllib.error
+import urllib.request
+from unittest.mock import patch
+
+import pytest
+from prometheus_client import REGISTRY
+
+import status_client
+
+
+def media_player_status(dropped_video_frames):
+    """
+    Returns a media player status with some dropped video frames.
+    """
+    return {
+        'label_id': 1,
+        'playlist_position': 0,
+        'playback_position': 0.5,
+        'dropped_audio_frames': 0,
+        'dropped_video_frames': dropped_video_frames,
+        'duration': 1000,
+        'player_volume': '5.0',
+        'system_volume': '10.0',
+    }
+
+
+@patch.object(status_client.DEVICE_INFO, 'info')
+def test_set_status_only_updates_changes(device_info):
+    """
+    Test that info metrics are only set when they change, dropped frames are counted
+    across VLC's per media totals, and gauges are read when scraped.
+    """
+    dropped_frames = REGISTRY.get_sample_value('dropped_video_frames_total')
+
+    for dropped_video_frames in (2, 5, 1):
+        status = media_player_status(dropped_video_frames)
+        status_client.set_status('uuid', 'mp-1', 'video.mp4', status)
+
+    device_info.assert_called_once_with({'uuid': 'uuid', 'name': 'mp-1'})
+    # 2, then 3 more, then 1 on the next item
+    assert REGISTRY.get_sample_value('dropped_video_frames_total') == dropped_frames + 6
+
+    status_client.STATUS_COLLECTOR.watch(lambda: media_player_status(0))
+    assert REGISTRY.get_sample_value('duration') == 1000
+    assert REGISTRY.get_sample_value('player_volume') == 5.0
+    status_client.STATUS_COLLECTOR.watch(lambda: {'error': 'No playable items'})
+    assert REGISTRY.get_sample_value('duration') is None
+
+
+def test_status_server_serves_debug_endpoints():
+    """
+    Test that the status server serves metrics, thread stacks, and profiles only
+    when the profiler is enabled.
+    """
+    server = status_client.start_status_server(0)
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    with status_client.timed('test_operation'):
+        pass
+
+    with urllib.request.urlopen(f'{url}/metrics') as response:
+        assert 'operation="test_operation"' in response.read().decode()
+    with urllib.request.urlopen(f'{url}/debug/stacks') as response:
+        assert 'MainThread' in response.read().decode()
+
+    with patch('profiler.PROFILER_ENABLED', False):
+        with pytest.raises(urllib.error.HTTPError) as error:
+            with urllib.request.urlopen(f'{url}/debug/profile?seconds=0.1'):
+                pass
+        assert error.value.code == 404
+
+    waiting = threading.Event()
+    thread = threading.Thread(target=waiting.wait, name='waiting', daemon=True)
+    thread.start()
+    with patch('profiler.PROFILER_ENABLED', True):
+        with urllib.request.urlopen(f'{url}/debug/profile?seconds=0.1') as response:
+            stacks = response.read().decode().splitlines()
+    waiting.set()
+    assert any(stack.startswith('waiting;') and 'wait (threading.py:' in stack for stack in stacks)
+    assert all(stack.rsplit(' ', 1)[1].isdigit() for stack in stacks)
+    server.shutdown()
@@ -0,0 +1,489 @@
+"""
+Sync benchmark: runs a sync server and several clients on localhost with simulated VLC
+players, and reports how quickly and how closely the clients follow the server.
+
+The server and clients are real MediaPlayers, so the server sends beacons from its
+scheduled tasks and the clients sync with the same sync_playlist/sync_playback logic
+as on a device, both timed by the playback clock from the simulated players' events.
+The clients connect to the server through a proxy that delays traffic with latency
+and jitter, and each simulated player's clock runs slightly fast or slow to simulate
+clock skew.
+
+Run it from the repository root with: make benchmark
+or: python -m tests.sync_benchmark --help
+"""
+
+import argparse
+import ctypes
+import json
+import queue
+import random
+import socket
+import statistics
+import threading
+import time
+from types import SimpleNamespace
+
+import vlc
+
+import media_player
+from media_player import MediaPlayer
+
+# Clients connect to the server through the latency proxy
+PROXY_PORT = 10000
+SERVER_PORT = 10001
+SAMPLE_INTERVAL = 0.05  # seconds
+# How often the simulated players send time-changed events, like VLC
+TIME_CHANGED_INTERVAL = 0.25  # seconds
+
+
+class SimulatedEventManager:
+    """
+    A stand-in for a VLC event manager, which keeps one callback per event type.
+    """
+
+    def __init__(self):
+        self._as_parameter_ = ctypes.c_void_p(id(self))
+        self.callbacks = {}
+        # Held while an event is read from the player and sent, as VLC sends events in order
+        self.lock = threading.RLock()
+
+    def event_attach(self, event_type, callback, *args):
+        """
+        Call callback(event, *args) for each event_type event.
+        """
+        self.callbacks[event_type.value] = (callback, args)
+
+    def send(self, event_type, new_time=None):
+        """
+        Send an event to the callback attached to its type.
+        """
+        callback, args = self.callbacks.get(event_type.value, (None, ()))
+        if callback:
+            callback(SimpleNamespace(type=event_type, u=SimpleNamespace(new_time=new_time)), *args)
+
+
+class SimulatedMedia:  # pylint: disable=too-few-public-methods
+    """
+    A stand-in for a vlc.Media in a simulated playlist.
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def get_stats(self, stats):
+        """
+        Leave the media stats empty.
+        """
+
+
+class SimulatedPlayer:  # pylint: disable=too-many-instance-attributes
+    """
+    Simulates VLC's media player, media list player and media list for a looping
+    playlist of items of the given lengths in milliseconds. Media time runs at
+    playback rate * (1 + skew) of real time, and seeks take seek_cost milliseconds.
+    Like VLC it sends time-changed events every TIME_CHANGED_INTERVAL seconds, and
+    next-item-set, media-changed and playing events as it moves to another item.
+    """
+
+    def __init__(self, item_lengths, skew=0.0, seek_cost=0):
+        self.lock = threading.Lock()
+        self.item_lengths = item_lengths
+        self.media = [SimulatedMedia(index) for index in range(len(item_lengths))]
+        self.skew = skew
+        self.seek_cost = seek_cost / 1000
+        self.index = 0
+        self.media_time = 0.0
+        self.updated = time.monotonic()
+        self.rate = 1.0
+        self.seeks = 0
+        self.rate_changes = 0
+        self.events = SimulatedEventManager()
+        threading.Thread(target=self.send_time_changed, daemon=True).start()
+
+    def advance(self):
+        """
+        Advance the media time to now, moving on to the next items as they finish.
+        Returns the (index, media time) now.
+        """
+        changed = False
+        with self.lock:
+            now = time.monotonic()
+            elapsed = max(now - self.updated, 0)
+            self.media_time += elapsed * 1000 * self.rate * (1 + self.skew)
+            self.updated = max(now, self.updated)
+            while self.media_time >= self.item_lengths[self.index]:
+                self.media_time -= self.item_lengths[self.index]
+                self.index = (self.index + 1) % len(self.item_lengths)
+                changed = True
+            state = self.index, int(self.media_time)
+        if changed:
+            self.send_item_changed()
+        return state
+
+    def send_item_changed(self):
+        """
+        Send the events VLC sends as it starts playing another item.
+        """
+        with self.events.lock:
+            for event_type in (
+                    vlc.EventType.MediaListPlayerNextItemSet,
+                    vlc.EventType.MediaPlayerMediaChanged,
+                    vlc.EventType.MediaPlayerPlaying,
+            ):
+                self.events.send(event_type)
+
+    def send_time_changed(self):
+        """
+        Send a time-changed event with the media time every TIME_CHANGED_INTERVAL seconds,
+        and move on to the next item as soon as the current one finishes.
+        """
+        while True:
+            with self.events.lock:
+                index, media_time = self.advance()
+                self.events.send(vlc.EventType.MediaPlayerTimeChanged, media_time)
+                speed = self.rate * (1 + self.skew)
+            remaining = (self.item_lengths[index] - media_time) / 1000 / speed
+            time.sleep(min(TIME_CHANGED_INTERVAL, remaining + 0.001))
+
+    def playlist_time(self):
+        """
+        Returns the time in milliseconds since the start of the playlist.
+        """
+        index, media_time = self.advance()
+        return sum(self.item_lengths[:index]) + media_time
+
+    def set_playlist_time(self, playlist_time):
+        """
+        Jump to a time since the start of the playlist without counting it as a seek.
+        """
+        playlist_time %= sum(self.item_lengths)
+        with self.lock:
+            self.index = 0
+            while playlist_time >= self.item_lengths[self.index]:
+                playlist_time -= self.item_lengths[self.index]
+                self.index += 1
+            self.media_time = playlist_time
+            self.updated = time.monotonic()
+
+    def get_time(self):
+        """
+        Returns the media time in milliseconds.
+        """
+        return self.advance()[1]
+
+    def set_time(self, media_time):
+        """
+        Seek, which freezes playback for the seek cost.
+        """
+        with self.lock:
+            self.seeks += 1
+            self.media_time = media_time
+            self.updated = time.monotonic() + self.seek_cost
+
+    def set_rate(self, rate):
+        """
+        Set the playback rate.
+        """
+        self.advance()
+        with self.lock:
+            self.rate_changes += 1
+            self.rate = rate
+
+    def play_item_at_index(self, index):
+        """
+        Play an item from its start.
+        """
+        with self.lock:
+            self.index = index
+            self.media_time = 0.0
+            self.updated = time.monotonic()
+        self.send_item_changed()
+
+    def get_length(self):
+        """
+        Returns the length of the current item in milliseconds.
+        """
+        return self.item_lengths[self.advance()[0]]
+
+    def get_position(self):
+        """
+        Returns how far through the current item it is, from 0 to 1.
+        """
+        index, media_time = self.advance()
+        return media_time / self.item_lengths[index]
+
+    @staticmethod
+    def audio_get_volume():
+        """
+        Returns the player's volume, from 0 to 256.
+        """
+        return 256
+
+    def get_media(self):
+        """
+        Returns the current item.
+        """
+        return self.media[self.advance()[0]]
+
+    def index_of_item(self, media):
+        """
+        Returns the playlist position of an item.
+        """
+        return media.index
+
+    def event_manager(self):
+        """
+        Returns the player's event manager.
+        """
+        return self.events
+
+
+class SimulatedMediaPlayer(MediaPlayer):
+    """
+    A MediaPlayer playing a SimulatedPlayer rather than VLC.
+    """
+
+    def __init__(self, player):
+        self.simulated_player = player
+        super().__init__()
+
+    def init_vlc(self):
+        """
+        Use the simulated player for all of VLC.
+        """
+        self.vlc = {
+            'instance': None,
+            'player': self.simulated_player,
+            'list_player': self.simulated_player,
+            'playlist': self.simulated_player,
+        }
+
+
+class LatencyProxy:
+    """
+    Forwards TCP connections on listen_port to target_port, delaying the data
+    in each direction by latency milliseconds plus normally distributed jitter.
+    """
+
+    def __init__(self, listen_port, target_port, latency, jitter):
+        self.target_port = target_port
+        self.latency = latency
+        self.jitter = jitter
+        self.sock = socket.create_server(('127.0.0.1', listen_port), reuse_port=True)
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        """
+        Accept connections and forward them to the target.
+        """
+        while True:
+            client, _ = self.sock.accept()
+            upstream = socket.create_connection(('127.0.0.1', self.target_port))
+            for source, destination in ((client, upstream), (upstream, client)):
+                source.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                threading.Thread(
+                    target=self.forward, args=(source, destination), daemon=True,
+                ).start()
+
+    def forward(self, source, destination):
+        """
+        Read from source and queue the data to be delivered to destination, in order.
+        """
+        deliveries = queue.Queue()
+        threading.Thread(
+            target=self.deliver, args=(deliveries, destination), daemon=True,
+        ).start()
+        last_delivery = 0
+        while True:
+            try:
+                data = source.recv(4096)
+            except OSError:
+                data = b''
+            if not data:
+                deliveries.put(None)
+                return
+            delay = max(random.gauss(self.latency, self.jitter), 0) / 1000
+            last_delivery = max(last_delivery, time.monotonic() + delay)
+            deliveries.put((last_delivery, data))
+
+    @staticmethod
+    def deliver(deliveries, destination):
+        """
+        Send queued data to destination when it's due.
+        """
+        while True:
+            delivery = deliveries.get()
+            if delivery is None:
+                destination.close()
+                return
+            deliver_at, data = delivery
+            time.sleep(max(deliver_at - time.monotonic(), 0))
+            try:
+                destination.sendall(data)
+            except OSError:
+                return
+
+
+def thread_cpu_time(thread):
+    """
+    Returns the CPU time used by a thread in seconds.
+    """
+    return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+
+
+def percentile(values, fraction):
+    """
+    Returns a percentile of values, or None if there aren't any.
+    """
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[int(fraction * 100) - 1]
+
+
+def start_server(item_lengths):
+    """
+    Start a sync server MediaPlayer on a simulated player, sending beacons from its
+    scheduled tasks like on a device.
+    """
+    player = SimulatedPlayer(item_lengths)
+    server = SimulatedMediaPlayer(player)
+    # The benchmark's playlist doesn't change, so there's nothing for the watcher to check
+    server.schedule_tasks(SimpleNamespace(interval=0, check=lambda: False))
+    threading.Thread(target=server.scheduler.run, daemon=True).start()
+    return player
+
+
+def start_client(item_lengths, server_player, args):
+    """
+    Start a client MediaPlayer on a simulated player with a random clock skew,
+    starting a random offset from the server.
+    """
+    player = SimulatedPlayer(
+        item_lengths,
+        skew=random.uniform(-args.skew, args.skew) / 1000000,
+        seek_cost=args.seek_cost,
+    )
+    player.set_playlist_time(
+        server_player.playlist_time() + random.uniform(-args.offset, args.offset)
+    )
+    client = SimulatedMediaPlayer(player)
+    thread = threading.Thread(target=client.sync_to_server, daemon=True)
+    thread.start()
+    return player, thread
+
+
+def drift(client_player, server_player, playlist_length):
+    """
+    Returns how far the client is ahead of the server in milliseconds.
+    """
+    difference = client_player.playlist_time() - server_player.playlist_time()
+    return (difference + playlist_length / 2) % playlist_length - playlist_length / 2
+
+
+def measure(clients, server_player, playlist_length, args):
+    """
+    Sample each client's drift for the length of the benchmark, and return its results.
+    """
+    threshold = int(media_player.SYNC_DRIFT_THRESHOLD)
+    started = time.monotonic()
+    cpu_started = [thread_cpu_time(thread) for _, thread in clients]
+    drifts = [[] for _ in clients]
+    converged = [None] * len(clients)
+    while time.monotonic() - started < args.duration:
+        time.sleep(SAMPLE_INTERVAL)
+        elapsed = time.monotonic() - started
+        for index, (player, _) in enumerate(clients):
+            client_drift = drift(player, server_player, playlist_length)
+            if converged[index] is None and abs(client_drift) <= threshold:
+                converged[index] = elapsed
+            if converged[index] is not None:
+                drifts[index].append(abs(client_drift))
+    duration = time.monotonic() - started
+
+    results = []
+    for index, (player, thread) in enumerate(clients):
+        results.append({
+            'client': index,
+            'skew_ppm': round(player.skew * 1000000),
+            'convergence_seconds': converged[index],
+            'drift_p50_ms': percentile(drifts[index], 0.5),
+            'drift_p95_ms': percentile(drifts[index], 0.95),
+            'drift_p99_ms': percentile(drifts[index], 0.99),
+            'drift_max_ms': max(drifts[index], default=None),
+            'seeks': player.seeks,
+            'rate_changes': player.rate_changes,
+            'cpu_percent': (thread_cpu_time(thread) - cpu_started[index]) / duration * 100,
+        })
+    return results
+
+
+def print_results(results):
+    """
+    Print a table of the results of each client.
+    """
+    columns = list(results[0])
+    print(' '.join(f'{column:>19}' for column in columns))
+    for result in results:
+        print(' '.join(
+            f'{"-" if value is None else round(value, 2):>19}' for value in result.values()
+        ))
+
+
+def parse_args():
+    """
+    Parse the benchmark's command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--clients', type=int, default=5, help='number of clients')
+    parser.add_argument('--duration', type=float, default=60, help='seconds to measure')
+    parser.add_argument('--items', type=int, default=3, help='number of playlist items')
+    parser.add_argument('--item-length', type=float, default=20, help='item length seconds')
+    parser.add_argument('--latency', type=float, default=5, help='one way latency ms')
+    parser.add_argument('--jitter', type=float, default=2, help='latency deviation ms')
+    parser.add_argument('--skew', type=float, default=200, help='maximum clock skew ppm')
+    parser.add_argument('--offset', type=float, default=3000, help='maximum start offset ms')
+    parser.add_argument('--seek-cost', type=float, default=150, help='time a seek takes ms')
+    parser.add_argument('--beacon-interval', type=float, default=0.5, help='seconds')
+    parser.add_argument('--seed', type=int, help='random seed to repeat a run')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    return parser.parse_args()
+
+
+def main():
+    """
+    Run the benchmark.
+    """
+    args = parse_args()
+    random.seed(args.seed)
+    item_lengths = [int(args.item_length * 1000)] * args.items
+
+    # The simulated players' media time runs on the monotonic clock, so the playback
+    # clock reads it in place of libvlc's
+    vlc.libvlc_clock = lambda: time.monotonic_ns() // 1000
+    media_player.IS_SYNCED_PLAYER = True
+    media_player.SYNC_TRANSPORT = 'tcp'
+    media_player.SYNC_BEACON_INTERVAL = args.beacon_interval
+
+    media_player.SYNC_IS_SERVER = True
+    media_player.SYNC_CLIENT_TO = None
+    media_player.SYNC_PORT = SERVER_PORT
+    server_player = start_server(item_lengths)
+
+    media_player.SYNC_IS_SERVER = False
+    media_player.SYNC_CLIENT_TO = '127.0.0.1'
+    media_player.SYNC_PORT = PROXY_PORT
+    LatencyProxy(PROXY_PORT, SERVER_PORT, args.latency, args.jitter)
+    clients = [start_client(item_lengths, server_player, args) for _ in range(args.clients)]
+    results = measure(clients, server_player, sum(item_lengths), args)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+
+
+if __name__ == '__main__':
+    main()
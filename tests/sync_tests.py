@@ -0,0 +1,51 @@
+from unittest.mock import MagicMock, patch
+
+from sync import SYNC_MAX_RATE_ADJUST, BeaconScheduler, DriftController
+
+
+def test_drift_controller_adjusts_rate_until_converged():
+    """
+    Test that drift beyond the threshold is corrected by adjusting the playback rate
+    within its limits, until the drift has settled.
+    """
+    media_player = MagicMock()
+    drift = DriftController(media_player, threshold=40)
+
+    # Drift within the threshold is left alone
+    drift.correct(30, now=0)
+    assert drift.rate == 1.0
+    assert not media_player.vlc['player'].set_rate.called
+
+    # A client ahead of the server slows down, limited to the maximum adjustment
+    drift.correct(500, now=1)
+    assert drift.rate == 1.0 - SYNC_MAX_RATE_ADJUST
+    media_player.clock.set_rate.assert_called_with(drift.rate)
+
+    # A client that's a little behind speeds up
+    drift.correct(-20, now=2)
+    assert 1.0 < drift.rate < 1.0 + SYNC_MAX_RATE_ADJUST
+
+    # The correction continues until the drift settles well within the threshold
+    drift.correct(5, now=3)
+    assert drift.rate == 1.0
+    assert drift.correction_started is None
+    media_player.vlc['player'].set_rate.assert_called_with(1.0)
+
+
+@patch('sync.vlc_events.subscribe', MagicMock())
+def test_beacon_scheduler_triggers_on_changes():
+    """
+    Test that a beacon is triggered straight away after an item change or seek.
+    """
+    trigger = MagicMock()
+    beacons = BeaconScheduler(MagicMock(), trigger)
+    beacons.on_change(None)
+    assert trigger.call_count == 1
+
+    with patch('sync.time.monotonic', MagicMock(side_effect=[10, 10.25, 10.5])):
+        beacons.on_time_changed(MagicMock(u=MagicMock(new_time=5000)))
+        beacons.on_time_changed(MagicMock(u=MagicMock(new_time=5250)))
+        assert trigger.call_count == 1
+        # Seeking ahead
+        beacons.on_time_changed(MagicMock(u=MagicMock(new_time=60000)))
+    assert trigger.call_count == 2
@@ -1,11 +1,15 @@
 import json
 import os
+import time
 from shutil import copyfile
+from threading import Timer
 from unittest.mock import MagicMock, patch
 
 import requests
 
+from media_metadata import MediaLibrary, MediaMetadataCache
 from media_player import MediaPlayer
+from playlist_watcher import PlaylistWatcher
 
 
 def file_to_string_strip_new_lines(filename):
@@ -35,6 +39,7 @@ def mocked_requests_get(*args, **kwargs):
         def __init__(self, json_data, status_code):
             self.content = json.loads(json_data)
             self.status_code = status_code
+            self.headers = {'ETag': '"playlist-1"'}
 
         def json(self):
             return self.content
@@ -76,6 +81,21 @@ def test_download_playlist_from_xos():
     assert playlist[0]['subtitles'] == '/data/resources/sample.srt'
 
 
+def test_download_file_retries_interrupted_transfers():
+    """
+    Test that a transfer cut off mid-body is retried rather than ending the download.
+    """
+    media_player = MediaPlayer()
+    media_player.peers.fetch = MagicMock(return_value=False)
+    media_player.store.link = MagicMock()
+    media_player.downloader.download = MagicMock(
+        side_effect=[requests.exceptions.ChunkedEncodingError(), None],
+    )
+
+    assert media_player.download_file('https://xos.acmi.net.au/video.mp4') == 'video.mp4'
+    assert media_player.downloader.download.call_count == 2
+
+
 @patch('os.remove', MagicMock())
 @patch('requests.get', MagicMock(side_effect=mocked_requests_get))
 def test_delete_unneeded_resources():
@@ -133,8 +153,10 @@ def test_get_media_player_status():
     media_player.vlc['playlist'] = mock_vlc_playlist
     status = media_player.get_media_player_status()
 
+    # The playlist position is only looked up again once the list player moves on
     mock_vlc_playlist.index_of_item = MagicMock(return_value=2)
-    media_player.vlc['playlist'] = mock_vlc_playlist
+    assert media_player.get_media_player_status()['playlist_position'] == 1
+    media_player.sampler.on_next_item_set(None)
     status_two = media_player.get_media_player_status()
 
     assert 'datetime' in status
@@ -194,3 +216,151 @@ def test_empty_playlist_if_cannot_reach_xos_and_no_cache():
     media_player.download_playlist_from_xos()
 
     assert not media_player.playlist
+
+
+@patch('requests.get', MagicMock(side_effect=mocked_requests_get))
+@patch('media_player.CACHED_PLAYLIST_JSON', 'test_cached_playlist.json')
+@patch('media_player.CACHED_PLAYLIST_VALIDATORS_JSON', 'test_cached_playlist_validators.json')
+def test_conditional_playlist_fetch():
+    """
+    Test that the playlist is fetched with the cached validators and
+    that a 304 Not Modified response loads the cached playlist.
+    """
+    media_player = MediaPlayer()
+    media_player.download_playlist_from_xos()
+    with open('test_cached_playlist_validators.json', encoding='utf-8') as json_file:
+        assert json.load(json_file)['etag'] == '"playlist-1"'
+
+    not_modified = MagicMock(status_code=304)
+    with patch('requests.get', MagicMock(return_value=not_modified)) as mock_get:
+        media_player = MediaPlayer()
+        playlist_json_data, modified, _ = media_player.fetch_playlist_from_xos()
+        assert mock_get.call_args.kwargs['headers']['If-None-Match'] == '"playlist-1"'
+        assert not modified
+        assert len(playlist_json_data['playlist_labels']) == 3
+
+        media_player.download_playlist_from_xos()
+        assert len(media_player.playlist) == 3
+        assert not media_player.refresh_playlist()
+
+    # A cached playlist left unreadable is fetched again without the validators
+    with open('test_cached_playlist.json', 'w', encoding='utf-8') as cached_playlist:
+        cached_playlist.write('{"playlist_labels": [')
+    playlist = mocked_requests_get('https://xos.acmi.net.au/api/playlists/1/')
+    with patch('requests.get', MagicMock(side_effect=[not_modified, playlist])) as mock_get:
+        playlist_json_data, modified, _ = media_player.fetch_playlist_from_xos()
+        assert 'If-None-Match' not in mock_get.call_args.kwargs['headers']
+        assert modified
+        assert len(playlist_json_data['playlist_labels']) == 3
+
+    os.remove('test_cached_playlist.json')
+    os.remove('test_cached_playlist_validators.json')
+
+
+@patch('media_player.CACHED_PLAYLIST_JSON', 'test_cached_playlist.json')
+def test_load_cached_playlist():
+    """
+    Test that a cached playlist is loaded without contacting XOS when its resources are cached.
+    """
+    copyfile('tests/data/test_cached_playlist.json', 'test_cached_playlist.json')
+    with patch('requests.get', MagicMock(side_effect=AssertionError('XOS was contacted'))):
+        media_player = MediaPlayer()
+        assert media_player.load_cached_playlist()
+        assert len(media_player.playlist) == 9
+
+    os.remove('test_cached_playlist.json')
+
+
+@patch('requests.get', MagicMock(side_effect=mocked_requests_get))
+@patch('media_player.CACHED_PLAYLIST_JSON', 'test_cached_playlist.json')
+def test_progressive_playlist_loading():
+    """
+    Test that progressive loading starts playback with the first item
+    and adds the rest of the playlist in order in the background.
+    """
+    media_player = MediaPlayer()
+    media_player.vlc['list_player'] = MagicMock()
+    media_player.download_playlist_from_xos(progressive=True)
+
+    assert media_player.vlc['list_player'].play.call_count == 1
+    assert media_player.playlist
+    for _ in range(50):
+        if len(media_player.playlist) == 3:
+            break
+        time.sleep(0.1)
+    assert len(media_player.playlist) == 3
+    assert media_player.vlc['playlist'].count() == 3
+    assert media_player.playlist[0]['resource'] == '/data/resources/sample.mp4'
+
+    os.remove('test_cached_playlist.json')
+
+
+@patch('media_player.CACHED_PLAYLIST_JSON', 'test_cached_playlist.json')
+def test_playlist_hot_reload():
+    """
+    Test that a changed playlist is swapped in at the loop boundary, reusing loaded media.
+    """
+    with patch('requests.get', MagicMock(side_effect=mocked_requests_get)):
+        media_player = MediaPlayer()
+        media_player.download_playlist_from_xos()
+    assert len(media_player.playlist) == 3
+    media_player.vlc['list_player'] = MagicMock()
+    media_player.get_current_playlist_position = MagicMock(return_value=0)
+    media_player.delete_unneeded_resources = MagicMock()
+    watcher = PlaylistWatcher(media_player, interval=0)
+
+    response = MagicMock(status_code=200, headers={})
+    response.json = MagicMock(return_value=json.loads(
+        file_to_string_strip_new_lines('data/playlist-2.json')
+    ))
+    with patch('requests.get', MagicMock(return_value=response)):
+        # The playlist is swapped when it loops back to its first item
+        Timer(0.2, watcher.on_next_item_set, [None]).start()
+        assert watcher.check()
+        assert len(media_player.playlist) == 5
+        assert media_player.playlist[0]['resource'] == '/data/resources/sample-2.mp4'
+        media_player.vlc['list_player'].set_media_list.assert_called_once_with(
+            media_player.vlc['playlist']
+        )
+        media_player.vlc['list_player'].play_item_at_index.assert_called_once_with(0)
+        assert list(media_player.media_library.media) == ['/data/resources/sample-2.mp4']
+        media_player.delete_unneeded_resources.assert_called_once_with(media_player.playlist)
+
+        # The same playlist again isn't reloaded
+        assert not watcher.check()
+
+    # Synced clients swap the updated playlist in once the sync server is playing it
+    os.remove('test_cached_playlist.json')
+    watcher = PlaylistWatcher(media_player, interval=0, follow_server=True)
+    updated_playlist = ([], MagicMock(), 2)
+    media_player.playlist_version = 1
+    media_player.refresh_playlist = MagicMock(return_value=updated_playlist)
+    media_player.swap_playlist = MagicMock()
+    media_player.scheduler.trigger = MagicMock()
+    assert not watcher.check()
+    assert watcher.follow(1)
+    media_player.swap_playlist.assert_not_called()
+    assert not watcher.follow(2)
+    media_player.swap_playlist.assert_called_once_with(*updated_playlist)
+
+    # A playlist the server changed to that the client hasn't downloaded is checked for
+    assert not watcher.follow(3)
+    assert not watcher.follow(3)
+    media_player.scheduler.trigger.assert_called_once_with('playlist_refresh')
+
+
+def test_media_metadata_cache(tmp_path):
+    """
+    Test that media is only parsed once, and that unchanged files aren't parsed after a restart.
+    """
+    media_player = MediaPlayer()
+    metadata_path = str(tmp_path / 'media_metadata.json')
+    library = MediaLibrary(media_player.vlc['instance'], MediaMetadataCache(metadata_path))
+    media = library.load('/data/resources/sample.mp4')
+    assert media
+    assert library.load('/data/resources/sample.mp4') is media
+    assert library.metadata.get('/data/resources/sample.mp4')['duration'] > 0
+
+    with patch('media_metadata.parse_media', MagicMock(side_effect=AssertionError('parsed'))):
+        library = MediaLibrary(media_player.vlc['instance'], MediaMetadataCache(metadata_path))
+        assert library.load('/data/resources/sample.mp4')
@@ -0,0 +1,88 @@
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+from prometheus_client import REGISTRY
+
+from throttle import DownloadThrottle, TokenBucket, in_windows, parse_windows
+
+
+def test_token_bucket_paces_consumers():
+    """
+    Test that a bucket lets a second's worth through, then sleeps for the bytes owed.
+    """
+    bucket = TokenBucket(1000)
+    with patch('throttle.time.sleep') as sleep:
+        bucket.consume(1000)
+        sleep.assert_not_called()
+        bucket.consume(500)
+        assert 0.4 < sleep.call_args[0][0] <= 0.5
+
+    unlimited = TokenBucket()
+    with patch('throttle.time.sleep') as sleep:
+        unlimited.consume(10 ** 9)
+        sleep.assert_not_called()
+
+
+def test_unthrottled_hours_wrap_around_midnight():
+    """
+    Test that windows ending before they start wrap around midnight,
+    and invalid windows are ignored.
+    """
+    windows = parse_windows('22:00-06:00, 12:00-13:00,lunchtime')
+    assert windows == [(22 * 60, 6 * 60), (12 * 60, 13 * 60)]
+    assert in_windows(windows, datetime(2020, 1, 1, 23, 30))
+    assert in_windows(windows, datetime(2020, 1, 1, 5, 59))
+    assert in_windows(windows, datetime(2020, 1, 1, 12, 0))
+    assert not in_windows(windows, datetime(2020, 1, 1, 6, 0))
+    assert not in_windows(windows, datetime(2020, 1, 1, 13, 0))
+
+
+def test_download_throttle_backs_off_when_frames_drop():
+    """
+    Test that the rate is halved while frames are dropped during downloads,
+    and recovers once they stop.
+    """
+    media_player = MagicMock(drift=None)
+    with patch('throttle.DOWNLOAD_RATE_LIMIT', 1024), patch('throttle.DOWNLOAD_MIN_RATE', 64):
+        throttle = DownloadThrottle(media_player)
+    # Limited before the first interval
+    assert throttle.bucket.rate == 1024 * 1024
+
+    def adapt(dropped_video_frames, downloaded=1024):
+        media_player.sampler.latest = MagicMock(
+            return_value={'dropped_video_frames': dropped_video_frames},
+        )
+        throttle.received = downloaded
+        throttle.adapt()
+
+    adapt(0)
+    assert throttle.bucket.rate == 1024 * 1024
+    assert REGISTRY.get_sample_value(
+        'download_throttle_state', {'download_throttle_state': 'limited'},
+    ) == 1
+
+    adapt(10)
+    adapt(20)
+    assert throttle.bucket.rate == 256 * 1024
+    assert REGISTRY.get_sample_value(
+        'download_throttle_state', {'download_throttle_state': 'backing_off'},
+    ) == 1
+
+    # Dropped frames while nothing is downloading aren't the downloads' fault
+    adapt(30, downloaded=0)
+    assert throttle.factor > 0.25
+
+    for _ in range(10):
+        adapt(30)
+    assert throttle.bucket.rate == 1024 * 1024
+    assert throttle.chunk_size(1024 * 1024) == 256 * 1024
+
+
+def test_download_throttle_starts_unlimited_in_window():
+    """
+    Test that a throttle created during the unthrottled hours doesn't limit downloads.
+    """
+    with patch('throttle.DOWNLOAD_RATE_LIMIT', 1024), \
+            patch('throttle.DOWNLOAD_UNTHROTTLED_HOURS', '00:00-24:00'):
+        throttle = DownloadThrottle(MagicMock(drift=None))
+    assert throttle.bucket.rate == 0
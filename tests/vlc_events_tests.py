@@ -0,0 +1,41 @@
+import ctypes
+import gc
+from unittest.mock import MagicMock
+
+import vlc_events
+
+
+class EventManager:
+    """
+    A stand in for python-vlc's EventManager, which keeps the callback libvlc calls.
+    """
+
+    def __init__(self, address):
+        self._as_parameter_ = ctypes.c_void_p(address)
+        self.callbacks = {}
+
+    def event_attach(self, event_type, callback, *args):
+        self.callbacks[event_type.value] = (callback, args)
+
+    def emit(self, event_type):
+        callback, args = self.callbacks[event_type.value]
+        callback(MagicMock(type=event_type), *args)
+
+
+def test_subscribers_only_receive_their_emitters_events():
+    """
+    Test that each emitter's events only reach its own subscribers, and that the event
+    managers attached to are kept alive.
+    """
+    event_type = MagicMock(value=1)
+    player, other_player = EventManager(0x1000), EventManager(0x2000)
+    callbacks = [MagicMock(), MagicMock(), MagicMock()]
+    vlc_events.subscribe(player, event_type, callbacks[0])
+    vlc_events.subscribe(EventManager(0x1000), event_type, callbacks[1])
+    vlc_events.subscribe(other_player, event_type, callbacks[2])
+    gc.collect()
+
+    player.emit(event_type)
+    assert callbacks[0].call_count == callbacks[1].call_count == 1
+    callbacks[2].assert_not_called()
+    assert vlc_events._attached[(0x1000, 1)] is player  # pylint: disable=protected-access
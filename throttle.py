@@ -0,0 +1,199 @@
+"""
+Limits the bandwidth of background downloads so they don't starve playback and sync traffic.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+
+import status_client
+
+DOWNLOAD_RATE_LIMIT = float(os.getenv('DOWNLOAD_RATE_LIMIT', '0'))  # kilobytes per second
+DOWNLOAD_MIN_RATE = float(os.getenv('DOWNLOAD_MIN_RATE', '64'))  # kilobytes per second
+# Times of day when downloads aren't limited, e.g. '22:00-06:00,12:00-13:00'
+DOWNLOAD_UNTHROTTLED_HOURS = os.getenv('DOWNLOAD_UNTHROTTLED_HOURS', '')
+DOWNLOAD_THROTTLE_INTERVAL = float(os.getenv('DOWNLOAD_THROTTLE_INTERVAL', '2'))  # seconds
+# How much of the limit is added back each interval playback isn't struggling
+RECOVERY_STEP = 0.1
+# Smallest chunk read from a limited download, so it's paced smoothly
+MIN_CHUNK_SIZE = 64 * 1024  # bytes
+
+
+def parse_windows(windows):
+    """
+    Returns a list of (start, end) minutes of the day from windows like '22:00-06:00,12:00-13:00'.
+    """
+    parsed = []
+    for window in filter(None, (window.strip() for window in windows.split(','))):
+        try:
+            start, end = (
+                int(hours) * 60 + int(minutes)
+                for hours, minutes in (time_of_day.split(':') for time_of_day in window.split('-'))
+            )
+        except ValueError:
+            print(f'Ignoring invalid download window {window}, expected HH:MM-HH:MM')
+            continue
+        parsed.append((start, end))
+    return parsed
+
+
+def in_windows(windows, now):
+    """
+    Returns True if the datetime now falls within one of the windows,
+    which wrap around midnight if they end before they start.
+    """
+    minute = now.hour * 60 + now.minute
+    for start, end in windows:
+        if start <= minute < end or (end < start and (minute >= start or minute < end)):
+            return True
+    return False
+
+
+class TokenBucket:
+    """
+    Paces consumers to rate bytes per second between them, allowing bursts of up to
+    a second's worth. A rate of zero doesn't limit them.
+    """
+
+    def __init__(self, rate=0):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def set_rate(self, rate):
+        """
+        Change the rate, keeping any bytes already owed.
+        """
+        with self.lock:
+            self.refill()
+            self.rate = rate
+            self.tokens = min(self.tokens, rate)
+
+    def refill(self):
+        """
+        Add the tokens earned since the last refill. Called with the lock held.
+        """
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, amount):
+        """
+        Take amount bytes from the bucket, sleeping until they've been earned.
+        """
+        with self.lock:
+            if not self.rate:
+                return
+            self.refill()
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            status_client.DOWNLOAD_THROTTLE_WAIT_COUNTER.inc(wait)
+            time.sleep(wait)
+
+
+class DownloadThrottle:  # pylint: disable=too-many-instance-attributes
+    """
+    Limits downloads to DOWNLOAD_RATE_LIMIT outside the DOWNLOAD_UNTHROTTLED_HOURS, and
+    backs off while the media player is playing if frames are dropped or the sync drift
+    rises while downloading: the rate is halved each interval playback struggles, down to
+    DOWNLOAD_MIN_RATE, and recovers a step at a time once it doesn't.
+    """
+
+    def __init__(self, media_player, timezone=None):
+        self.media_player = media_player
+        self.timezone = timezone
+        self.limit = DOWNLOAD_RATE_LIMIT * 1024
+        self.min_rate = DOWNLOAD_MIN_RATE * 1024
+        self.windows = parse_windows(DOWNLOAD_UNTHROTTLED_HOURS)
+        # Limited from the start, as adapt isn't scheduled until the player is running
+        self.bucket = TokenBucket(self.current_limit())
+        # Fraction of the limit currently allowed, less than one while backing off
+        self.factor = 1.0
+        # The throughput to back off from when there's no limit
+        self.ceiling = 0
+        self.received = 0
+        self.last_adapted = time.monotonic()
+        self.last_dropped_frames = None
+        self.lock = threading.Lock()
+
+    def current_limit(self):
+        """
+        Returns the rate downloads are limited to at this time of day, or zero if they aren't.
+        """
+        if self.windows and in_windows(self.windows, datetime.now(self.timezone)):
+            return 0
+        return self.limit
+
+    def consume(self, amount):
+        """
+        Account for amount bytes downloaded, sleeping if they're over the rate.
+        """
+        with self.lock:
+            self.received += amount
+        self.bucket.consume(amount)
+
+    def chunk_size(self, default):
+        """
+        Returns the size of the chunks to read a download in, smaller while limited.
+        """
+        if not self.bucket.rate:
+            return default
+        return int(min(default, max(MIN_CHUNK_SIZE, self.bucket.rate / 4)))
+
+    def dropped_frames(self, status):
+        """
+        Returns the frames dropped since the last status, allowing for VLC's per media totals.
+        """
+        total = (status.get('dropped_video_frames') or 0) + \
+            (status.get('dropped_audio_frames') or 0)
+        last_total, self.last_dropped_frames = self.last_dropped_frames, total
+        if last_total is None:
+            return 0
+        return total - last_total if total >= last_total else total
+
+    def struggling(self):
+        """
+        Returns True if the player dropped frames or drifted out of sync since it last checked.
+        """
+        status = self.media_player.sampler.latest()
+        if 'error' in status:
+            return False
+        dropped_frames = self.dropped_frames(status)
+        # A synced client corrects drift beyond its threshold
+        drift = getattr(self.media_player, 'drift', None)
+        drifting = drift is not None and drift.correction_started is not None
+        return dropped_frames > 0 or drifting
+
+    def adapt(self):
+        """
+        Set the download rate for the time of day and how playback is coping.
+        """
+        now = time.monotonic()
+        with self.lock:
+            throughput = self.received / max(now - self.last_adapted, 0.001)
+            downloading = self.received > 0
+            self.received = 0
+        self.last_adapted = now
+
+        limit = self.current_limit()
+        if self.struggling() and downloading:
+            if self.factor == 1.0:
+                self.ceiling = limit or throughput
+            self.factor = max(self.factor / 2, self.min_rate / max(self.ceiling, self.min_rate))
+        elif self.factor < 1.0:
+            self.factor = min(1.0, self.factor + RECOVERY_STEP)
+
+        if self.factor < 1.0:
+            rate = max(self.ceiling * self.factor, self.min_rate)
+            state = 'backing_off'
+        else:
+            rate = limit
+            state = 'limited' if limit else 'unlimited'
+        if rate != self.bucket.rate:
+            self.bucket.set_rate(rate)
+        status_client.DOWNLOAD_THROTTLE_RATE_GAUGE.set(rate)
+        status_client.DOWNLOAD_THROTTLE_STATE.state(state)
@@ -0,0 +1,39 @@
+"""
+Fans VLC events out to several callbacks.
+
+python-vlc only keeps one callback per event type on each EventManager, so components
+that need the same event subscribe through here rather than attaching to it directly.
+"""
+
+import ctypes
+import threading
+
+_lock = threading.Lock()
+# Callbacks keyed by (event manager address, event type)
+_subscribers = {}
+# The event managers the dispatcher is attached to, keyed the same way. python-vlc keeps the
+# callback libvlc calls on the EventManager, which event_manager() memoizes on the player or
+# media it came from, so a reference is kept here for as long as libvlc might call it.
+_attached = {}
+
+
+def _dispatch(event, key):
+    """
+    Call every subscriber to an event manager's events of the event's type.
+    """
+    for callback in tuple(_subscribers.get(key, ())):
+        callback(event)
+
+
+def subscribe(event_manager, event_type, callback):
+    """
+    Call callback(event) for each event_type event from event_manager.
+
+    Like any VLC event callback, it mustn't call back into libvlc.
+    """
+    key = (ctypes.cast(event_manager, ctypes.c_void_p).value, event_type.value)
+    with _lock:
+        _subscribers.setdefault(key, []).append(callback)
+        if key not in _attached:
+            event_manager.event_attach(event_type, _dispatch, key)
+            _attached[key] = event_manager